@@ -0,0 +1,304 @@
+"""Benchmark each task_impls entry point against synthetic data.
+
+Each benchmark runs in a fresh process, so that its peak memory is its own,
+and reports its throughput in images/s and MB/s. The results are written as
+JSON, so that runs can be compared over time, e.g.
+
+    python benchmarks/bench_task_impls.py --n-images 20 --width 512 --height 512
+    python benchmarks/bench_task_impls.py --compare benchmark_results/<earlier run>.json
+"""
+
+import argparse
+import datetime
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import resource
+import shutil
+import statistics
+import subprocess
+import tempfile
+import time
+
+import synthetic_data
+
+MB = 1024**2
+
+
+def _sharded_bytes(filepath):
+    from kbmod_wf.utilities.tracing_utilities import get_sharded_bytes
+
+    return get_sharded_bytes(filepath)
+
+
+def bench_uri_to_ic(dataset, work_dir, args, logger):
+    """Build an ImageCollection from a URI list."""
+    from kbmod_wf.task_impls.uri_to_ic import uri_to_ic
+
+    uri_to_ic(
+        uris_filepath=dataset["uri_filepath"],
+        ic_filepath=os.path.join(work_dir, "out.collection"),
+        logger=logger,
+    )
+    return len(dataset["images"]), sum(os.path.getsize(f) for f in dataset["images"])
+
+
+def bench_ic_to_wu(dataset, work_dir, args, logger):
+    """Build a sharded WorkUnit from an ImageCollection."""
+    from kbmod_wf.task_impls.ic_to_wu import ic_to_wu
+
+    wu_filepath = os.path.join(work_dir, "out.wu")
+    ic_to_wu(ic_filepath=dataset["ic_filepath"], wu_filepath=wu_filepath, logger=logger)
+    return len(dataset["images"]), _sharded_bytes(wu_filepath)
+
+
+def bench_reproject_multi_night_wu(dataset, work_dir, args, logger):
+    """Reproject an ImageCollection's images to a single guess distance."""
+    from kbmod_wf.task_impls.reproject_multi_chip_multi_night_wu import reproject_wu
+
+    wu_filepath = os.path.join(work_dir, "out.wu")
+    reproject_wu(
+        guess_dist=40.0,
+        ic_filepath=dataset["ic_filepath"],
+        reprojected_wu_filepath=wu_filepath,
+        runtime_config={"n_workers": args.n_workers},
+        logger=logger,
+    )
+    return len(dataset["images"]), _sharded_bytes(wu_filepath)
+
+
+def bench_reproject_wu_from_uris(dataset, work_dir, args, logger):
+    """Reproject a WorkUnit to the patch of a URI list."""
+    from kbmod_wf.task_impls.reproject_multi_chip_multi_night_from_uris import reproject_wu
+
+    wu_filepath = os.path.join(work_dir, "out.wu")
+    reproject_wu(
+        original_wu_filepath=dataset["wu_filepath"],
+        uri_filepath=dataset["uri_filepath"],
+        reprojected_wu_filepath=wu_filepath,
+        runtime_config={"n_workers": args.n_workers, "overwrite": True},
+        logger=logger,
+    )
+    return len(dataset["images"]), _sharded_bytes(wu_filepath)
+
+
+def bench_reproject_single_chip_wu(dataset, work_dir, args, logger):
+    """Reproject a single chip WorkUnit to its own WCS."""
+    from kbmod_wf.task_impls.reproject_single_chip_single_night_wu import reproject_wu
+
+    wu_filepath = os.path.join(work_dir, "out.wu")
+    reproject_wu(
+        original_wu_filepath=dataset["wu_filepath"],
+        reprojected_wu_filepath=wu_filepath,
+        runtime_config={"n_workers": args.n_workers},
+        logger=logger,
+    )
+    return len(dataset["images"]), _sharded_bytes(wu_filepath)
+
+
+def bench_kbmod_search_io(dataset, work_dir, args, logger):
+    """The parts of KBMODSearcher that don't need a GPU: loading and configuring
+    the WorkUnit, and writing the results."""
+    from kbmod.results import Results
+    from kbmod.search import Trajectory
+
+    from kbmod_wf.task_impls.kbmod_search import KBMODSearcher
+
+    searcher = KBMODSearcher(
+        wu_filepath=dataset["wu_filepath"],
+        result_filepath=os.path.join(work_dir, "out.search.parquet"),
+        logger=logger,
+    )
+    wu = searcher.load_work_unit()
+    searcher.configure_work_unit(wu)
+    results = Results.from_trajectories(
+        [
+            Trajectory(x=i % 100, y=i // 100, vx=1.0, vy=-1.0, flux=10.0, lh=10.0, obs_count=len(wu))
+            for i in range(args.n_results)
+        ]
+    )
+    searcher.write_results(results)
+    return len(wu), _sharded_bytes(dataset["wu_filepath"]) + os.path.getsize(searcher.result_filepath)
+
+
+BENCHMARKS = {
+    "uri_to_ic": bench_uri_to_ic,
+    "ic_to_wu": bench_ic_to_wu,
+    "reproject_multi_night_wu": bench_reproject_multi_night_wu,
+    "reproject_wu_from_uris": bench_reproject_wu_from_uris,
+    "reproject_single_chip_wu": bench_reproject_single_chip_wu,
+    "kbmod_search_io": bench_kbmod_search_io,
+}
+
+
+def _peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux. The reprojections fan out to worker processes.
+    peak = max(
+        resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+    )
+    return peak * 1024
+
+
+def _run_once(name, dataset, args, result_queue):
+    """Run a single benchmark, in its own process."""
+    synthetic_data.install_stub_butler()
+    logger = logging.getLogger("benchmark")
+    logger.setLevel(logging.WARNING)
+
+    work_dir = tempfile.mkdtemp(dir=args.work_directory, prefix=f"{name}_")
+    try:
+        start = time.perf_counter()
+        n_images, n_bytes = BENCHMARKS[name](dataset, work_dir, args, logger)
+        seconds = time.perf_counter() - start
+        result_queue.put(
+            {"seconds": seconds, "n_images": n_images, "bytes": n_bytes, "peak_rss": _peak_rss_bytes()}
+        )
+    except Exception as e:
+        result_queue.put({"error": f"{type(e).__name__}: {e}"})
+    finally:
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+
+def run_benchmark(name, dataset, args):
+    """Run a benchmark ``args.repeat`` times, and summarize its throughput and peak memory."""
+    context = multiprocessing.get_context("spawn")
+    runs = []
+    for _ in range(args.repeat):
+        result_queue = context.Queue()
+        process = context.Process(target=_run_once, args=(name, dataset, args, result_queue))
+        process.start()
+        run = result_queue.get()
+        process.join()
+        if "error" in run:
+            return {"name": name, "error": run["error"]}
+        runs.append(run)
+
+    seconds = [run["seconds"] for run in runs]
+    best = min(seconds)
+    return {
+        "name": name,
+        "n_images": runs[0]["n_images"],
+        "bytes": runs[0]["bytes"],
+        "seconds": seconds,
+        "best_seconds": best,
+        "median_seconds": statistics.median(seconds),
+        "images_per_second": runs[0]["n_images"] / best,
+        "mb_per_second": runs[0]["bytes"] / MB / best,
+        "peak_rss_mb": max(run["peak_rss"] for run in runs) / MB,
+    }
+
+
+def _environment():
+    versions = {}
+    for package in ("kbmod", "astropy", "numpy", "reproject", "parsl"):
+        try:
+            versions[package] = __import__(package).__version__
+        except Exception:
+            versions[package] = None
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            capture_output=True,
+            text=True,
+            check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        commit = None
+    return {
+        "host": platform.node(),
+        "platform": platform.platform(),
+        "python": platform.python_version(),
+        "cpu_count": os.cpu_count(),
+        "commit": commit,
+        "versions": versions,
+    }
+
+
+def _format_results(results, previous=None):
+    previous = {r["name"]: r for r in (previous or {}).get("results", []) if "error" not in r}
+    lines = [f"{'benchmark':<26} {'best [s]':>9} {'images/s':>9} {'MB/s':>8} {'peak MB':>8} {'vs prev':>8}"]
+    for r in results:
+        if "error" in r:
+            lines.append(f"{r['name']:<26} failed: {r['error']}")
+            continue
+        change = ""
+        if r["name"] in previous:
+            change = f"{previous[r['name']]['best_seconds'] / r['best_seconds']:.2f}x"
+        lines.append(
+            f"{r['name']:<26} {r['best_seconds']:>9.2f} {r['images_per_second']:>9.2f} "
+            f"{r['mb_per_second']:>8.1f} {r['peak_rss_mb']:>8.0f} {change:>8}"
+        )
+    return "\n".join(lines)
+
+
+def main():
+    """Run the task_impls benchmarks from the command line."""
+    parser = argparse.ArgumentParser(description="Benchmark the task_impls against synthetic data.")
+    parser.add_argument("--n-images", type=int, default=10, help="Number of synthetic images.")
+    parser.add_argument("--width", type=int, default=512, help="Width of the synthetic images in pixels.")
+    parser.add_argument("--height", type=int, default=512, help="Height of the synthetic images in pixels.")
+    parser.add_argument("--n-nights", type=int, default=2, help="Number of nights the images span.")
+    parser.add_argument("--n-workers", type=int, default=1, help="n_workers passed to the reprojections.")
+    parser.add_argument("--n-results", type=int, default=1000, help="Number of synthetic search results.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times each benchmark is run.")
+    parser.add_argument(
+        "--only", nargs="+", choices=sorted(BENCHMARKS), help="Only run these benchmarks, by default all."
+    )
+    parser.add_argument("--work-directory", type=str, help="Where the synthetic data is written.")
+    parser.add_argument(
+        "--output", type=str, help="The results JSON, by default benchmark_results/<time>.json"
+    )
+    parser.add_argument("--compare", type=str, help="A previous results JSON to compare against.")
+    args = parser.parse_args()
+
+    timestamp = datetime.datetime.now(datetime.UTC).strftime("%Y%m%dT%H%M%SZ")
+    output_filepath = args.output or os.path.join("benchmark_results", f"{timestamp}.json")
+    cleanup_work_directory = args.work_directory is None
+    args.work_directory = args.work_directory or tempfile.mkdtemp(prefix="kbmod_wf_bench_")
+
+    try:
+        print(f"Generating {args.n_images} {args.width}x{args.height} images in {args.work_directory}")
+        dataset = synthetic_data.make_dataset(
+            os.path.join(args.work_directory, "data"), args.n_images, args.width, args.height, args.n_nights
+        )
+
+        results = []
+        for name in args.only or BENCHMARKS:
+            print(f"Running {name}")
+            results.append(run_benchmark(name, dataset, args))
+    finally:
+        if cleanup_work_directory:
+            shutil.rmtree(args.work_directory, ignore_errors=True)
+
+    report = {
+        "timestamp": timestamp,
+        "parameters": {
+            "n_images": args.n_images,
+            "width": args.width,
+            "height": args.height,
+            "n_nights": args.n_nights,
+            "n_workers": args.n_workers,
+            "n_results": args.n_results,
+            "repeat": args.repeat,
+        },
+        "environment": _environment(),
+        "results": results,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(output_filepath)), exist_ok=True)
+    with open(output_filepath, "w") as f:
+        json.dump(report, f, indent=2)
+
+    previous = None
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            previous = json.load(f)
+    print(_format_results(results, previous))
+    print(f"Results written to {output_filepath}")
+
+
+if __name__ == "__main__":
+    main()
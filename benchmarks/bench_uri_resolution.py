@@ -0,0 +1,129 @@
+"""Benchmark checking that the files of a URI list exist, as uri_to_ic does,
+against a synthetic tree of visit directories.
+
+The previous approach globbed each file in turn, `resolve_uris` lists each
+directory once from a pool of threads. A local disk answers metadata requests
+from its cache, ``--latency-ms`` adds a delay to every listing and stat to
+emulate the round-trip to the metadata servers of a parallel filesystem, e.g.
+
+    python benchmarks/bench_uri_resolution.py --n-directories 500 --n-files 4 --latency-ms 2
+"""
+
+import argparse
+import glob
+import os
+import shutil
+import statistics
+import tempfile
+import time
+from contextlib import contextmanager
+
+import synthetic_data
+
+
+def read_uris(uri_filepath):
+    """Return the URIs of a URI file, without its comments."""
+    with open(uri_filepath, "r") as f:
+        return [line.strip() for line in f if line.strip() and not line.startswith("#")]
+
+
+def glob_each_uri(uris):
+    """The previous approach, a glob of every file in turn."""
+    from kbmod_wf.utilities.uri_utilities import clean_uri
+
+    missing = []
+    for uri in uris:
+        filepath = clean_uri(uri)
+        if len(glob.glob(filepath)) == 0:
+            missing.append(filepath)
+    return missing
+
+
+def resolve(uris, n_threads):
+    """The current approach, see `kbmod_wf.utilities.uri_utilities.resolve_uris`."""
+    from kbmod_wf.utilities.uri_utilities import resolve_uris
+
+    _, missing = resolve_uris(uris, n_threads=n_threads)
+    return missing
+
+
+@contextmanager
+def metadata_latency(seconds):
+    """Delay every directory listing and stat, as a parallel filesystem would."""
+    if seconds <= 0:
+        yield
+        return
+
+    originals = {name: getattr(os, name) for name in ("scandir", "stat", "lstat")}
+
+    def delayed(function):
+        def wrapper(*args, **kwargs):
+            time.sleep(seconds)
+            return function(*args, **kwargs)
+
+        return wrapper
+
+    for name, function in originals.items():
+        setattr(os, name, delayed(function))
+    try:
+        yield
+    finally:
+        for name, function in originals.items():
+            setattr(os, name, function)
+
+
+def main():
+    """Run the URI resolution benchmark from the command line."""
+    parser = argparse.ArgumentParser(
+        description="Benchmark URI resolution against a synthetic directory tree."
+    )
+    parser.add_argument("--n-directories", type=int, default=200, help="Number of visit directories.")
+    parser.add_argument("--n-files", type=int, default=4, help="Number of listed files per directory.")
+    parser.add_argument(
+        "--n-other-files", type=int, default=20, help="Number of unlisted files per directory."
+    )
+    parser.add_argument("--n-missing", type=int, default=0, help="Number of listed files to remove.")
+    parser.add_argument("--n-threads", type=int, default=16, help="Threads used by resolve_uris.")
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="Delay added to every metadata call.")
+    parser.add_argument("--repeat", type=int, default=3, help="Number of times each approach is run.")
+    parser.add_argument(
+        "--work-directory", type=str, help="Where the tree is written, by default a temp dir."
+    )
+    args = parser.parse_args()
+
+    work_directory = tempfile.mkdtemp(prefix="kbmod_wf_bench_uris_", dir=args.work_directory)
+    try:
+        uri_filepath = synthetic_data.make_uri_tree(
+            work_directory, args.n_directories, args.n_files, args.n_other_files
+        )
+        uris = read_uris(uri_filepath)
+        from kbmod_wf.utilities.uri_utilities import clean_uri
+
+        for uri in uris[: args.n_missing]:
+            os.remove(clean_uri(uri))
+        print(f"{len(uris)} URIs in {args.n_directories} directories, {args.n_missing} missing")
+
+        approaches = {
+            "glob each file": glob_each_uri,
+            "resolve_uris, 1 thread": lambda uris: resolve(uris, 1),
+            f"resolve_uris, {args.n_threads} threads": lambda uris: resolve(uris, args.n_threads),
+        }
+        print(f"{'approach':<28} {'best [s]':>9} {'median [s]':>11} {'URIs/s':>10} {'missing':>8}")
+        for name, approach in approaches.items():
+            seconds = []
+            for _ in range(args.repeat):
+                with metadata_latency(args.latency_ms / 1000):
+                    start = time.perf_counter()
+                    missing = approach(uris)
+                    seconds.append(time.perf_counter() - start)
+            best = min(seconds)
+            print(
+                f"{name:<28} {best:>9.3f} {statistics.median(seconds):>11.3f} "
+                f"{len(uris) / best:>10.0f} {len(missing):>8}"
+            )
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+"""Generate synthetic inputs for the task_impls benchmarks: FITS images, URI
+lists, ImageCollections and sharded WorkUnits of a configurable size."""
+
+import os
+from types import SimpleNamespace
+
+import numpy as np
+from astropy.io import fits
+from astropy.time import Time
+from astropy.wcs import WCS
+
+PIXEL_SCALE = 0.263
+"""Pixel scale of the synthetic images in arcsec/pixel, matching DECam."""
+
+FIELD_CENTER = (216.5, -13.5)
+"""RA, Dec in degrees that the synthetic images are centered on."""
+
+
+def make_wcs(width, height, center=FIELD_CENTER, pixel_scale=PIXEL_SCALE):
+    """Return a TAN WCS for an image of the given size, centered on ``center``."""
+    wcs = WCS(naxis=2)
+    wcs.wcs.crpix = [width / 2, height / 2]
+    wcs.wcs.crval = list(center)
+    wcs.wcs.cdelt = [-pixel_scale / 3600, pixel_scale / 3600]
+    wcs.wcs.ctype = ["RA---TAN", "DEC--TAN"]
+    wcs.array_shape = (height, width)
+    return wcs
+
+
+def write_fits_image(filepath, width, height, mjd, wcs, rng):
+    """Write a difference image with science, mask and variance extensions, as
+    read by kbmod's FITS standardizers.
+
+    Parameters
+    ----------
+    filepath : str
+        The FITS file.
+    width : int
+        The width of the image in pixels.
+    height : int
+        The height of the image in pixels.
+    mjd : float
+        The observation time of the image.
+    wcs : astropy.wcs.WCS
+        The WCS of the image.
+    rng : numpy.random.Generator
+        Used to generate the pixels.
+    """
+    primary = fits.PrimaryHDU()
+    primary.header["DATE-AVG"] = Time(mjd, format="mjd").isot
+    primary.header["MJD-OBS"] = mjd
+    primary.header["EXPTIME"] = 120.0
+    primary.header["FILTER"] = "VR"
+    primary.header["OBSID"] = os.path.splitext(os.path.basename(filepath))[0]
+
+    wcs_header = wcs.to_header()
+    science = rng.normal(0.0, 1.0, size=(height, width)).astype(np.float32)
+    hdus = [
+        primary,
+        fits.ImageHDU(science, header=wcs_header, name="IMAGE"),
+        fits.ImageHDU(np.zeros((height, width), dtype=np.int32), header=wcs_header, name="MASK"),
+        fits.ImageHDU(np.ones((height, width), dtype=np.float32), header=wcs_header, name="VARIANCE"),
+    ]
+    fits.HDUList(hdus).writeto(filepath, overwrite=True)
+
+
+def make_images(directory, n_images, width, height, n_nights=1, seed=0):
+    """Write ``n_images`` synthetic images, spread over ``n_nights`` nights and
+    dithered by a few pixels.
+
+    Returns
+    -------
+    list[str]
+        The image filepaths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    start_mjd = 58600.0
+    per_night = max(1, int(np.ceil(n_images / n_nights)))
+
+    filepaths = []
+    for i in range(n_images):
+        night, exposure = divmod(i, per_night)
+        mjd = start_mjd + night + exposure * 150.0 / 86400.0
+        dither = rng.uniform(-5, 5, size=2) * PIXEL_SCALE / 3600
+        wcs = make_wcs(width, height, center=(FIELD_CENTER[0] + dither[0], FIELD_CENTER[1] + dither[1]))
+        filepath = os.path.join(directory, f"diffexp_{i:05d}.fits")
+        write_fits_image(filepath, width, height, mjd, wcs, rng)
+        filepaths.append(filepath)
+    return filepaths
+
+
+def patch_box(width, height, center=FIELD_CENTER, pixel_scale=PIXEL_SCALE):
+    """Return the corners of a patch covering a width x height image, as written in URI files."""
+    half_ra = width * pixel_scale / 3600 / 2
+    half_dec = height * pixel_scale / 3600 / 2
+    ra, dec = center
+    return [
+        [ra - half_ra, dec - half_dec],
+        [ra - half_ra, dec + half_dec],
+        [ra + half_ra, dec + half_dec],
+        [ra + half_ra, dec - half_dec],
+        [ra - half_ra, dec - half_dec],
+    ]
+
+
+def write_uri_file(filepath, image_filepaths, width, height, guess_dist=40.0):
+    """Write a URI list, with the patch metadata comments that the reprojection reads."""
+    patch_size = [width * PIXEL_SCALE / 60, height * PIXEL_SCALE / 60]
+    with open(filepath, "w") as f:
+        f.write(f"#dist_au={guess_dist}\n")
+        f.write(f"#patch_size={patch_size}\n")
+        f.write(f"#pixel_scale={PIXEL_SCALE}\n")
+        f.write(f"#patch_box={patch_box(width, height)}\n")
+        for image_filepath in image_filepaths:
+            f.write(f"file://{image_filepath}\n")
+    return filepath
+
+
+def make_uri_tree(directory, n_directories, n_files, n_other_files=0):
+    """Write empty files in a tree of ``night/visit`` directories, like the
+    difference images of a Butler repository, and a URI list of them.
+
+    Parameters
+    ----------
+    directory : str
+        The root of the tree.
+    n_directories : int
+        The number of visit directories.
+    n_files : int
+        The number of listed files in each visit directory.
+    n_other_files : int, optional
+        The number of files in each visit directory that aren't listed, by default 0
+
+    Returns
+    -------
+    str
+        The URI list, ``<directory>/images.uris``.
+    """
+    uris = []
+    for i in range(n_directories):
+        visit_directory = os.path.join(directory, f"night_{i % 10:02d}", f"visit_{i:06d}")
+        os.makedirs(visit_directory, exist_ok=True)
+        for j in range(n_files + n_other_files):
+            filepath = os.path.join(visit_directory, f"differenceExp_{i:06d}_S{j:02d}_step6.fits")
+            open(filepath, "w").close()
+            if j < n_files:
+                uris.append("file://" + filepath.replace("#", "%23"))
+
+    uri_filepath = os.path.join(directory, "images.uris")
+    with open(uri_filepath, "w") as f:
+        f.write("\n".join(uris) + "\n")
+    return uri_filepath
+
+
+def write_image_collection(ic_filepath, image_filepaths, width, height, guess_dist=40.0):
+    """Write an ImageCollection of the images, with the global WCS columns that
+    the multi-night reprojection reads."""
+    from kbmod import ImageCollection
+
+    ic = ImageCollection.fromTargets(image_filepaths)
+    global_wcs = make_wcs(width, height)
+    ic.data["global_wcs"] = [global_wcs.to_header_string()] * len(ic)
+    ic.data["global_wcs_pixel_shape_0"] = [width] * len(ic)
+    ic.data["global_wcs_pixel_shape_1"] = [height] * len(ic)
+    ic.data["helio_guess_dist"] = [guess_dist] * len(ic)
+    ic.write(ic_filepath, format="ascii.ecsv", overwrite=True)
+    return ic_filepath
+
+
+class StubButler:
+    """Stands in for a Butler, the synthetic images are read from disk without one."""
+
+    def __init__(self):
+        self.registry = SimpleNamespace(refresh=lambda: None)
+
+
+def install_stub_butler():
+    """Make every task in this process use a `StubButler`."""
+    from kbmod_wf.utilities import butler_utilities
+
+    butler_utilities._POOL = butler_utilities.ButlerPool(
+        factory=lambda repo, collections: StubButler(), health_check=lambda butler: None
+    )
+
+
+def make_dataset(directory, n_images, width, height, n_nights=1, seed=0):
+    """Write every synthetic input of the benchmarks.
+
+    Returns
+    -------
+    dict
+        The filepaths of the ``images``, the ``uri_filepath``, the ``ic_filepath``
+        and the sharded ``wu_filepath``.
+    """
+    import logging
+
+    from kbmod_wf.task_impls.ic_to_wu import ic_to_wu
+
+    image_filepaths = make_images(
+        os.path.join(directory, "images"), n_images, width, height, n_nights=n_nights, seed=seed
+    )
+    uri_filepath = write_uri_file(os.path.join(directory, "images.uris"), image_filepaths, width, height)
+    ic_filepath = write_image_collection(
+        os.path.join(directory, "images.collection"), image_filepaths, width, height
+    )
+
+    install_stub_butler()
+    wu_filepath = os.path.join(directory, "wu", "images.wu")
+    os.makedirs(os.path.dirname(wu_filepath), exist_ok=True)
+    ic_to_wu(ic_filepath=ic_filepath, wu_filepath=wu_filepath, logger=logging.getLogger("benchmark"))
+
+    return {
+        "images": image_filepaths,
+        "uri_filepath": uri_filepath,
+        "ic_filepath": ic_filepath,
+        "wu_filepath": wu_filepath,
+    }
@@ -1 +1,11 @@
-from .workflow import workflow_runner
+__all__ = ["workflow_runner"]
+
+
+def __getattr__(name):
+    # The workflow is only imported when it is used, so that importing kbmod_wf,
+    # e.g. for its utilities, doesn't import parsl.
+    if name == "workflow_runner":
+        from .workflow import workflow_runner
+
+        return workflow_runner
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
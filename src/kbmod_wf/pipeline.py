@@ -0,0 +1,1100 @@
+"""A small engine that runs a workflow declared as a graph of stages.
+
+Every workflow in kbmod_wf follows the same pattern: a manifest of staged files
+is created, and each manifest entry is pushed through a chain of python_apps
+(e.g. ic_to_wu -> reproject_wu -> kbmod_search). Rather than hand rolling that
+loop in every workflow, a workflow is declared as a list of stages, either in
+code or in the ``[workflow]`` section of the runtime configuration TOML::
+
+    [[workflow.stages]]
+    name = "reproject_wu"
+    app = "reproject_multi_night_wu"
+    executors = ["sharded_reproject"]
+    max_in_flight = 8
+    fan_out = "helio_guess_dists"
+    inputs = ["upstream", "fan_out"]
+    output = "{upstream}.wu.{fan_out}.repro"
+
+    [[workflow.stages]]
+    name = "kbmod_search"
+    app = "kbmod_search"
+    executors = ["gpu"]
+    output = "{upstream}.search.parquet"
+
+Each stage consumes the output of its ``upstream`` stage (by default the stage
+listed before it, or the manifest entry for the first stage). The runtime
+configuration passed to the app is read from ``[apps.<name>]``.
+"""
+
+import copy
+import os
+import threading
+from collections import deque
+from concurrent.futures import Future
+from functools import partial
+
+from kbmod_wf.utilities.future_utilities import wait_for_futures
+
+__all__ = ["Stage", "StageGraph", "PlannedTask", "Pipeline", "MANIFEST", "main", "run_workflow"]
+
+
+MANIFEST = "manifest"
+"""Name of the pseudo-stage that yields the manifest entries."""
+
+VALID_INPUTS = ("upstream", "source", "fan_out")
+"""The tokens that can be used to build the `inputs` of a stage's app."""
+
+
+class Stage:
+    """The declaration of a single stage of a workflow.
+
+    Parameters
+    ----------
+    name : str
+        The name of the stage. Also used as the key into the ``apps`` section of
+        the runtime configuration.
+    app : str, optional
+        The name of the python_app in `kbmod_wf.workflow_tasks` that implements
+        this stage, by default the same as ``name``.
+    upstream : str, optional
+        The name of the stage whose outputs this stage consumes. `MANIFEST` is
+        used for the stage that consumes the manifest entries. By default None,
+        meaning the previously declared stage.
+    executors : list[str], optional
+        Executor labels this stage may run on, by default None which keeps the
+        executors that the app was declared with.
+    max_in_flight : int, optional
+        The maximum number of tasks of this stage that may be submitted to the
+        DFK but not yet completed, by default None (unlimited).
+    fan_out : str | list, optional
+        Submit one task per value for each upstream output. A string is the
+        name of a list in the stage's runtime configuration, e.g.
+        "helio_guess_dists", while a list is used as the values directly. By
+        default None, one task per upstream output.
+    group_fan_out : bool, optional
+        Submit a single task for all of the fan out values of an upstream
+        output, that writes one output per value. The app receives the list of
+        values in place of the fan out value, and downstream stages still run
+        one task per output. By default False.
+    inputs : list[str], optional
+        The items passed to the app in ``inputs``, in order. Any of "upstream"
+        (the upstream output), "source" (the original manifest entry) and
+        "fan_out" (the fan out value), by default ["upstream"].
+    output : str, optional
+        Template for the output filepath. May reference ``{upstream}``,
+        ``{source}`` and ``{fan_out}``, by default "{upstream}".
+    fuse : bool, optional
+        Run this stage in the same task as its upstream stage, on this stage's
+        executors, passing the WorkUnit between them in memory instead of
+        writing the upstream output. The upstream output is still written if
+        its stage's runtime configuration sets ``keep_intermediate = true``.
+        By default False.
+    cleanup : bool, optional
+        Delete each output of this stage, and its WorkUnit shards, once every
+        downstream task that consumes it has succeeded. By default False.
+    """
+
+    def __init__(
+        self,
+        name,
+        app=None,
+        upstream=None,
+        executors=None,
+        max_in_flight=None,
+        fan_out=None,
+        inputs=("upstream",),
+        output="{upstream}",
+        fuse=False,
+        group_fan_out=False,
+        cleanup=False,
+    ):
+        self.name = name
+        self.app = app if app is not None else name
+        self.upstream = upstream
+        self.executors = list(executors) if executors is not None else None
+        self.max_in_flight = max_in_flight
+        self.fan_out = fan_out
+        self.inputs = list(inputs)
+        self.output = output
+        self.fuse = fuse
+        self.group_fan_out = group_fan_out
+        self.cleanup = cleanup
+
+        for item in self.inputs:
+            if item not in VALID_INPUTS:
+                raise ValueError(
+                    f"Stage {self.name} has unknown input '{item}', must be one of {VALID_INPUTS}"
+                )
+
+        if self.max_in_flight is not None and self.max_in_flight < 1:
+            raise ValueError(f"Stage {self.name} must have max_in_flight >= 1, got {self.max_in_flight}")
+
+    @classmethod
+    def from_dict(cls, stage_config):
+        """Create a Stage from a dictionary, i.e. one ``[[workflow.stages]]`` table.
+
+        Parameters
+        ----------
+        stage_config : dict
+            The stage declaration.
+
+        Returns
+        -------
+        Stage
+            The stage.
+        """
+        stage_config = dict(stage_config)
+        if "name" not in stage_config:
+            raise ValueError(f"Every workflow stage requires a name: {stage_config}")
+        return cls(**stage_config)
+
+    def fan_out_values(self, runtime_config):
+        """Return the values this stage fans out over.
+
+        Parameters
+        ----------
+        runtime_config : dict
+            The runtime configuration for this stage.
+
+        Returns
+        -------
+        list
+            The fan out values, or [None] if the stage does not fan out.
+
+        Raises
+        ------
+        ValueError
+            If the fan out key is not present in the stage's runtime configuration.
+        """
+        if self.fan_out is None:
+            return [None]
+        if isinstance(self.fan_out, str):
+            if self.fan_out not in runtime_config:
+                raise ValueError(
+                    f"No '{self.fan_out}' were provided in the runtime config for stage {self.name}."
+                )
+            return list(runtime_config[self.fan_out])
+        return list(self.fan_out)
+
+
+class PlannedTask:
+    """A single task of a workflow, expanded from the stage graph but not yet submitted.
+
+    Parameters
+    ----------
+    stage : Stage
+        The stage the task belongs to.
+    source_filepath : str
+        The manifest entry the task was expanded from.
+    output_filepath : str
+        The filepath of the task's output.
+    fan_out : object, optional
+        The fan out value of the task, by default None
+    upstream : PlannedTask, optional
+        The task whose output this task consumes, by default None, meaning the
+        manifest entry itself.
+    group : list[PlannedTask], optional
+        For a stage with ``group_fan_out``, the tasks for every fan out value of
+        the same upstream output, which are submitted as one. By default None
+    """
+
+    def __init__(self, stage, source_filepath, output_filepath, fan_out=None, upstream=None, group=None):
+        self.stage = stage
+        self.source_filepath = source_filepath
+        self.output_filepath = output_filepath
+        self.fan_out = fan_out
+        self.upstream = upstream
+        self.group = group
+
+
+class StageGraph:
+    """The validated graph of stages for a workflow.
+
+    Parameters
+    ----------
+    stages : list[Stage]
+        The stages of the workflow. A stage must be declared after its upstream.
+    app_configs : dict, optional
+        The ``apps`` section of the runtime configuration, by default None
+    """
+
+    def __init__(self, stages, app_configs=None):
+        self.stages = list(stages)
+        self.app_configs = app_configs if app_configs is not None else {}
+
+        self._validate_graph()
+
+        self.downstream = {stage.name: [] for stage in self.stages}
+        for stage in self.stages:
+            if stage.upstream != MANIFEST:
+                self.downstream[stage.upstream].append(stage.name)
+
+        for stage in self.stages:
+            if not stage.fuse:
+                continue
+            if stage.group_fan_out or (
+                stage.upstream != MANIFEST and self.stage(stage.upstream).group_fan_out
+            ):
+                raise ValueError(f"Workflow stage {stage.name} can not both be fused and group its fan out.")
+            if stage.upstream == MANIFEST:
+                raise ValueError(f"Workflow stage {stage.name} has no upstream stage to be fused with.")
+            if len(self.downstream[stage.upstream]) > 1:
+                raise ValueError(
+                    f"Workflow stage {stage.name} can not be fused with {stage.upstream}, "
+                    f"because its output is also used by {self.downstream[stage.upstream]}."
+                )
+
+        for stage in self.stages:
+            if not stage.cleanup:
+                continue
+            if self.is_leaf(stage):
+                raise ValueError(
+                    f"Workflow stage {stage.name} can not clean up its outputs, "
+                    "they are the results of the workflow."
+                )
+            if self.is_fused_downstream(stage):
+                raise ValueError(
+                    f"Workflow stage {stage.name} can not clean up its outputs, "
+                    f"it runs in the same task as {self.downstream[stage.name][0]}."
+                )
+
+    @classmethod
+    def from_config(cls, runtime_config, default_stages=()):
+        """Create a StageGraph from the runtime configuration.
+
+        Parameters
+        ----------
+        runtime_config : dict
+            The complete runtime configuration. If it has a ``[workflow]`` section
+            with ``stages`` those are used, otherwise ``default_stages`` are.
+        default_stages : list[dict], optional
+            The stage declarations to use when the runtime configuration has none,
+            by default ()
+
+        Returns
+        -------
+        StageGraph
+            The stage graph.
+        """
+        stage_configs = runtime_config.get("workflow", {}).get("stages", default_stages)
+        stages = [Stage.from_dict(s) for s in stage_configs]
+        return cls(stages, app_configs=runtime_config.get("apps", {}))
+
+    def _validate_graph(self):
+        if len(self.stages) == 0:
+            raise ValueError("A workflow requires at least one stage.")
+
+        seen = set()
+        for i, stage in enumerate(self.stages):
+            if stage.name in seen:
+                raise ValueError(f"Workflow stage {stage.name} is declared more than once.")
+            if stage.upstream is None:
+                stage.upstream = MANIFEST if i == 0 else self.stages[i - 1].name
+            if stage.upstream != MANIFEST and stage.upstream not in seen:
+                raise ValueError(
+                    f"Workflow stage {stage.name} must be declared after its upstream stage {stage.upstream}."
+                )
+            seen.add(stage.name)
+
+    def stage_config(self, stage):
+        """Return the runtime configuration passed to the app for a stage."""
+        # The profile option is passed separately, so that it doesn't change the memoization hash.
+        return {k: v for k, v in self.app_configs.get(stage.name, {}).items() if k != "profile"}
+
+    def profile_config(self, stage):
+        """Return the ``profile`` option of a stage, see `kbmod_wf.utilities.profiling_utilities`."""
+        return self.app_configs.get(stage.name, {}).get("profile")
+
+    def validate(self):
+        """Check that every stage can expand its fan out, before anything is submitted."""
+        for stage in self.stages:
+            values = stage.fan_out_values(self.stage_config(stage))
+            # Each fused task would repeat all of the upstream work.
+            if stage.fuse and len(values) > 1:
+                raise ValueError(
+                    f"Workflow stage {stage.name} can not be fused with {stage.upstream}, "
+                    f"because it fans out over {len(values)} values."
+                )
+
+    def is_leaf(self, stage):
+        """Return True if no other stage consumes the outputs of this stage."""
+        return len(self.downstream[stage.name]) == 0
+
+    def is_fused_downstream(self, stage):
+        """Return True if this stage runs in the same task as its downstream stage."""
+        downstream = self.downstream[stage.name]
+        return len(downstream) == 1 and self.stage(downstream[0]).fuse
+
+    def stage(self, name):
+        """Return the stage with the given name."""
+        for stage in self.stages:
+            if stage.name == name:
+                return stage
+        raise KeyError(f"No workflow stage named {name}.")
+
+    def expand(self, source_filepath):
+        """Expand every task of the workflow for a single manifest entry.
+
+        Parameters
+        ----------
+        source_filepath : str
+            The filepath of the manifest entry.
+
+        Yields
+        ------
+        PlannedTask
+            The tasks, each one after the task whose output it consumes. The
+            tasks for every fan out value of an upstream output are yielded
+            together.
+        """
+        yield from self._expand_downstream(MANIFEST, None, source_filepath, source_filepath)
+
+    def _expand_downstream(self, stage_name, upstream, upstream_filepath, source_filepath):
+        for stage in self.stages:
+            if stage.upstream != stage_name:
+                continue
+
+            tasks = []
+            for value in stage.fan_out_values(self.stage_config(stage)):
+                output_filepath = stage.output.format(
+                    upstream=upstream_filepath, source=source_filepath, fan_out=value
+                )
+                tasks.append(
+                    PlannedTask(stage, source_filepath, output_filepath, fan_out=value, upstream=upstream)
+                )
+
+            if stage.group_fan_out:
+                for task in tasks:
+                    task.group = tasks
+
+            yield from tasks
+            for task in tasks:
+                yield from self._expand_downstream(stage.name, task, task.output_filepath, source_filepath)
+
+
+class _StageThrottle:
+    """Launches the tasks of a stage with a ``max_in_flight`` limit, at most that
+    many at a time, in the order their inputs become ready.
+
+    A task is queued rather than submitted to the DFK, and a future standing in
+    for its AppFuture is returned straight away, so that a limited stage never
+    holds up the submission of the other stages. A task's slot is only taken
+    once its upstream futures have resolved, so that a task waiting on its
+    inputs doesn't keep a ready one from running.
+
+    Parameters
+    ----------
+    max_in_flight : int
+        The most tasks of the stage that are submitted but not yet completed.
+    """
+
+    def __init__(self, max_in_flight):
+        self.max_in_flight = max_in_flight
+        self.n_in_flight = 0
+        self._ready = deque()
+        self._lock = threading.Lock()
+
+    def submit(self, launch, inputs, n_outputs=1):
+        """Queue a task, returning a future that resolves like the task's AppFuture.
+
+        Parameters
+        ----------
+        launch : callable
+            Submits the task to the DFK, returning its AppFuture.
+        inputs : list
+            The task's inputs, it is launched once the futures among them have resolved.
+        n_outputs : int, optional
+            The number of outputs of the task, by default 1
+
+        Returns
+        -------
+        concurrent.futures.Future
+            The future of the task, with an ``outputs`` future for each of its
+            outputs, and the ``task_record`` of the AppFuture once it is launched.
+        """
+        future = Future()
+        future.outputs = [Future() for _ in range(n_outputs)]
+        future.task_record = {}
+
+        dependencies = [item for item in inputs if isinstance(item, Future)]
+        remaining = [len(dependencies)]
+
+        def dependency_done(_):
+            with self._lock:
+                remaining[0] -= 1
+                if remaining[0] > 0:
+                    return
+                self._ready.append((launch, future))
+            self._launch_ready()
+
+        if len(dependencies) == 0:
+            with self._lock:
+                self._ready.append((launch, future))
+            self._launch_ready()
+        for dependency in dependencies:
+            dependency.add_done_callback(dependency_done)
+        return future
+
+    def _launch_ready(self):
+        while True:
+            with self._lock:
+                if self.n_in_flight >= self.max_in_flight or len(self._ready) == 0:
+                    return
+                launch, future = self._ready.popleft()
+                self.n_in_flight += 1
+
+            try:
+                app_future = launch()
+            except Exception as e:
+                self._done(future, exception=e)
+                continue
+            future.task_record = app_future.task_record
+            app_future.add_done_callback(partial(self._app_done, future))
+
+    def _app_done(self, future, app_future):
+        if app_future.cancelled():
+            self._done(future, exception=RuntimeError("The task was cancelled."))
+        elif app_future.exception() is not None:
+            self._done(future, exception=app_future.exception())
+        else:
+            outputs = [output.result() for output in app_future.outputs]
+            self._done(future, result=app_future.result(), outputs=outputs)
+
+    def _done(self, future, result=None, outputs=(), exception=None):
+        """Free a task's slot for the next ready task, then resolve the task's futures."""
+        with self._lock:
+            self.n_in_flight -= 1
+        self._launch_ready()
+
+        if exception is not None:
+            for output in future.outputs:
+                output.set_exception(exception)
+            future.set_exception(exception)
+            return
+        for output, value in zip(future.outputs, outputs, strict=True):
+            output.set_result(value)
+        future.set_result(result)
+
+
+class Pipeline:
+    """Submits manifest entries through a graph of stages.
+
+    Tasks are chained through their futures, so each task is launched by the
+    DFK as soon as its own inputs are ready. The tasks of a stage with a
+    ``max_in_flight`` limit are queued instead, and submitted as its running
+    tasks complete, without holding up the submission of the other stages.
+
+    Parameters
+    ----------
+    graph : StageGraph
+        The stages of the workflow.
+    logging_file : parsl.File, optional
+        The parsl.File object the defines where the logs are written, by default None
+    logger : logging.Logger, optional
+        Logger for the workflow runner, by default None
+    cost_model : kbmod_wf.utilities.cost_model_utilities.CostModel, optional
+        When provided, manifest entries are submitted most expensive first, tasks
+        on HighThroughputExecutors are given matching priorities, and the runtime
+        of each task is recorded to refine the model, by default None
+    logging_config : dict, optional
+        The ``[logging]`` section of the runtime configuration, passed to every
+        task, by default None
+    collector : kbmod_wf.utilities.cleanup_utilities.ArtifactCollector, optional
+        Deletes the outputs of the stages with ``cleanup`` once they have been
+        consumed, by default None, a new collector if any stage cleans up.
+    skip_completed : bool, optional
+        Don't submit a manifest entry whose final outputs all exist, by default
+        None, only if a stage cleans up its outputs. The cleaned up outputs of a
+        completed entry are gone, so resubmitting it would run every stage again,
+        despite the checkpoints, only to delete their outputs once more.
+    memory_config : dict, optional
+        The ``[memory]`` section of the runtime configuration, passed to every
+        task if ``enabled``, see `kbmod_wf.utilities.memory_utilities`, by default None
+    """
+
+    def __init__(
+        self,
+        graph,
+        logging_file=None,
+        logger=None,
+        cost_model=None,
+        logging_config=None,
+        collector=None,
+        skip_completed=None,
+        memory_config=None,
+    ):
+        self.graph = graph
+        self.stages = graph.stages
+        self.logging_file = logging_file
+        self.logging_config = logging_config if logging_config is not None else {}
+        self.memory_config = memory_config if memory_config is not None else {}
+        self.logger = logger
+        self.cost_model = cost_model
+
+        self._apps = {}
+        self._throttles = {}
+        self._supports_priority = {}
+        for stage in self.stages:
+            self._apps[stage.name] = self._bind_app(stage)
+            self._supports_priority[stage.name] = self._executors_support_priority(self._apps[stage.name])
+            if stage.max_in_flight is not None:
+                self._throttles[stage.name] = _StageThrottle(stage.max_in_flight)
+
+        self.collector = collector
+        if self.collector is None and any(stage.cleanup for stage in self.stages):
+            from kbmod_wf.utilities.cleanup_utilities import ArtifactCollector, get_deleter
+
+            self.collector = ArtifactCollector(get_deleter(logger=logger), logger=logger)
+
+        self.skip_completed = skip_completed
+        if self.skip_completed is None:
+            self.skip_completed = any(stage.cleanup for stage in self.stages)
+        self.n_completed = 0
+
+        self.leaf_futures = []
+
+    @classmethod
+    def from_config(cls, runtime_config, default_stages=(), logging_file=None, logger=None, cost_model=None):
+        """Create a Pipeline from the runtime configuration.
+
+        Parameters
+        ----------
+        runtime_config : dict
+            The complete runtime configuration. If it has a ``[workflow]`` section
+            with ``stages`` those are used, otherwise ``default_stages`` are.
+        default_stages : list[dict], optional
+            The stage declarations to use when the runtime configuration has none,
+            by default ()
+        logging_file : parsl.File, optional
+            The parsl.File object the defines where the logs are written, by default None
+        logger : logging.Logger, optional
+            Logger for the workflow runner, by default None
+        cost_model : kbmod_wf.utilities.cost_model_utilities.CostModel, optional
+            Used to order and prioritize the tasks, by default None
+
+        Returns
+        -------
+        Pipeline
+            The pipeline.
+        """
+        return cls(
+            StageGraph.from_config(runtime_config, default_stages=default_stages),
+            logging_file=logging_file,
+            logger=logger,
+            cost_model=cost_model,
+            logging_config=runtime_config.get("logging", {}),
+            memory_config=runtime_config.get("memory", {}),
+        )
+
+    def _bind_app(self, stage):
+        """Look up the python_app for a stage, and rebind it to the stage's executors."""
+        from kbmod_wf import workflow_tasks
+
+        app = getattr(workflow_tasks, stage.app, None)
+        if app is None:
+            raise ValueError(f"Unknown app '{stage.app}' for workflow stage {stage.name}.")
+
+        if stage.fuse:
+            from kbmod_wf.workflow_tasks.fused_stages import FUSABLE_APPS
+
+            for fused_stage in self._fused_stages(stage):
+                if fused_stage.app not in FUSABLE_APPS:
+                    raise ValueError(
+                        f"Workflow stage {fused_stage.name} can not be fused, "
+                        f"its app must be one of {FUSABLE_APPS}."
+                    )
+
+            # The fused task runs where this stage would have run.
+            executors = app.executors
+            app = copy.copy(workflow_tasks.fused_stages)
+            app.executors = executors
+
+        if stage.executors is not None:
+            import parsl
+
+            available = parsl.dfk().executors
+            executors = [label for label in stage.executors if label in available]
+            if len(executors) == 0:
+                raise ValueError(
+                    f"None of the executors {stage.executors} for workflow stage {stage.name} are available."
+                )
+            app = copy.copy(app)
+            app.executors = executors
+
+        if self.cost_model is not None:
+            from kbmod_wf.utilities.cost_model_utilities import timed_app_function
+
+            # The cost model is fit from the time spent running each task, not waiting for a worker.
+            app = copy.copy(app)
+            app.func = timed_app_function(app.func)
+
+        return app
+
+    def _fused_stages(self, stage):
+        """Return the stages that run in the same task as ``stage``, in order, ending with ``stage``."""
+        stages = [stage]
+        while stages[0].fuse:
+            stages.insert(0, self.graph.stage(stages[0].upstream))
+        return stages
+
+    @staticmethod
+    def _executors_support_priority(app):
+        """Only the HighThroughputExecutor accepts a task priority."""
+        import parsl
+        from parsl.executors import HighThroughputExecutor
+
+        executors = parsl.dfk().executors
+        labels = app.executors
+        if labels == "all":
+            labels = [label for label in executors if label != "_parsl_internal"]
+        return all(isinstance(executors[label], HighThroughputExecutor) for label in labels)
+
+    def validate(self):
+        """Check that every stage can expand its fan out, before anything is submitted."""
+        self.graph.validate()
+
+    def submit(self, source_filepath, priority=None):
+        """Submit every stage of the workflow for a single manifest entry.
+
+        Parameters
+        ----------
+        source_filepath : str
+            The filepath of the manifest entry.
+        priority : int, optional
+            The priority given to each of the tasks, lower values are higher
+            priority, by default None
+        """
+        from parsl import File
+
+        if self.skip_completed:
+            leaf_filepaths = [
+                task.output_filepath
+                for task in self.graph.expand(source_filepath)
+                if self.graph.is_leaf(task.stage)
+            ]
+            if all(os.path.exists(filepath) for filepath in leaf_filepaths):
+                if self.logger is not None:
+                    self.logger.debug(f"Skipping {source_filepath}, its outputs already exist")
+                self.n_completed += 1
+                for filepath in leaf_filepaths:
+                    future = Future()
+                    future.set_result(File(filepath))
+                    self.leaf_futures.append(future)
+                return
+
+        source = File(source_filepath)
+        futures = {}
+        held = []
+        for task in self.graph.expand(source_filepath):
+            if self.graph.is_fused_downstream(task.stage):
+                # Submitted as part of the downstream task it is fused with.
+                continue
+            if task.group is not None and task is not task.group[0]:
+                # Submitted together with the first task of its group.
+                continue
+            grouped_tasks = task.group if task.group is not None else [task]
+
+            fused_tasks = [task]
+            while fused_tasks[0].stage.fuse:
+                fused_tasks.insert(0, fused_tasks[0].upstream)
+
+            first_task = fused_tasks[0]
+            inputs = []
+            for item in first_task.stage.inputs:
+                if item == "upstream":
+                    inputs.append(source if first_task.upstream is None else futures[first_task.upstream])
+                elif item == "source":
+                    inputs.append(source)
+                elif task.group is not None:
+                    inputs.append([t.fan_out for t in task.group])
+                else:
+                    inputs.append(first_task.fan_out)
+
+            if len(fused_tasks) == 1:
+                output_filepaths = [t.output_filepath for t in grouped_tasks]
+                runtime_config = self.graph.stage_config(task.stage)
+                profile_config = self.graph.profile_config(task.stage)
+            else:
+                output_filepaths, runtime_config = self._fused_task_config(fused_tasks)
+                # Each of the fused stages is profiled separately.
+                profile_config = [self.graph.profile_config(t.stage) for t in fused_tasks]
+                if all(profile is None for profile in profile_config):
+                    profile_config = None
+
+            future = self._submit_task(
+                task.stage, inputs, output_filepaths, runtime_config, priority, profile_config=profile_config
+            )
+
+            # The runtime of a fused task can't be attributed to any single stage.
+            if self.cost_model is not None and len(fused_tasks) == 1:
+                future.add_done_callback(
+                    partial(self._record_timing, task.stage.name, source_filepath, n_tasks=len(grouped_tasks))
+                )
+
+            upstream = first_task.upstream
+            if upstream is not None and upstream.stage.cleanup and "upstream" in first_task.stage.inputs:
+                self.collector.consumed_by(upstream.output_filepath, future)
+            if task.stage.cleanup:
+                for grouped_task in grouped_tasks:
+                    # The output is deleted once this task, and every task that consumes it, has succeeded.
+                    # Until they have all been submitted, it is also held here, so that the first
+                    # consumer to finish doesn't delete it.
+                    self.collector.consumed_by(grouped_task.output_filepath, future)
+                    self.collector.retain(grouped_task.output_filepath)
+                    held.append(grouped_task.output_filepath)
+
+            if self.graph.is_leaf(task.stage):
+                self.leaf_futures.append(future)
+            elif task.group is None:
+                futures[task] = future
+            else:
+                # Downstream tasks wait only on their own output of the grouped task.
+                for i, grouped_task in enumerate(grouped_tasks):
+                    futures[grouped_task] = future.outputs[i]
+
+        for filepath in held:
+            self.collector.release(filepath)
+
+    def _fused_task_config(self, fused_tasks):
+        """Build the outputs and runtime configuration of the fused_stages app."""
+        steps = []
+        output_filepaths = [fused_tasks[-1].output_filepath]
+        for task in fused_tasks:
+            stage_config = self.graph.stage_config(task.stage)
+            keep_intermediate = task is not fused_tasks[-1] and stage_config.get("keep_intermediate", False)
+            if keep_intermediate:
+                output_filepaths.append(task.output_filepath)
+            steps.append(
+                {
+                    "app": task.stage.app,
+                    "inputs": task.stage.inputs,
+                    "source": task.source_filepath,
+                    "fan_out": task.fan_out,
+                    "output": task.output_filepath,
+                    "runtime_config": stage_config,
+                    "keep_intermediate": keep_intermediate,
+                }
+            )
+        return output_filepaths, {"steps": steps}
+
+    def _submit_task(
+        self, stage, inputs, output_filepaths, runtime_config, priority=None, profile_config=None
+    ):
+        from parsl import File
+
+        kwargs = {}
+        if priority is not None and self._supports_priority[stage.name]:
+            kwargs["parsl_resource_specification"] = {"priority": priority}
+        if profile_config is not None:
+            kwargs["profile_config"] = profile_config
+        if self.memory_config.get("enabled", False):
+            kwargs["memory_config"] = self.memory_config
+
+        launch = partial(
+            self._apps[stage.name],
+            inputs=inputs,
+            outputs=[File(f) for f in output_filepaths],
+            runtime_config=runtime_config,
+            logging_file=self.logging_file,
+            logging_config=self.logging_config,
+            **kwargs,
+        )
+
+        throttle = self._throttles.get(stage.name)
+        if throttle is None:
+            return launch()
+        return throttle.submit(launch, inputs, n_outputs=len(output_filepaths))
+
+    def _record_timing(self, stage_name, source_filepath, future, n_tasks=1):
+        """Feed the runtime of a successful, non-memoized, task back into the cost model.
+        The runtime of a task that ran a group of ``n_tasks`` fan out values is
+        shared between them."""
+        from kbmod_wf.utilities.cost_model_utilities import TASK_SECONDS_ATTRIBUTE
+
+        if future.exception() is not None or future.task_record.get("from_memo"):
+            return
+        seconds = getattr(future.result(), TASK_SECONDS_ATTRIBUTE, None)
+        if seconds is None:
+            return
+        seconds = seconds / n_tasks
+        try:
+            self.cost_model.record(stage_name, source_filepath, seconds)
+        except Exception as e:
+            if self.logger is not None:
+                self.logger.warning(f"Unable to record the runtime of a {stage_name} task: {e}")
+
+    def run(self, manifest_filepath):
+        """Submit every entry of a manifest file and wait for the workflow to finish.
+
+        Parameters
+        ----------
+        manifest_filepath : str
+            Path to a manifest file with one staged filepath per line.
+
+        Returns
+        -------
+        tuple[list, list]
+            The results of the final stage(s), and the (future, exception) tuples
+            for any that failed.
+        """
+        with open(manifest_filepath, "r") as f:
+            entries = [line.strip() for line in f if line.strip() != ""]
+
+        return self.run_batches([entries])
+
+    def run_batches(self, batches):
+        """Submit batches of manifest entries as they become available, and wait
+        for the workflow to finish.
+
+        Parameters
+        ----------
+        batches : iterable[list[str]]
+            Batches of manifest entries, e.g. from
+            `kbmod_wf.utilities.manifest_utilities.stream_manifest_entries`. Each
+            batch is submitted as soon as it is produced. An entry that has
+            already been submitted is skipped. The graph is expected to have
+            been checked with `validate` beforehand.
+
+        Returns
+        -------
+        tuple[list, list]
+            The results of the final stage(s), and the (future, exception) tuples
+            for any that failed.
+        """
+        submitted = set()
+        priority = 0
+        for batch in batches:
+            entries = [entry for entry in dict.fromkeys(batch) if entry not in submitted]
+            submitted.update(entries)
+
+            if self.cost_model is None:
+                for entry in entries:
+                    self.submit(entry)
+                continue
+
+            # Submit the longest running entries first so that they don't become the tail of the run.
+            for entry, predicted_seconds in self.cost_model.order(
+                entries, [stage.name for stage in self.stages]
+            ):
+                if self.logger is not None:
+                    self.logger.debug(f"Predicted {round(predicted_seconds, 1)}[s] to process {entry}")
+                self.submit(entry, priority=priority)
+                priority += 1
+
+        if self.n_completed > 0 and self.logger is not None:
+            self.logger.info(f"Skipped {self.n_completed} manifest entries whose outputs already exist")
+
+        results = wait_for_futures(self.leaf_futures, self.logger)
+
+        if self.collector is not None:
+            self.collector.wait()
+            if self.logger is not None:
+                self.logger.info(
+                    f"Cleaned up {self.collector.n_collected} intermediate outputs, "
+                    f"{len(self.collector)} were kept"
+                )
+        return results
+
+
+def run_workflow(env=None, runtime_config=None, default_stages=(), log_filename="kbmod.log"):
+    """Load and configure Parsl, create the manifest, and run the workflow stages
+    over each of its entries.
+
+    Parameters
+    ----------
+    env : str, optional
+        Environment string used to define which resource configuration to use,
+        by default None
+    runtime_config : dict, optional
+        Dictionary of assorted runtime configuration parameters, by default None
+    default_stages : list[dict], optional
+        The stage declarations to use when the runtime configuration has no
+        ``[workflow]`` section, by default ()
+    log_filename : str, optional
+        Name of the log file written in the parsl run directory, by default "kbmod.log"
+
+    Returns
+    -------
+    list
+        The results of the final stage(s).
+
+    Raises
+    ------
+    RuntimeError
+        If any of the tasks failed, once every other task has finished.
+    """
+    import parsl
+    import toml
+    from parsl import File
+
+    from kbmod_wf.utilities.checkpoint_utilities import configure_checkpoints
+    from kbmod_wf.utilities.configuration_utilities import apply_runtime_updates, get_resource_config
+    from kbmod_wf.utilities.cost_model_utilities import CostModel, get_history_filepath
+    from kbmod_wf.utilities.logger_utilities import get_configured_logger
+    from kbmod_wf.utilities.manifest_utilities import stream_manifest_entries
+    from kbmod_wf.utilities.memoization_utilities import set_file_identity_mode
+    from kbmod_wf.workflow_tasks import create_manifest
+
+    runtime_config = runtime_config if runtime_config is not None else {}
+    set_file_identity_mode(runtime_config.get("memoization", {}).get("file_identity", "stat"))
+
+    resource_config = get_resource_config(env=env)
+    resource_config = apply_runtime_updates(resource_config, runtime_config)
+    configure_checkpoints(resource_config, runtime_config.get("checkpoint", {}))
+
+    app_configs = runtime_config.get("apps", {})
+
+    dfk = parsl.load(resource_config)
+    # Shut down the executors and flush the checkpoints, also when the workflow fails to start.
+    try:
+        logging_file = File(os.path.join(dfk.run_dir, log_filename))
+        logger = get_configured_logger(
+            "workflow.workflow_runner", logging_file.filepath, runtime_config.get("logging", {})
+        )
+
+        logger.info(f"Using runtime configuration definition:\n{toml.dumps(runtime_config)}")
+
+        # Timings are kept next to the per-run directories, so that they are reused between runs.
+        cost_model = CostModel.from_config(
+            runtime_config.get("cost_model", {}),
+            default_history_filepath=get_history_filepath(resource_config.run_dir),
+        )
+
+        pipeline = Pipeline.from_config(
+            runtime_config,
+            default_stages=default_stages,
+            logging_file=logging_file,
+            logger=logger,
+            cost_model=cost_model,
+        )
+        pipeline.validate()
+
+        logger.info("Starting workflow")
+
+        # gather all the files that are staged for processing
+        create_manifest_config = app_configs.get("create_manifest", {})
+        manifest_filepath = os.path.join(
+            create_manifest_config.get("output_directory", os.getcwd()), "manifest.txt"
+        )
+
+        if create_manifest_config.get("streaming", False):
+            # Feed each batch of staged files to the first stage as soon as it is discovered.
+            staging_directory = create_manifest_config.get("staging_directory")
+            if staging_directory is None:
+                raise ValueError("No staging_directory provided in the configuration.")
+
+            batches = stream_manifest_entries(
+                staging_directory,
+                create_manifest_config.get("output_directory", staging_directory),
+                manifest_filepath,
+                file_pattern=create_manifest_config.get("file_pattern", "*.collection"),
+                batch_size=create_manifest_config.get("batch_size", 100),
+                watch=create_manifest_config.get("watch", False),
+                poll_interval=create_manifest_config.get("poll_interval", 30.0),
+                idle_timeout=create_manifest_config.get("idle_timeout", 600.0),
+                staging=create_manifest_config.get("staging", "copy"),
+                n_threads=create_manifest_config.get("staging_threads", 8),
+                logger=logger,
+            )
+            results, failures = pipeline.run_batches(batches)
+        else:
+            create_manifest_future = create_manifest(
+                inputs=[],
+                outputs=[File(manifest_filepath)],
+                runtime_config=create_manifest_config,
+                logging_file=logging_file,
+                logging_config=runtime_config.get("logging", {}),
+            )
+            results, failures = pipeline.run(create_manifest_future.result().filepath)
+
+        logger.info("Workflow complete")
+    finally:
+        dfk.cleanup()
+        parsl.clear()
+
+    # Every task has been waited on, so a failure can't leave any of the others running.
+    if len(failures) > 0:
+        root, ext = os.path.splitext(log_filename)
+        raise RuntimeError(
+            f"{len(failures)} of {len(results) + len(failures)} workflow tasks failed, "
+            f"see the {root}.<hostname>.<pid>{ext} logs in the parsl run directory"
+        ) from failures[0][1]
+    return results
+
+
+def main(default_stages, envs=("dev", "klone", "usdf"), log_filename="kbmod.log"):
+    """Run, or with ``--plan`` only plan, a workflow from the command line.
+
+    Parameters
+    ----------
+    default_stages : list[dict]
+        The stage declarations of the workflow, used when the runtime
+        configuration has no ``[workflow]`` section.
+    envs : tuple[str], optional
+        The environments the workflow can run in, by default ("dev", "klone", "usdf")
+    log_filename : str, optional
+        Name of the log file written in the parsl run directory, by default "kbmod.log"
+    """
+    import argparse
+
+    import toml
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--env",
+        type=str,
+        choices=list(envs),
+        help="The environment to run the workflow in.",
+    )
+
+    parser.add_argument(
+        "--runtime-config",
+        type=str,
+        help="The complete runtime configuration filepath to use for the workflow.",
+    )
+
+    parser.add_argument(
+        "--plan",
+        action="store_true",
+        help="Print the tasks and the predicted resource usage of the workflow, without running it.",
+    )
+
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        help="An existing manifest to plan, instead of scanning the staging directory.",
+    )
+
+    parser.add_argument(
+        "--plan-output",
+        type=str,
+        help="A JSON filepath to write the full list of planned tasks to.",
+    )
+
+    args = parser.parse_args()
+
+    # if a runtime_config file was provided and exists, load the toml as a dict.
+    runtime_config = {}
+    if args.runtime_config is not None and os.path.exists(args.runtime_config):
+        with open(args.runtime_config, "r") as toml_runtime_config:
+            runtime_config = toml.load(toml_runtime_config)
+
+    if args.plan:
+        from kbmod_wf.planner import plan_workflow
+
+        plan = plan_workflow(
+            env=args.env,
+            runtime_config=runtime_config,
+            default_stages=default_stages,
+            manifest_filepath=args.manifest,
+        )
+        print(plan.format_report())
+        if args.plan_output is not None:
+            plan.write(args.plan_output)
+    else:
+        run_workflow(
+            env=args.env,
+            runtime_config=runtime_config,
+            default_stages=default_stages,
+            log_filename=log_filename,
+        )
@@ -0,0 +1,378 @@
+"""Plan a workflow run without loading Parsl.
+
+The planner expands the stage graph over every manifest entry exactly as the
+`Pipeline` would, and uses the cost model to predict the walltime and memory of
+each task. The tasks are then assigned to the executors of the resource
+configuration, so that tasks which would exceed an executor's walltime or memory
+per worker are reported before any blocks are requested from the scheduler.
+
+Nothing is submitted, no files are staged and `parsl.load` is never called, so a
+plan can be made offline, e.g. on a laptop with a copy of the staged collections.
+"""
+
+import json
+import math
+import os
+
+from kbmod_wf.pipeline import StageGraph
+
+__all__ = ["ExecutorResources", "WorkflowPlan", "plan_workflow", "parse_walltime"]
+
+
+def parse_walltime(walltime):
+    """Convert a Slurm style walltime, "[D-]HH:MM:SS", to seconds.
+
+    Parameters
+    ----------
+    walltime : str
+        The walltime.
+
+    Returns
+    -------
+    float
+        The walltime in seconds.
+    """
+    days = 0
+    if "-" in walltime:
+        days, walltime = walltime.split("-", 1)
+    seconds = 0
+    for part in walltime.split(":"):
+        seconds = seconds * 60 + float(part)
+    return int(days) * 86400 + seconds
+
+
+class ExecutorResources:
+    """The resources available to each worker of an executor.
+
+    Parameters
+    ----------
+    label : str
+        The executor label.
+    workers_per_node : int
+        The number of tasks that run concurrently on each node.
+    memory_per_worker : float, optional
+        The memory available to each worker in GB, by default None (unlimited).
+    walltime : float, optional
+        The walltime of a block in seconds, by default None (unlimited).
+    gpu : bool, optional
+        Whether the executor's nodes have GPUs, by default False
+    """
+
+    def __init__(self, label, workers_per_node=1, memory_per_worker=None, walltime=None, gpu=False):
+        self.label = label
+        self.workers_per_node = workers_per_node
+        self.memory_per_worker = memory_per_worker
+        self.walltime = walltime
+        self.gpu = gpu
+
+    @classmethod
+    def from_executor(cls, executor):
+        """Read the resources of a (not started) Parsl executor.
+
+        Parameters
+        ----------
+        executor : parsl.executors.base.ParslExecutor
+            The executor.
+
+        Returns
+        -------
+        ExecutorResources
+            The executor's resources.
+        """
+        provider = getattr(executor, "provider", None)
+
+        workers_per_node = getattr(executor, "max_workers_per_node", None)
+        if workers_per_node is None:
+            workers_per_node = getattr(executor, "max_workers", None)
+        if workers_per_node is None:
+            workers_per_node = getattr(executor, "max_threads", 1)
+
+        cores_per_node = getattr(provider, "cores_per_node", None)
+        cores_per_worker = getattr(executor, "cores_per_worker", None)
+        if cores_per_node and cores_per_worker:
+            workers_per_node = min(workers_per_node, math.floor(cores_per_node / cores_per_worker))
+        if math.isinf(workers_per_node) or workers_per_node < 1:
+            workers_per_node = 1
+
+        memory_per_worker = getattr(executor, "mem_per_worker", None)
+        mem_per_node = getattr(provider, "mem_per_node", None)
+        if memory_per_worker is None and mem_per_node:
+            memory_per_worker = mem_per_node / workers_per_node
+
+        walltime = getattr(provider, "walltime", None)
+        if walltime is not None:
+            walltime = parse_walltime(walltime)
+
+        scheduler_options = getattr(provider, "scheduler_options", "") or ""
+        gpu = "gpu" in executor.label.lower() or "gpu" in scheduler_options.lower()
+
+        return cls(
+            executor.label,
+            workers_per_node=int(workers_per_node),
+            memory_per_worker=memory_per_worker,
+            walltime=walltime,
+            gpu=gpu,
+        )
+
+
+class WorkflowPlan:
+    """The tasks of a workflow run, with their predicted cost and executor.
+
+    Parameters
+    ----------
+    tasks : list[dict]
+        One dictionary per task with the ``stage``, ``executor``, ``source``,
+        ``output``, ``fan_out``, predicted ``seconds`` and ``memory_gb``.
+    executors : dict[str, ExecutorResources]
+        The resources of each executor in the resource configuration.
+    warnings : list[str], optional
+        Problems found while planning, by default None
+    """
+
+    def __init__(self, tasks, executors, warnings=None):
+        self.tasks = tasks
+        self.executors = executors
+        self.warnings = warnings if warnings is not None else []
+
+    def summary(self):
+        """Aggregate the tasks per executor.
+
+        Returns
+        -------
+        dict[str, dict]
+            For each executor label with tasks, the number of ``tasks``, the
+            ``max_seconds`` and ``max_memory_gb`` of a single task, and the
+            ``node_hours`` needed to run them all.
+        """
+        summary = {}
+        for task in self.tasks:
+            label = task["executor"]
+            entry = summary.setdefault(
+                label,
+                {"tasks": 0, "stages": [], "max_seconds": 0.0, "max_memory_gb": 0.0, "node_hours": 0.0},
+            )
+            entry["tasks"] += 1
+            if task["stage"] not in entry["stages"]:
+                entry["stages"].append(task["stage"])
+            entry["max_seconds"] = max(entry["max_seconds"], task["seconds"])
+            entry["max_memory_gb"] = max(entry["max_memory_gb"], task["memory_gb"])
+
+            workers_per_node = self.executors[label].workers_per_node if label in self.executors else 1
+            entry["node_hours"] += task["seconds"] / 3600 / workers_per_node
+        return summary
+
+    def node_hours(self):
+        """Return the total (CPU, GPU) node-hours of the plan."""
+        cpu, gpu = 0.0, 0.0
+        for label, entry in self.summary().items():
+            if label in self.executors and self.executors[label].gpu:
+                gpu += entry["node_hours"]
+            else:
+                cpu += entry["node_hours"]
+        return cpu, gpu
+
+    def format_report(self):
+        """Return a human readable report of the plan."""
+        lines = [f"{len(self.tasks)} tasks"]
+        for label, entry in self.summary().items():
+            resources = self.executors.get(label)
+            walltime = "unlimited"
+            memory = "unlimited"
+            if resources is not None and resources.walltime is not None:
+                walltime = f"{resources.walltime:.0f}s"
+            if resources is not None and resources.memory_per_worker is not None:
+                memory = f"{resources.memory_per_worker:.1f}GB"
+            lines.append(
+                f"  {label} ({', '.join(entry['stages'])}): {entry['tasks']} tasks, "
+                f"longest {entry['max_seconds']:.0f}s of {walltime}, "
+                f"largest {entry['max_memory_gb']:.1f}GB of {memory}, "
+                f"{entry['node_hours']:.2f} node-hours"
+            )
+
+        cpu, gpu = self.node_hours()
+        lines.append(f"Total: {cpu:.2f} CPU node-hours, {gpu:.2f} GPU node-hours")
+
+        if len(self.warnings) > 0:
+            lines.append(f"{len(self.warnings)} warnings:")
+            lines.extend(f"  {w}" for w in self.warnings)
+        return "\n".join(lines)
+
+    def write(self, filepath):
+        """Write the full list of tasks, and the summary, to a JSON file.
+
+        Parameters
+        ----------
+        filepath : str
+            The JSON file to write.
+        """
+        cpu, gpu = self.node_hours()
+        with open(filepath, "w") as f:
+            json.dump(
+                {
+                    "tasks": self.tasks,
+                    "executors": self.summary(),
+                    "cpu_node_hours": cpu,
+                    "gpu_node_hours": gpu,
+                    "warnings": self.warnings,
+                },
+                f,
+                indent=2,
+                default=str,
+            )
+
+
+def _get_manifest_entries(runtime_config, manifest_filepath=None):
+    """Return the (planned, readable) filepaths of the manifest entries.
+
+    The planned filepath is where the entry will be staged, which determines the
+    names of the outputs, while the readable filepath is where the entry can be
+    read from now.
+    """
+    from kbmod_wf.utilities.manifest_utilities import scan_staging_directory
+
+    if manifest_filepath is not None:
+        with open(manifest_filepath, "r") as f:
+            entries = [line.strip() for line in f if line.strip() != ""]
+        return [(entry, entry) for entry in entries]
+
+    create_manifest_config = runtime_config.get("apps", {}).get("create_manifest", {})
+    staging_directory = create_manifest_config.get("staging_directory")
+    if staging_directory is None:
+        raise ValueError("No staging_directory provided in the configuration.")
+    output_directory = create_manifest_config.get("output_directory", staging_directory)
+
+    entries = []
+    for batch in scan_staging_directory(
+        staging_directory, create_manifest_config.get("file_pattern", "*.collection")
+    ):
+        for filepath in batch:
+            entries.append((os.path.join(output_directory, os.path.basename(filepath)), filepath))
+    return sorted(entries)
+
+
+def _get_stage_executor(stage, labels):
+    """Return the first executor label in the resource configuration that a stage may run on."""
+    from kbmod_wf import workflow_tasks
+
+    candidates = stage.executors
+    if candidates is None:
+        app = getattr(workflow_tasks, stage.app, None)
+        if app is None:
+            raise ValueError(f"Unknown app '{stage.app}' for workflow stage {stage.name}.")
+        candidates = getattr(app.executors, "candidates", app.executors)
+        if candidates == "all":
+            candidates = labels
+
+    for label in candidates:
+        if label in labels:
+            return label
+    return None
+
+
+def plan_workflow(env=None, runtime_config=None, default_stages=(), manifest_filepath=None):
+    """Expand every task of a workflow run and predict its cost, without running it.
+
+    Parameters
+    ----------
+    env : str, optional
+        Environment string used to define which resource configuration to plan
+        for, by default None
+    runtime_config : dict, optional
+        Dictionary of assorted runtime configuration parameters, by default None
+    default_stages : list[dict], optional
+        The stage declarations to use when the runtime configuration has no
+        ``[workflow]`` section, by default ()
+    manifest_filepath : str, optional
+        An existing manifest to plan, by default None, in which case the staging
+        directory of ``[apps.create_manifest]`` is scanned.
+
+    Returns
+    -------
+    WorkflowPlan
+        The planned tasks.
+    """
+    from kbmod_wf.utilities.configuration_utilities import apply_runtime_updates, get_resource_config
+    from kbmod_wf.utilities.cost_model_utilities import CostModel, estimate_memory_bytes, get_history_filepath
+
+    runtime_config = runtime_config if runtime_config is not None else {}
+    resource_config = get_resource_config(env=env)
+    resource_config = apply_runtime_updates(resource_config, runtime_config)
+    executors = {e.label: ExecutorResources.from_executor(e) for e in resource_config.executors}
+
+    graph = StageGraph.from_config(runtime_config, default_stages=default_stages)
+    graph.validate()
+
+    # Use the timings of previous runs if there are any, even when ordering by cost is disabled.
+    cost_model_config = dict(runtime_config.get("cost_model", {}))
+    cost_model_config["enabled"] = True
+    cost_model = CostModel.from_config(
+        cost_model_config,
+        default_history_filepath=get_history_filepath(resource_config.run_dir),
+    )
+
+    warnings = []
+    stage_executors = {}
+    for stage in reversed(graph.stages):
+        if graph.is_fused_downstream(stage):
+            # Fused stages run where the stage they are fused into runs.
+            stage_executors[stage.name] = stage_executors[graph.downstream[stage.name][0]]
+            continue
+        stage_executors[stage.name] = _get_stage_executor(stage, list(executors))
+        if stage_executors[stage.name] is None:
+            warnings.append(f"No executor in the '{env}' resource configuration for stage {stage.name}.")
+
+    tasks = []
+    for entry, readable_entry in _get_manifest_entries(runtime_config, manifest_filepath):
+        features = cost_model.features(readable_entry)
+        if features["n_images"] == 0:
+            warnings.append(f"Manifest entry {readable_entry} could not be read or has no images.")
+
+        fused_seconds = {}
+        group_seconds = {}
+        for planned in graph.expand(entry):
+            stage = planned.stage
+            label = stage_executors[stage.name]
+            seconds = cost_model.predict(stage.name, features)
+            memory_gb = estimate_memory_bytes(stage.name, features) / 1024**3
+            tasks.append(
+                {
+                    "stage": stage.name,
+                    "executor": label,
+                    "source": entry,
+                    "output": planned.output_filepath,
+                    "fan_out": planned.fan_out,
+                    "seconds": seconds,
+                    "memory_gb": memory_gb,
+                }
+            )
+
+            # A fused task runs all of its stages within the same walltime.
+            if stage.fuse:
+                seconds += fused_seconds[planned.upstream]
+            if graph.is_fused_downstream(stage):
+                fused_seconds[planned] = seconds
+                continue
+
+            # A grouped task runs all of its fan out values within the same walltime. This is an
+            # upper bound, as the work shared between the values is only done once.
+            if planned.group is not None:
+                group_seconds[id(planned.group)] = group_seconds.get(id(planned.group), 0.0) + seconds
+                if planned is not planned.group[-1]:
+                    continue
+                seconds = group_seconds[id(planned.group)]
+
+            resources = executors.get(label)
+            if resources is None:
+                continue
+            if resources.walltime is not None and seconds > resources.walltime:
+                warnings.append(
+                    f"{stage.name} for {entry} is predicted to take {seconds:.0f}s, "
+                    f"longer than the {resources.walltime:.0f}s walltime of {label}."
+                )
+            if resources.memory_per_worker is not None and memory_gb > resources.memory_per_worker:
+                warnings.append(
+                    f"{stage.name} for {entry} is predicted to use {memory_gb:.1f}GB, "
+                    f"more than the {resources.memory_per_worker:.1f}GB per worker of {label}."
+                )
+
+    return WorkflowPlan(tasks, executors, warnings)
@@ -1,5 +1,17 @@
-from .dev_configuration import dev_resource_config
-from .klone_configuration import klone_resource_config
-from .usdf_configuration import usdf_resource_config
+import importlib
 
 __all__ = ["dev_resource_config", "klone_resource_config", "usdf_resource_config"]
+
+# Each configuration imports parsl's executors and providers, so only the one
+# that is used is imported.
+_LAZY_ATTRIBUTES = {
+    "dev_resource_config": "dev_configuration",
+    "klone_resource_config": "klone_configuration",
+    "usdf_resource_config": "usdf_configuration",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return getattr(importlib.import_module(f".{_LAZY_ATTRIBUTES[name]}", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -2,7 +2,6 @@ import os
 import datetime
 from parsl import Config
 from parsl.executors import ThreadPoolExecutor
-from parsl.utils import get_all_checkpoints
 
 
 this_dir = os.path.dirname(os.path.abspath(__file__))
@@ -10,14 +9,12 @@ project_dir = os.path.abspath(os.path.join(this_dir, "../../../"))
 
 
 def dev_resource_config():
+    from kbmod_wf.utilities.checkpoint_utilities import get_checkpoint_config
+
     return Config(
         # put the log files in in the top level folder, "run_logs".
         run_dir=os.path.join(project_dir, "run_logs", datetime.date.today().isoformat()),
-        app_cache=True,
-        checkpoint_mode="task_exit",
-        checkpoint_files=get_all_checkpoints(
-            os.path.join(project_dir, "run_logs", datetime.date.today().isoformat())
-        ),
+        **get_checkpoint_config(os.path.join(project_dir, "run_logs", datetime.date.today().isoformat())),
         executors=[
             ThreadPoolExecutor(
                 label="local_dev_testing",
@@ -3,7 +3,6 @@ import datetime
 from parsl import Config
 from parsl.executors import HighThroughputExecutor
 from parsl.providers import LocalProvider, SlurmProvider
-from parsl.utils import get_all_checkpoints
 
 walltimes = {
     "compute_bigmem": "01:00:00",
@@ -14,10 +13,10 @@ walltimes = {
 
 
 def klone_resource_config():
+    from kbmod_wf.utilities.checkpoint_utilities import get_checkpoint_config
+
     return Config(
-        app_cache=True,
-        checkpoint_mode="task_exit",
-        checkpoint_files=get_all_checkpoints(
+        **get_checkpoint_config(
             os.path.join("/gscratch/dirac/kbmod/workflow/run_logs", datetime.date.today().isoformat())
         ),
         run_dir=os.path.join("/gscratch/dirac/kbmod/workflow/run_logs", datetime.date.today().isoformat()),
@@ -13,7 +13,6 @@ import datetime
 from parsl import Config
 from parsl.executors import HighThroughputExecutor
 from parsl.providers import LocalProvider, SlurmProvider
-from parsl.utils import get_all_checkpoints
 from parsl.monitoring.monitoring import MonitoringHub # COC
 from parsl.addresses import address_by_hostname # COC
 import logging # COC
@@ -31,6 +30,8 @@ max_ram_dict = {"ada":350, # 351 Gb total, with 5 GPUs total on the one node, le
 }
 max_block_dict = {"ada":1, "ampere":2}
 gpus_per_node_dict = {"ada":5, "ampere":4}
+# match [apps.kbmod_search.gpu] slots_per_device to share the GPUs
+searches_per_gpu_dict = {"ada":1, "ampere":1}
 max_nodes_dict = {"ada":1, "ampere":2}
 cpus_per_node_dict = {"ada":30, "ampere":112} # {"ada":6, "ampere":28} # ada cap is 36, ampere ≥100
 cores_per_worker_dict = {"ada":6, "ampere":28}
@@ -46,6 +47,9 @@ if "GPUNODE" in os.environ:
     gpu_partition = os.environ["GPUNODE"].lower()
     print(f"Set gpu_partition to {gpu_partition} via environment variable GPUNODE.")
 
+searches_per_gpu = searches_per_gpu_dict[gpu_partition]
+gpu_workers_per_node = gpus_per_node_dict[gpu_partition]*searches_per_gpu
+
 
 walltimes = {
     "sharded_reproject": "04:00:00",
@@ -58,12 +62,10 @@ account_name = "rubin:commissioning"
 
 
 def usdf_resource_config():
+    from kbmod_wf.utilities.checkpoint_utilities import get_checkpoint_config
+
     return Config(
-        app_cache=True,
-        checkpoint_mode="task_exit",
-        checkpoint_files=get_all_checkpoints(
-            os.path.join(base_path, "kbmod/workflow/run_logs")
-        ),
+        **get_checkpoint_config(os.path.join(base_path, "kbmod/workflow/run_logs")),
         run_dir=os.path.join(base_path, "kbmod/workflow/run_logs"),
         retries=1,
         executors=[
@@ -91,9 +93,9 @@ def usdf_resource_config():
             ),
             HighThroughputExecutor(
                 label="gpu",
-                max_workers_per_node=gpus_per_node_dict[gpu_partition], # was 1
-                cores_per_worker=cores_per_worker_dict[gpu_partition],
-                mem_per_worker=int(np.floor(max_ram_dict[gpu_partition]/gpus_per_node_dict[gpu_partition])),
+                max_workers_per_node=gpu_workers_per_node, # was 1
+                cores_per_worker=max(1, cores_per_worker_dict[gpu_partition]//searches_per_gpu),
+                mem_per_worker=int(np.floor(max_ram_dict[gpu_partition]/gpu_workers_per_node)),
                 provider=SlurmProvider(
                     partition=gpu_partition, # or ada
                     account=account_name,
@@ -107,9 +109,8 @@ def usdf_resource_config():
  #                   exclusive=False, # disabled
                     walltime=walltimes["gpu"],
                     cmd_timeout=slurm_cmd_timeout,
+                    # Each search takes a slot of a GPU when it starts, see kbmod_wf.utilities.gpu_utilities.
                     worker_init="""
-export CUDA_VISIBLE_DEVICES=$((${PARSL_WORKER_RANK:-0} % 4))
-echo Assigned GPU $CUDA_VISIBLE_DEVICES to worker $PARSL_WORKER_RANK
 hostname
 hostnamectl
 nvidia-smi
@@ -1,6 +1,4 @@
-from .ic_to_wu import ic_to_wu
-from .kbmod_search import kbmod_search
-from .uri_to_ic import uri_to_ic
+import importlib
 
 __all__ = [
     "ic_to_wu",
@@ -8,3 +6,17 @@ __all__ = [
     "reproject_wu",
     "uri_to_ic",
 ]
+
+# The task implementations import kbmod, so they are only imported when they are
+# first used, i.e. on the workers.
+_LAZY_ATTRIBUTES = {
+    "ic_to_wu": "ic_to_wu",
+    "kbmod_search": "kbmod_search",
+    "uri_to_ic": "uri_to_ic",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return getattr(importlib.import_module(f".{_LAZY_ATTRIBUTES[name]}", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
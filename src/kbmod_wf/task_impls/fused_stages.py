@@ -0,0 +1,165 @@
+import os
+from logging import Logger
+from typing import TYPE_CHECKING
+
+from kbmod_wf.task_impls.ic_to_wu import ic_to_wu
+from kbmod_wf.task_impls.kbmod_search import kbmod_search
+from kbmod_wf.task_impls.reproject_multi_chip_multi_night_from_uris import (
+    reproject_wu as reproject_wu_from_uris,
+)
+from kbmod_wf.task_impls.reproject_multi_chip_multi_night_wu import reproject_wu as reproject_multi_night_wu
+from kbmod_wf.task_impls.reproject_single_chip_single_night_wu import reproject_wu as reproject_single_chip_wu
+from kbmod_wf.utilities.gpu_utilities import pin_gpu
+from kbmod_wf.utilities.profiling_utilities import task_profile
+from kbmod_wf.utilities.tracing_utilities import get_sharded_bytes, trace_span
+
+if TYPE_CHECKING:
+    from kbmod.work_unit import WorkUnit
+
+
+def run_fused_stages(inputs: list = None, steps: list = None, profiles: list = None, logger: Logger = None):
+    """Run adjacent workflow stages one after the other, passing the WorkUnit
+    from each stage to the next in memory rather than through sharded FITS files.
+
+    Parameters
+    ----------
+    inputs : list, optional
+        The inputs of the first stage, with any file already resolved to its
+        filepath, by default None
+    steps : list, optional
+        One dictionary per stage, in order, with the ``app`` that implements the
+        stage, the ``inputs`` tokens, the ``source`` and ``fan_out`` of the task,
+        the ``output`` filepath, the stage's ``runtime_config`` and whether to
+        ``keep_intermediate``, i.e. still write the stage's output, by default None
+    profiles : list, optional
+        The ``profile`` option of each stage, see
+        `kbmod_wf.utilities.profiling_utilities`, by default None
+    logger : Logger, optional
+        Primary logger for the workflow, by default None
+
+    Returns
+    -------
+    str
+        The fully resolved filepath of the output of the last stage.
+    """
+    inputs = inputs if inputs is not None else []
+    steps = steps if steps is not None else []
+
+    # CUDA only reads CUDA_VISIBLE_DEVICES when it is initialized, so the search's GPU is
+    # chosen before kbmod is imported.
+    for step in steps:
+        if step["app"] == "kbmod_search":
+            pin_gpu(step["runtime_config"].get("gpu", {}), logger=logger)
+
+    from kbmod.work_unit import WorkUnit
+
+    result = None
+    for i, step in enumerate(steps):
+        if i > 0:
+            # Later stages take the previous stage's WorkUnit in place of its output file.
+            values = {"upstream": result, "source": step["source"], "fan_out": step["fan_out"]}
+            inputs = [values[item] for item in step["inputs"]]
+
+        save = i == len(steps) - 1 or step.get("keep_intermediate", False)
+        logger.info(f"Starting fused stage {step['app']}")
+        profile_config = profiles[i] if profiles is not None else None
+        profile = task_profile(step["app"], step["output"], profile_config, logger)
+        with trace_span(f"fused.{step['app']}", fan_out=step["fan_out"]) as span, profile:
+            result = FUSABLE_STEPS[step["app"]](inputs, step["output"], step["runtime_config"], logger)
+        logger.info(f"Required {round(span.seconds, 1)}[s] to complete fused stage {step['app']}.")
+
+        if save and isinstance(result, WorkUnit):
+            write_work_unit(result, step["output"], logger=logger)
+
+    return steps[-1]["output"]
+
+
+def write_work_unit(wu: "WorkUnit", wu_filepath: str, logger: Logger = None):
+    """Write a WorkUnit to disk as sharded FITS files.
+
+    Parameters
+    ----------
+    wu : WorkUnit
+        The WorkUnit to write.
+    wu_filepath : str
+        The fully resolved filepath of the WorkUnit file.
+    logger : Logger, optional
+        Primary logger for the workflow, by default None
+    """
+    with trace_span("wu.write_shards", logger=logger, n_images=len(wu)) as span:
+        directory_containing_shards, wu_filename = os.path.split(wu_filepath)
+        wu.to_sharded_fits(wu_filename, directory_containing_shards, overwrite=True)
+        if span.recording:
+            span.set(bytes=get_sharded_bytes(wu_filepath))
+
+
+def _ic_to_wu_step(inputs, output_filepath, runtime_config, logger):
+    return ic_to_wu(
+        ic_filepath=inputs[0],
+        wu_filepath=output_filepath,
+        save=False,
+        runtime_config=runtime_config,
+        logger=logger,
+    )
+
+
+def _reproject_wu_step(inputs, output_filepath, runtime_config, logger):
+    return reproject_wu_from_uris(
+        uri_filepath=inputs[1],
+        reprojected_wu_filepath=output_filepath,
+        runtime_config=runtime_config,
+        logger=logger,
+        wu=_as_work_unit(inputs[0]),
+        save=False,
+    )
+
+
+def _reproject_single_chip_wu_step(inputs, output_filepath, runtime_config, logger):
+    return reproject_single_chip_wu(
+        reprojected_wu_filepath=output_filepath,
+        runtime_config=runtime_config,
+        logger=logger,
+        wu=_as_work_unit(inputs[0]),
+        save=False,
+    )
+
+
+def _reproject_multi_night_wu_step(inputs, output_filepath, runtime_config, logger):
+    return reproject_multi_night_wu(
+        inputs[1],
+        ic_filepath=inputs[0],
+        reprojected_wu_filepath=output_filepath,
+        runtime_config=runtime_config,
+        logger=logger,
+        save=False,
+    )
+
+
+def _kbmod_search_step(inputs, output_filepath, runtime_config, logger):
+    return kbmod_search(
+        wu_filepath=None,
+        result_filepath=output_filepath,
+        runtime_config=runtime_config,
+        logger=logger,
+        wu=_as_work_unit(inputs[0]),
+    )
+
+
+def _as_work_unit(wu_or_filepath):
+    """Read a WorkUnit from its filepath, unless it is already in memory."""
+    from kbmod.work_unit import WorkUnit
+
+    if isinstance(wu_or_filepath, WorkUnit):
+        return wu_or_filepath
+    directory_containing_shards, wu_filename = os.path.split(wu_or_filepath)
+    return WorkUnit.from_sharded_fits(wu_filename, directory_containing_shards, lazy=False)
+
+
+FUSABLE_STEPS = {
+    "ic_to_wu": _ic_to_wu_step,
+    "reproject_wu": _reproject_wu_step,
+    "reproject_single_chip_wu": _reproject_single_chip_wu_step,
+    "reproject_multi_night_wu": _reproject_multi_night_wu_step,
+    "kbmod_search": _kbmod_search_step,
+}
+"""The stage implementations that can be fused, keyed by the name of their python_app."""
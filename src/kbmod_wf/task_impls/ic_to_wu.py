@@ -1,11 +1,14 @@
-from kbmod import ImageCollection
-from kbmod.configuration import SearchConfiguration
-from lsst.daf.butler import Butler
+from kbmod_wf.utilities.butler_utilities import borrow_butler
+from kbmod_wf.utilities.memory_utilities import record_work_unit
+from kbmod_wf.utilities.search_config_utilities import load_search_config
+from kbmod_wf.utilities.tracing_utilities import get_sharded_bytes, trace_span
 
 import os
-import glob
-import time
 from logging import Logger
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from kbmod import ImageCollection
 
 
 def ic_to_wu(
@@ -14,6 +17,7 @@ def ic_to_wu(
     save: bool = True,
     runtime_config: dict = {},
     logger: Logger = None,
+    ic: "ImageCollection" = None,
 ):
     """This task will convert an ImageCollection to a WorkUnit.
 
@@ -29,6 +33,9 @@ def ic_to_wu(
         Additional configuration parameters to be used at runtime, by default {}
     logger : Logger, optional
         Primary logger for the workflow, by default None
+    ic : ImageCollection, optional
+        The ImageCollection, if it has already been read from ``ic_filepath``,
+        by default None
 
     Returns
     -------
@@ -41,6 +48,7 @@ def ic_to_wu(
         save=save,
         runtime_config=runtime_config,
         logger=logger,
+        ic=ic,
     )
 
     return ic_to_wu_converter.create_work_unit()
@@ -54,8 +62,10 @@ class ICtoWUConverter:
         save: bool = True,
         runtime_config: dict = {},
         logger: Logger = None,
+        ic: "ImageCollection" = None,
     ):
         self.ic_filepath = ic_filepath
+        self.ic = ic
         self.wu_filepath = wu_filepath
         self.save = save
         self.runtime_config = runtime_config
@@ -64,31 +74,32 @@ class ICtoWUConverter:
         self.search_config_filepath = self.runtime_config.get("search_config_filepath", None)
 
     def create_work_unit(self):
-        ic = ImageCollection.read(self.ic_filepath, format="ascii.ecsv")
-        self.logger.info(f"ImageCollection read from {self.ic_filepath}, creating work unit next.")
-
-        last_time = time.time()
-        self.logger.info("Creating butler instance")
-        this_butler = Butler(self.runtime_config.get("butler_config_filepath", None))
-        elapsed = round(time.time() - last_time, 1)
-        self.logger.debug(f"Required {elapsed}[s] to instantiate butler.")
-
-        last_time = time.time()
-        orig_wu = ic.toWorkUnit(
-            search_config=SearchConfiguration.from_file(self.search_config_filepath), butler=this_butler
-        )
-        elapsed = round(time.time() - last_time, 1)
-        self.logger.debug(f"Required {elapsed}[s] to create WorkUnit.")
+        from kbmod import ImageCollection
+
+        ic = self.ic
+        if ic is None:
+            with trace_span("ic.read", logger=self.logger):
+                ic = ImageCollection.read(self.ic_filepath, format="ascii.ecsv")
+            self.logger.info(f"ImageCollection read from {self.ic_filepath}, creating work unit next.")
+
+        # The butler is reused by every task that runs on this worker, unless this one fails with it.
+        self.logger.info("Getting butler instance")
+        butler_repo = self.runtime_config.get("butler_config_filepath", None)
+        with borrow_butler(butler_repo, logger=self.logger) as this_butler:
+            with trace_span("wu.create", logger=self.logger, n_images=len(ic)):
+                orig_wu = ic.toWorkUnit(
+                    search_config=load_search_config(self.search_config_filepath), butler=this_butler
+                )
+        record_work_unit(orig_wu)
 
         if not self.save:
-            self.logger.debug(f"Required {elapsed}[s] to create the WorkUnit.")
             return orig_wu
 
         self.logger.info(f"Saving sharded work unit to: {self.wu_filepath}")
-        last_time = time.time()
-        directory_containing_shards, wu_filename = os.path.split(self.wu_filepath)
-        orig_wu.to_sharded_fits(wu_filename, directory_containing_shards, overwrite=True)
-        elapsed = round(time.time() - last_time, 1)
-        self.logger.debug(f"Required {elapsed}[s] to write WorkUnit to disk: {self.wu_filepath}")
+        with trace_span("wu.write_shards", logger=self.logger, n_images=len(orig_wu)) as span:
+            directory_containing_shards, wu_filename = os.path.split(self.wu_filepath)
+            orig_wu.to_sharded_fits(wu_filename, directory_containing_shards, overwrite=True)
+            if span.recording:
+                span.set(bytes=get_sharded_bytes(self.wu_filepath))
 
         return self.wu_filepath
@@ -1,9 +1,15 @@
-import kbmod
-from kbmod.search import kb_has_gpu
-from kbmod.work_unit import WorkUnit
+from kbmod_wf.utilities.cleanup_utilities import get_deleter
+from kbmod_wf.utilities.gpu_utilities import estimate_search_device_bytes, gpu_slot, pin_gpu
+from kbmod_wf.utilities.memory_utilities import record_work_unit
+from kbmod_wf.utilities.search_config_utilities import load_search_config
+from kbmod_wf.utilities.tracing_utilities import get_sharded_bytes, trace_span
 
 import os
 from logging import Logger
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from kbmod.work_unit import WorkUnit
 
 
 def kbmod_search(
@@ -11,6 +17,7 @@ def kbmod_search(
     result_filepath: str = None,
     runtime_config: dict = {},
     logger: Logger = None,
+    wu: "WorkUnit" = None,
 ):
     """This task will run the KBMOD search algorithm on a WorkUnit.
 
@@ -22,20 +29,21 @@ def kbmod_search(
         Additional configuration parameters to be used at runtime, by default {}
     logger : Logger, optional
         Primary logger for the workflow, by default None
+    wu : WorkUnit, optional
+        An in-memory WorkUnit to search instead of reading ``wu_filepath``,
+        by default None
 
     Returns
     -------
     str
         The fully resolved filepath of the results file.
     """
-    worker_rank = os.environ["PARSL_WORKER_RANK"]
-    os.environ["CUDA_VISIBLE_DEVICES"] = worker_rank
-    print(f"Set worker_rank to {worker_rank}")
     kbmod_searcher = KBMODSearcher(
         wu_filepath=wu_filepath,
         result_filepath=result_filepath,
         runtime_config=runtime_config,
         logger=logger,
+        wu=wu,
     )
 
     return kbmod_searcher.run_search()
@@ -48,14 +56,18 @@ class KBMODSearcher:
         result_filepath: str = None,
         runtime_config: dict = {},
         logger: Logger = None,
+        wu: "WorkUnit" = None,
     ):
         self.input_wu_filepath = wu_filepath
+        self.wu = wu
         self.runtime_config = runtime_config
         self.result_filepath = result_filepath
         self.logger = logger
 
         self.search_config_filepath = self.runtime_config.get("search_config_filepath", None)
         self.cleanup_wu = self.runtime_config.get("cleanup_wu", False)
+        # The GPU slots are shared by the searches running on the host, see `gpu_slot`.
+        self.gpu_config = self.runtime_config.get("gpu", {})
         self.results_directory = os.path.dirname(self.result_filepath)
 
         # Whether or not to randomize timestamp ordering to create bad searches
@@ -63,22 +75,65 @@ class KBMODSearcher:
         self.disordered_search = self.runtime_config.get("disordered_search", False)
 
     def run_search(self):
+        # CUDA only reads CUDA_VISIBLE_DEVICES when it is initialized, so the GPU is chosen first.
+        pin_gpu(self.gpu_config, logger=self.logger)
+
+        import kbmod
+        from kbmod.search import kb_has_gpu
+
         # Check that KBMOD has access to a GPU before starting the search.
         if not kb_has_gpu():
             raise RuntimeError("Code compiled without GPU support.")
         else:
             self.logger.info("Confirmed GPU avaliable.")
 
+        wu = self.load_work_unit()
+        record_work_unit(wu)
+        self.configure_work_unit(wu)
+
+        self.logger.info("Running KBMOD search")
+        device_bytes = self.estimate_device_bytes(wu)
+        with gpu_slot(device_bytes, self.gpu_config, logger=self.logger) as device:
+            with trace_span("search", logger=self.logger, n_images=len(wu)) as span:
+                if device is not None:
+                    span.set(gpu=device.index, device_bytes=device_bytes)
+                res = kbmod.run_search.SearchRunner().run_search_from_work_unit(wu)
+                span.set(n_results=len(res))
+        self.logger.info("Search complete")
+        self.logger.info(f"Number of results found: {len(res)}")
+
+        self.write_results(res)
+
+        # An in-memory WorkUnit has no shards on disk to clean up.
+        if self.cleanup_wu and self.wu is None:
+            self.cleanup_work_unit()
+
+        return self.result_filepath
+
+    def load_work_unit(self):
+        """Return the in-memory WorkUnit, or read it from its shards."""
+        from kbmod.work_unit import WorkUnit
+
+        if self.wu is not None:
+            return self.wu
+
         self.logger.info("Loading workunit from file")
         directory_containing_shards, wu_filename = os.path.split(self.input_wu_filepath)
-        wu = WorkUnit.from_sharded_fits(wu_filename, directory_containing_shards, lazy=False)
+        with trace_span("wu.load", logger=self.logger, lazy=False) as span:
+            wu = WorkUnit.from_sharded_fits(wu_filename, directory_containing_shards, lazy=False)
+            span.set(n_images=len(wu))
+            if span.recording:
+                span.set(bytes=get_sharded_bytes(self.input_wu_filepath))
         self.logger.debug("Loaded work unit")
+        return wu
 
+    def configure_work_unit(self, wu):
+        """Set the search configuration, and the results location, of the WorkUnit."""
         #! Seems odd that we extract, modify, and reset the config in the workunit.
         #! Can we just modify the config in the workunit directly?
         if self.search_config_filepath is not None:
             # Load a search configuration, otherwise use the one loaded with the work unit
-            wu.config = kbmod.configuration.SearchConfiguration.from_file(self.search_config_filepath)
+            wu.config = load_search_config(self.search_config_filepath)
 
         config = wu.config
 
@@ -96,30 +151,29 @@ class KBMODSearcher:
 
         wu.config = config
 
-        self.logger.info("Running KBMOD search")
-        res = kbmod.run_search.SearchRunner().run_search_from_work_unit(wu)
-        self.logger.info("Search complete")
-        self.logger.info(f"Number of results found: {len(res)}")
-
+    def estimate_device_bytes(self, wu):
+        """Estimate the GPU memory the search of a configured WorkUnit will use."""
+        first_wcs = wu.get_wcs(0) if len(wu) > 0 else None
+        try:
+            results_per_pixel = wu.config["results_per_pixel"]
+        except (KeyError, TypeError):
+            results_per_pixel = None
+        return estimate_search_device_bytes(
+            len(wu), getattr(first_wcs, "array_shape", None), results_per_pixel
+        )
+
+    def write_results(self, res):
+        """Write the search results to the results file."""
         self.logger.info(f"Writing results to output file: {self.result_filepath}")
-        res.write_table(self.result_filepath)
+        with trace_span("results.write", logger=self.logger, n_results=len(res)) as span:
+            res.write_table(self.result_filepath)
+            if span.recording:
+                span.set(bytes=os.path.getsize(self.result_filepath))
         self.logger.info("Results written to file")
 
-        if self.cleanup_wu:
-            self.logger.info(f"Cleaning up sharded WorkUnit {self.input_wu_filepath} with {len(wu)}")
-            # Delete the head filefor the WorkUnit
-            try:
-                os.remove(self.input_wu_filepath)
-            except Exception as e:
-                self.logger.warning(f"Failed to remove {self.input_wu_filepath}: {e}")
-
-            # Delete the individual shards for this WorkUnit, one existing for each image.
-            for i in range(len(wu)):
-                shard_path = os.path.join(directory_containing_shards, f"{i}_{wu_filename}")
-                try:
-                    os.remove(shard_path)
-                except Exception as e:
-                    self.logger.warning(f"Failed to remove WorkUnit shard {shard_path}: {e}")
-            self.logger.info(f"Successfully removed WorkUnit {self.input_wu_filepath}")
-
-        return self.result_filepath
+    def cleanup_work_unit(self):
+        """Queue the sharded WorkUnit that was searched to be removed in the
+        background, so that the worker can take its next task straight away."""
+        self.logger.info(f"Cleaning up sharded WorkUnit {self.input_wu_filepath}")
+        # The head file, and its shards found by listing the directory, are removed by the worker's deleter.
+        get_deleter(logger=self.logger).delete_artifact(self.input_wu_filepath)
@@ -1,16 +1,24 @@
-import kbmod
-from kbmod.work_unit import WorkUnit
-from kbmod.reprojection_utils import transform_wcses_to_ebd
-
-import kbmod.reprojection as reprojection
-from astropy.wcs import WCS
-from astropy.io import fits
-from astropy.coordinates import EarthLocation
-from astropy.time import Time
+from kbmod_wf.utilities.concurrency_utilities import (
+    DEFAULT_MEMORY_FRACTION,
+    DEFAULT_N_WORKERS,
+    resolve_n_workers,
+    resolve_reprojection_workers,
+)
+from kbmod_wf.utilities.ebd_utilities import (
+    DEFAULT_EBD_CACHE_MAX_BYTES,
+    DEFAULT_EBD_SEED,
+    transform_wcses_to_ebd_cached,
+)
+from kbmod_wf.utilities.memory_utilities import record_input_size
+from kbmod_wf.utilities.site_utilities import get_observation_site
+from kbmod_wf.utilities.tracing_utilities import get_sharded_bytes, trace_span
 import numpy as np
 import os
-import time
 from logging import Logger
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from kbmod.work_unit import WorkUnit
 
 
 def reproject_wu(
@@ -19,6 +27,8 @@ def reproject_wu(
     reprojected_wu_filepath: str = None,
     runtime_config: dict = {},
     logger: Logger = None,
+    wu: "WorkUnit" = None,
+    save: bool = True,
 ):
     """This task will perform reflex correction and reproject a WorkUnit to a common WCS.
 
@@ -36,12 +46,18 @@ def reproject_wu(
         Additional configuration parameters to be used at runtime, by default {}
     logger : Logger, optional
         Primary logger for the workflow, by default None
+    wu : WorkUnit, optional
+        An in-memory WorkUnit to reproject instead of reading
+        ``original_wu_filepath``, by default None
+    save : bool, optional
+        Flag to save the reprojected WorkUnit to disk, by default True. If False,
+        the WorkUnit is returned.
 
     Returns
     -------
-    str
+    str | WorkUnit
         The fully resolved filepath of the resulting WorkUnit file after reflex
-        and reprojection.
+        and reprojection, or the WorkUnit object itself if save=False.
     """
     wu_reprojector = WUReprojector(
         original_wu_filepath=original_wu_filepath,
@@ -49,6 +65,8 @@ def reproject_wu(
         reprojected_wu_filepath=reprojected_wu_filepath,
         runtime_config=runtime_config,
         logger=logger,
+        wu=wu,
+        save=save,
     )
 
     return wu_reprojector.reproject_workunit()
@@ -62,19 +80,28 @@ class WUReprojector:
         reprojected_wu_filepath: str = None,
         runtime_config: dict = {},
         logger: Logger = None,
+        wu: "WorkUnit" = None,
+        save: bool = True,
     ):
         self.original_wu_filepath = original_wu_filepath
         self.uri_filepath = uri_filepath
         self.reprojected_wu_filepath = reprojected_wu_filepath
         self.runtime_config = runtime_config
         self.logger = logger
+        self.wu = wu
+        self.save = save
+
+        import kbmod
+
         kbmod._logging.basicConfig(level=self.logger.level)
 
         self.overwrite = self.runtime_config.get("overwrite", False)
         self.search_config = self.runtime_config.get("search_config", None)
 
-        # Default to 8 workers if not in the config. Value must be 0<num workers<65.
-        self.n_workers = max(1, min(self.runtime_config.get("n_workers", 8), 64))
+        # Default to 8 workers if not in the config. Value must be 0<num workers<65, or "auto" to fit
+        # the workers to the CPU and memory limits each time the WorkUnit is reprojected.
+        self.n_workers = self.runtime_config.get("n_workers", DEFAULT_N_WORKERS)
+        self.memory_fraction = self.runtime_config.get("memory_fraction", DEFAULT_MEMORY_FRACTION)
 
         #! In the long run, we likely won't have the URI files to start from
         #! So we'll need to rethink how we get these parameters.
@@ -95,9 +122,22 @@ class WUReprojector:
 
         self.image_width, self.image_height = self._patch_arcmin_to_pixels()
 
-        self.point_on_earth = EarthLocation.of_site(self.runtime_config.get("observation_site", "ctio"))
+        self.point_on_earth = get_observation_site(
+            self.runtime_config.get("observation_site", "ctio"),
+            self.runtime_config.get("site_registry_filepath", None),
+        )
+
+        # The EBD WCS fits are seeded so that they are reproducible, and cached on disk when a
+        # cache directory is configured.
+        self.ebd_seed = self.runtime_config.get("ebd_seed", DEFAULT_EBD_SEED)
+        self.ebd_cache_directory = self.runtime_config.get("ebd_cache_directory", None)
+        self.ebd_cache_max_bytes = self.runtime_config.get("ebd_cache_max_bytes", DEFAULT_EBD_CACHE_MAX_BYTES)
 
     def reproject_workunit(self):
+        import kbmod.reprojection as reprojection
+        from astropy.time import Time
+        from kbmod.work_unit import WorkUnit
+
         # Create a WCS object for the patch. This will be our common reprojection WCS
         self.logger.debug(f"Creating WCS from patch")
         patch_wcs = self._create_wcs_from_corners(
@@ -107,53 +147,90 @@ class WUReprojector:
             pixel_scale=self.pixel_scale,
         )
 
-        last_time = time.time()
-        self.logger.info(f"Lazy reading existing WorkUnit from disk: {self.original_wu_filepath}")
-        directory_containing_shards, wu_filename = os.path.split(self.original_wu_filepath)
-        wu = WorkUnit.from_sharded_fits(wu_filename, directory_containing_shards, lazy=True)
-        elapsed = round(time.time() - last_time, 1)
-        self.logger.debug(
-            f"Required {elapsed}[s] to lazy read original WorkUnit {self.original_wu_filepath}."
-        )
+        wu = self.wu
+        if wu is None:
+            self.logger.info(f"Lazy reading existing WorkUnit from disk: {self.original_wu_filepath}")
+            with trace_span("wu.load", logger=self.logger, lazy=True) as span:
+                directory_containing_shards, wu_filename = os.path.split(self.original_wu_filepath)
+                wu = WorkUnit.from_sharded_fits(wu_filename, directory_containing_shards, lazy=True)
+                span.set(n_images=len(wu))
 
         image_height, image_width = wu.get_wcs(0).array_shape
+        record_input_size(n_images=len(wu), image_height=image_height, image_width=image_width)
 
         # Find the EBD (estimated barycentric distance) WCS for each image
-        last_time = time.time()
-        ebd_per_image_wcs, geocentric_dists = transform_wcses_to_ebd(
-            [wu.get_wcs(i) for i in range(len(wu))],
-            image_width,
-            image_height,
-            self.guess_dist,
-            Time(wu.get_all_obstimes(), format="mjd"),
-            self.point_on_earth,
-            npoints=10,
-            seed=None,
-        )
-        elapsed = round(time.time() - last_time, 1)
-        self.logger.debug(f"Required {elapsed}[s] to transform WCS objects to EBD..")
+        with trace_span("ebd.transform", logger=self.logger, n_images=len(wu), guess_dist=self.guess_dist):
+            ebd_per_image_wcs, geocentric_dists = transform_wcses_to_ebd_cached(
+                [wu.get_wcs(i) for i in range(len(wu))],
+                image_width,
+                image_height,
+                self.guess_dist,
+                Time(wu.get_all_obstimes(), format="mjd"),
+                self.point_on_earth,
+                npoints=10,
+                seed=self.ebd_seed,
+                cache_directory=self.ebd_cache_directory,
+                max_cache_bytes=self.ebd_cache_max_bytes,
+                n_workers=resolve_n_workers(
+                    self.n_workers, n_tasks=len(wu), memory_fraction=self.memory_fraction
+                ),
+                logger=self.logger,
+            )
 
         wu.org_img_meta["ebd_wcs"] = ebd_per_image_wcs
         wu.barycentric_distance = self.guess_dist
         wu.org_img_meta["geocentric_distance"] = geocentric_dists
 
         # Reproject to a common WCS using the WCS for our patch
-        self.logger.debug(f"Reprojecting WorkUnit with {self.n_workers} workers...")
-        last_time = time.time()
+        n_workers = resolve_reprojection_workers(
+            self.n_workers,
+            len(wu),
+            image_shape=(image_height, image_width),
+            patch_shape=(self.image_height, self.image_width),
+            in_memory=self.wu is not None,
+            memory_fraction=self.memory_fraction,
+            logger=self.logger,
+        )
+        self.logger.debug(f"Reprojecting WorkUnit with {n_workers} workers...")
+        n_pixels = len(wu) * image_height * image_width
 
         directory_containing_reprojected_shards, reprojected_wu_filename = os.path.split(
             self.reprojected_wu_filepath
         )
-        reprojection.reproject_lazy_work_unit(
-            wu,
-            patch_wcs,
-            directory_containing_reprojected_shards,
-            reprojected_wu_filename,
-            frame="ebd",
-            max_parallel_processes=self.n_workers,
-        )
-        elapsed = round(time.time() - last_time, 1)
-        self.logger.debug(f"Required {elapsed}[s] to create the sharded reprojected WorkUnit.")
+
+        if self.wu is not None:
+            # The pixels are already in memory, so there is nothing to gain from lazy reprojection.
+            with trace_span("wu.reproject", logger=self.logger, n_images=len(wu), n_pixels=n_pixels):
+                resampled_wu = reprojection.reproject_work_unit(
+                    wu,
+                    patch_wcs,
+                    parallelize=True,
+                    frame="ebd",
+                    max_parallel_processes=n_workers,
+                )
+
+            if not self.save:
+                return resampled_wu
+            with trace_span("wu.write_shards", logger=self.logger, n_images=len(resampled_wu)) as span:
+                resampled_wu.to_sharded_fits(
+                    reprojected_wu_filename, directory_containing_reprojected_shards, overwrite=True
+                )
+                if span.recording:
+                    span.set(bytes=get_sharded_bytes(self.reprojected_wu_filepath))
+            return self.reprojected_wu_filepath
+
+        # The lazy reprojection reads, reprojects and writes each shard in turn.
+        with trace_span("wu.reproject_lazy", logger=self.logger, n_images=len(wu), n_pixels=n_pixels) as span:
+            reprojection.reproject_lazy_work_unit(
+                wu,
+                patch_wcs,
+                directory_containing_reprojected_shards,
+                reprojected_wu_filename,
+                frame="ebd",
+                max_parallel_processes=n_workers,
+            )
+            if span.recording:
+                span.set(bytes=get_sharded_bytes(self.reprojected_wu_filepath))
 
         return self.reprojected_wu_filepath
 
@@ -232,6 +309,8 @@ class WUReprojector:
 
         5/6/2024 COC + ChatGPT4
         """
+        from astropy.wcs import WCS
+
         # TODO switch to https://docs.astropy.org/en/stable/api/astropy.wcs.utils.fit_wcs_from_points.html
         # Extract the corners
         if verbose:
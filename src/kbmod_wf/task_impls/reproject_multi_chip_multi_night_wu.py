@@ -1,19 +1,25 @@
-import kbmod
-from kbmod import ImageCollection
-from kbmod.work_unit import WorkUnit
-from kbmod.reprojection_utils import transform_wcses_to_ebd
-
-
-import kbmod.reprojection as reprojection
 from kbmod_wf.task_impls.ic_to_wu import ic_to_wu
-from astropy.wcs import WCS
-from astropy.io import fits
-from astropy.coordinates import EarthLocation
-from astropy.time import Time
-import numpy as np
+from kbmod_wf.utilities.concurrency_utilities import (
+    DEFAULT_MEMORY_FRACTION,
+    DEFAULT_N_WORKERS,
+    resolve_n_workers,
+    resolve_reprojection_workers,
+)
+from kbmod_wf.utilities.ebd_utilities import (
+    DEFAULT_EBD_CACHE_MAX_BYTES,
+    DEFAULT_EBD_SEED,
+    transform_wcses_to_ebd_cached,
+)
+from kbmod_wf.utilities.memory_utilities import record_input_size
+from kbmod_wf.utilities.site_utilities import get_observation_site
+from kbmod_wf.utilities.tracing_utilities import get_sharded_bytes, trace_span
+import copy
 import os
-import time
 from logging import Logger
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from kbmod.work_unit import WorkUnit
 
 
 def reproject_wu(
@@ -22,6 +28,8 @@ def reproject_wu(
     reprojected_wu_filepath: str = None,
     runtime_config: dict = {},
     logger: Logger = None,
+    wu: "WorkUnit" = None,
+    save: bool = True,
 ):
     """This task will perform reflex correction and reproject a WorkUnit to a common WCS.
 
@@ -38,12 +46,18 @@ def reproject_wu(
         Additional configuration parameters to be used at runtime, by default {}
     logger : Logger, optional
         Primary logger for the workflow, by default None
+    wu : WorkUnit, optional
+        An in-memory WorkUnit, built from ``ic_filepath``, to reproject instead
+        of building a new one, by default None
+    save : bool, optional
+        Flag to save the reprojected WorkUnit to disk, by default True. If False,
+        the WorkUnit is returned.
 
     Returns
     -------
-    str
+    str | WorkUnit
         The fully resolved filepath of the resulting WorkUnit file after reflex
-        and reprojection.
+        and reprojection, or the WorkUnit object itself if save=False.
     """
     wu_reprojector = WUReprojector(
         guess_dist=guess_dist,
@@ -51,11 +65,59 @@ def reproject_wu(
         reprojected_wu_filepath=reprojected_wu_filepath,
         runtime_config=runtime_config,
         logger=logger,
+        wu=wu,
+        save=save,
     )
 
     return wu_reprojector.reproject_workunit()
 
 
+def reproject_wu_to_distances(
+    guess_dists: list,
+    ic_filepath: str,
+    reprojected_wu_filepaths: list,
+    runtime_config: dict = None,
+    logger: Logger = None,
+):
+    """This task will build a WorkUnit from an ImageCollection once, then perform
+    reflex correction and reproject it for each of several heliocentric guess
+    distances, writing one reprojected WorkUnit per distance.
+
+    Parameters
+    ----------
+    guess_dists: list[float]
+        The heliocentric guess distances to reproject to in AU.
+    ic_filepath : str
+        The fully resolved filepath to the input ImageCollection file
+    reprojected_wu_filepaths : list[str]
+        The fully resolved filepath of the resulting WorkUnit file for each of
+        the guess distances.
+    runtime_config : dict, optional
+        Additional configuration parameters to be used at runtime, by default None
+    logger : Logger, optional
+        Primary logger for the workflow, by default None
+
+    Returns
+    -------
+    list[str]
+        The fully resolved filepaths of the resulting WorkUnit files.
+    """
+    if len(guess_dists) != len(reprojected_wu_filepaths):
+        raise ValueError(
+            f"Received {len(guess_dists)} guess distances "
+            f"but {len(reprojected_wu_filepaths)} output filepaths."
+        )
+
+    wu_reprojector = WUReprojector(
+        guess_dist=None,
+        ic_filepath=ic_filepath,
+        runtime_config=runtime_config if runtime_config is not None else {},
+        logger=logger,
+    )
+
+    return wu_reprojector.reproject_workunit_to_distances(guess_dists, reprojected_wu_filepaths)
+
+
 class WUReprojector:
     def __init__(
         self,
@@ -64,83 +126,166 @@ class WUReprojector:
         reprojected_wu_filepath: str = None,
         runtime_config: dict = {},
         logger: Logger = None,
+        wu: "WorkUnit" = None,
+        save: bool = True,
     ):
         self.guess_dist = guess_dist
         self.ic_filepath = ic_filepath
         self.reprojected_wu_filepath = reprojected_wu_filepath
         self.runtime_config = runtime_config
         self.logger = logger
+        self.wu = wu
+        self.save = save
+
+        import kbmod
+
         kbmod._logging.basicConfig(level=self.logger.level)
 
         self.overwrite = self.runtime_config.get("overwrite", True)
         self.search_config = self.runtime_config.get("search_config", None)
 
-        # Default to 8 workers if not in the config. Value must be 0<num workers<65.
-        self.n_workers = max(1, min(self.runtime_config.get("n_workers", 8), 64))
+        # Default to 8 workers if not in the config. Value must be 0<num workers<65, or "auto" to fit
+        # the workers to the CPU and memory limits each time the WorkUnit is reprojected.
+        self.n_workers = self.runtime_config.get("n_workers", DEFAULT_N_WORKERS)
+        self.memory_fraction = self.runtime_config.get("memory_fraction", DEFAULT_MEMORY_FRACTION)
 
-        self.point_on_earth = EarthLocation.of_site(self.runtime_config.get("observation_site", "ctio"))
+        self.point_on_earth = get_observation_site(
+            self.runtime_config.get("observation_site", "ctio"),
+            self.runtime_config.get("site_registry_filepath", None),
+        )
+
+        # The EBD WCS fits are seeded so that they are reproducible, and cached on disk when a
+        # cache directory is configured.
+        self.ebd_seed = self.runtime_config.get("ebd_seed", DEFAULT_EBD_SEED)
+        self.ebd_cache_directory = self.runtime_config.get("ebd_cache_directory", None)
+        self.ebd_cache_max_bytes = self.runtime_config.get("ebd_cache_max_bytes", DEFAULT_EBD_CACHE_MAX_BYTES)
 
     def reproject_workunit(self):
-        last_time = time.time()
+        from kbmod import ImageCollection
+
+        with trace_span("ic.read", logger=self.logger):
+            ic = ImageCollection.read(self.ic_filepath, format="ascii.ecsv")
+        wu = self.wu if self.wu is not None else self._create_work_unit(ic)
+        return self._reproject_to_distance(
+            wu, self._get_common_wcs(ic), self.guess_dist, self.reprojected_wu_filepath, save=self.save
+        )
+
+    def reproject_workunit_to_distances(self, guess_dists, reprojected_wu_filepaths):
+        """Build the original WorkUnit once, and reproject it to each of the
+        heliocentric guess distances in turn.
+
+        Parameters
+        ----------
+        guess_dists : list[float]
+            The heliocentric guess distances to reproject to in AU.
+        reprojected_wu_filepaths : list[str]
+            The fully resolved filepath of the reprojected WorkUnit for each distance.
+
+        Returns
+        -------
+        list[str]
+            The fully resolved filepaths of the reprojected WorkUnit files.
+        """
+        from kbmod import ImageCollection
+
+        with trace_span("ic.read", logger=self.logger):
+            ic = ImageCollection.read(self.ic_filepath, format="ascii.ecsv")
+        wu = self.wu if self.wu is not None else self._create_work_unit(ic)
+        common_wcs = self._get_common_wcs(ic)
+        for guess_dist, reprojected_wu_filepath in zip(guess_dists, reprojected_wu_filepaths, strict=True):
+            self._reproject_to_distance(wu, common_wcs, guess_dist, reprojected_wu_filepath, save=True)
+        return reprojected_wu_filepaths
+
+    def _create_work_unit(self, ic):
         self.logger.info(f"Loading a WorkUnit from ImageCollection at {self.ic_filepath}")
-        wu = ic_to_wu(
+        return ic_to_wu(
             ic_filepath=self.ic_filepath,
             wu_filepath=None,
             save=False,
             runtime_config=self.runtime_config,
             logger=self.logger,
+            ic=ic,
         )
-        elapsed = round(time.time() - last_time, 1)
-        self.logger.debug(
-            f"Required {elapsed}[s] to create original WorkUnit from ImageCollection at {self.ic_filepath}."
+
+    def _get_common_wcs(self, ic):
+        from astropy.wcs import WCS
+
+        # Pick the first global WCS and pixel shape from the ImageCollection
+        common_wcs = WCS(ic.data["global_wcs"][0])
+        common_wcs.pixel_shape = (
+            ic.data["global_wcs_pixel_shape_0"][0],
+            ic.data["global_wcs_pixel_shape_1"][0],
         )
+        return common_wcs
+
+    def _reproject_to_distance(self, wu, common_wcs, guess_dist, reprojected_wu_filepath, save=True):
+        import kbmod.reprojection as reprojection
+        from astropy.time import Time
 
         #! This method to get image dimensions won't hold if the images are different sizes.
         image_height, image_width = wu.get_wcs(0).array_shape
+        record_input_size(n_images=len(wu), image_height=image_height, image_width=image_width)
 
         # Find the EBD (estimated barycentric distance) WCS for each image
-        last_time = time.time()
-        ebd_per_image_wcs, geocentric_dists = transform_wcses_to_ebd(
-            [wu.get_wcs(i) for i in range(len(wu))],
-            image_width,
-            image_height,
-            self.guess_dist,  # heliocentric guess distance in AU
-            Time(wu.get_all_obstimes(), format="mjd"),
-            self.point_on_earth,
-            npoints=10,
-            seed=None,
-        )
-        elapsed = round(time.time() - last_time, 1)
-        self.logger.debug(f"Required {elapsed}[s] to transform WCS objects to EBD..")
+        with trace_span("ebd.transform", logger=self.logger, n_images=len(wu), guess_dist=guess_dist):
+            ebd_per_image_wcs, geocentric_dists = transform_wcses_to_ebd_cached(
+                [wu.get_wcs(i) for i in range(len(wu))],
+                image_width,
+                image_height,
+                guess_dist,  # heliocentric guess distance in AU
+                Time(wu.get_all_obstimes(), format="mjd"),
+                self.point_on_earth,
+                npoints=10,
+                seed=self.ebd_seed,
+                cache_directory=self.ebd_cache_directory,
+                max_cache_bytes=self.ebd_cache_max_bytes,
+                n_workers=resolve_n_workers(
+                    self.n_workers, n_tasks=len(wu), memory_fraction=self.memory_fraction
+                ),
+                logger=self.logger,
+            )
 
+        # The EBD WCSes are only valid for this distance, so they are set on a copy of the
+        # WorkUnit that shares its images, leaving the original as it was for the next distance.
+        wu = copy.copy(wu)
+        wu.org_img_meta = wu.org_img_meta.copy(copy_data=False)
         wu.org_img_meta["ebd_wcs"] = ebd_per_image_wcs
-        wu.barycentric_distance = self.guess_dist
+        wu.barycentric_distance = guess_dist
         wu.org_img_meta["geocentric_distance"] = geocentric_dists
 
-        # Reproject to a common WCS using the WCS for our patch
-        self.logger.debug(f"Reprojecting WorkUnit with {self.n_workers} workers...")
-        last_time = time.time()
-
-        # Use the global WCS that was specified from the ImageCollection.
-        ic = ImageCollection.read(self.ic_filepath, format="ascii.ecsv")
-
-        # Pick the first global WCS and pixel shape from the ImageCollection
-        common_wcs = WCS(ic.data["global_wcs"][0])
-        common_wcs.pixel_shape = (
-            ic.data["global_wcs_pixel_shape_0"][0],
-            ic.data["global_wcs_pixel_shape_1"][0],
+        # Reproject to a common WCS using the global WCS that was specified in the ImageCollection.
+        # With "auto", the workers are fit to the memory available before each distance.
+        n_workers = resolve_reprojection_workers(
+            self.n_workers,
+            len(wu),
+            image_shape=(image_height, image_width),
+            patch_shape=common_wcs.array_shape,
+            in_memory=True,
+            memory_fraction=self.memory_fraction,
+            logger=self.logger,
         )
+        self.logger.debug(f"Reprojecting WorkUnit to {guess_dist} AU with {n_workers} workers...")
+        with trace_span(
+            "wu.reproject",
+            logger=self.logger,
+            n_images=len(wu),
+            n_pixels=len(wu) * image_height * image_width,
+            guess_dist=guess_dist,
+        ):
+            resampled_wu = reprojection.reproject_work_unit(
+                wu,
+                common_wcs,
+                parallelize=True,
+                frame="ebd",
+                max_parallel_processes=n_workers,
+            )
+        if not save:
+            return resampled_wu
 
-        resampled_wu = reprojection.reproject_work_unit(
-            wu,
-            common_wcs,
-            parallelize=True,
-            frame="ebd",
-            max_parallel_processes=self.n_workers,
-        )
-        directory_containing_shards, wu_filename = os.path.split(self.reprojected_wu_filepath)
-        resampled_wu.to_sharded_fits(wu_filename, directory_containing_shards, overwrite=self.overwrite)
-        elapsed = round(time.time() - last_time, 1)
-        self.logger.debug(f"Required {elapsed}[s] to create the sharded reprojected WorkUnit.")
+        with trace_span("wu.write_shards", logger=self.logger, n_images=len(resampled_wu)) as span:
+            directory_containing_shards, wu_filename = os.path.split(reprojected_wu_filepath)
+            resampled_wu.to_sharded_fits(wu_filename, directory_containing_shards, overwrite=self.overwrite)
+            if span.recording:
+                span.set(bytes=get_sharded_bytes(reprojected_wu_filepath))
 
-        return self.reprojected_wu_filepath
+        return reprojected_wu_filepath
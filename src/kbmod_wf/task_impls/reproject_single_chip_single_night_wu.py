@@ -1,12 +1,16 @@
-import kbmod
-from kbmod.work_unit import WorkUnit
-
-import kbmod.reprojection as reprojection
-
-from reproject.mosaicking import find_optimal_celestial_wcs
+from kbmod_wf.utilities.concurrency_utilities import (
+    DEFAULT_MEMORY_FRACTION,
+    DEFAULT_N_WORKERS,
+    resolve_reprojection_workers,
+)
+from kbmod_wf.utilities.memory_utilities import record_work_unit
+from kbmod_wf.utilities.tracing_utilities import get_sharded_bytes, trace_span
 import os
-import time
 from logging import Logger
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from kbmod.work_unit import WorkUnit
 
 
 def reproject_wu(
@@ -14,6 +18,8 @@ def reproject_wu(
     reprojected_wu_filepath: str = None,
     runtime_config: dict = {},
     logger: Logger = None,
+    wu: "WorkUnit" = None,
+    save: bool = True,
 ):
     """This task will reproject a WorkUnit to a common WCS.
 
@@ -28,18 +34,26 @@ def reproject_wu(
         Additional configuration parameters to be used at runtime, by default {}
     logger : Logger, optional
         Primary logger for the workflow, by default None
+    wu : WorkUnit, optional
+        An in-memory WorkUnit to reproject instead of reading
+        ``original_wu_filepath``, by default None
+    save : bool, optional
+        Flag to save the reprojected WorkUnit to disk, by default True. If False,
+        the WorkUnit is returned.
 
     Returns
     -------
-    str
+    str | WorkUnit
         The fully resolved filepath of the resulting WorkUnit file after reflex
-        and reprojection.
+        and reprojection, or the WorkUnit object itself if save=False.
     """
     wu_reprojector = WUReprojector(
         original_wu_filepath=original_wu_filepath,
         reprojected_wu_filepath=reprojected_wu_filepath,
         runtime_config=runtime_config,
         logger=logger,
+        wu=wu,
+        save=save,
     )
 
     return wu_reprojector.reproject_workunit()
@@ -52,43 +66,78 @@ class WUReprojector:
         reprojected_wu_filepath: str = None,
         runtime_config: dict = {},
         logger: Logger = None,
+        wu: "WorkUnit" = None,
+        save: bool = True,
     ):
         self.original_wu_filepath = original_wu_filepath
         self.reprojected_wu_filepath = reprojected_wu_filepath
         self.runtime_config = runtime_config
         self.logger = logger
+        self.wu = wu
+        self.save = save
 
-        # Default to 8 workers if not in the config. Value must be 0<num workers<65.
-        self.n_workers = max(1, min(self.runtime_config.get("n_workers", 8), 64))
+        # Default to 8 workers if not in the config. Value must be 0<num workers<65, or "auto" to fit
+        # the workers to the CPU and memory limits each time the WorkUnit is reprojected.
+        self.n_workers = self.runtime_config.get("n_workers", DEFAULT_N_WORKERS)
+        self.memory_fraction = self.runtime_config.get("memory_fraction", DEFAULT_MEMORY_FRACTION)
 
     def reproject_workunit(self):
-        last_time = time.time()
-        self.logger.info(f"Lazy reading existing WorkUnit from disk: {self.original_wu_filepath}")
-        directory_containing_shards, wu_filename = os.path.split(self.original_wu_filepath)
-        wu = WorkUnit.from_sharded_fits(wu_filename, directory_containing_shards, lazy=True)
-        elapsed = round(time.time() - last_time, 1)
-        self.logger.info(f"Required {elapsed}[s] to lazy read original WorkUnit {self.original_wu_filepath}.")
+        import kbmod.reprojection as reprojection
+        from kbmod.work_unit import WorkUnit
+        from reproject.mosaicking import find_optimal_celestial_wcs
+
+        wu = self.wu
+        if wu is None:
+            self.logger.info(f"Lazy reading existing WorkUnit from disk: {self.original_wu_filepath}")
+            with trace_span("wu.load", logger=self.logger, lazy=True) as span:
+                directory_containing_shards, wu_filename = os.path.split(self.original_wu_filepath)
+                wu = WorkUnit.from_sharded_fits(wu_filename, directory_containing_shards, lazy=True)
+                span.set(n_images=len(wu))
+        record_work_unit(wu)
 
         directory_containing_reprojected_shards, reprojected_wu_filename = os.path.split(
             self.reprojected_wu_filepath
         )
 
         # Reproject to a common WCS using the WCS for our patch
-        self.logger.info(f"Reprojecting WorkUnit with {self.n_workers} workers...")
-        last_time = time.time()
-
-        opt_wcs, shape = find_optimal_celestial_wcs(list(wu._per_image_wcs))
-        opt_wcs.array_shape = shape
-        reprojection.reproject_work_unit(
-            wu,
-            opt_wcs,
-            max_parallel_processes=self.n_workers,
-            write_output=True,
-            directory=directory_containing_reprojected_shards,
-            filename=reprojected_wu_filename,
+        with trace_span("wcs.find_optimal", logger=self.logger, n_images=len(wu)):
+            opt_wcs, shape = find_optimal_celestial_wcs(list(wu._per_image_wcs))
+            opt_wcs.array_shape = shape
+        n_pixels = len(wu) * shape[0] * shape[1]
+
+        first_wcs = wu.get_wcs(0) if len(wu) > 0 else None
+        n_workers = resolve_reprojection_workers(
+            self.n_workers,
+            len(wu),
+            image_shape=getattr(first_wcs, "array_shape", None),
+            patch_shape=shape,
+            in_memory=not self.save,
+            memory_fraction=self.memory_fraction,
+            logger=self.logger,
         )
-
-        elapsed = round(time.time() - last_time, 1)
-        self.logger.info(f"Required {elapsed}[s] to create the sharded reprojected WorkUnit.")
+        self.logger.info(f"Reprojecting WorkUnit with {n_workers} workers...")
+
+        if not self.save:
+            with trace_span("wu.reproject", logger=self.logger, n_images=len(wu), n_pixels=n_pixels):
+                return reprojection.reproject_work_unit(
+                    wu,
+                    opt_wcs,
+                    max_parallel_processes=n_workers,
+                )
+
+        # The reprojected shards are written as they are reprojected.
+        with trace_span(
+            "wu.reproject_write", logger=self.logger, n_images=len(wu), n_pixels=n_pixels
+        ) as span:
+            reprojection.reproject_work_unit(
+                wu,
+                opt_wcs,
+                max_parallel_processes=n_workers,
+                write_output=True,
+                directory=directory_containing_reprojected_shards,
+                filename=reprojected_wu_filename,
+            )
+            if span.recording:
+                span.set(bytes=get_sharded_bytes(self.reprojected_wu_filepath))
 
         return self.reprojected_wu_filepath
@@ -1,8 +1,16 @@
 import os
-import glob
-import time
 from logging import Logger
-from kbmod import ImageCollection
+from kbmod_wf.utilities.image_collection_utilities import (
+    DEFAULT_HEADER_CACHE_MAX_BYTES,
+    DEFAULT_HEADER_WORKERS,
+    build_image_collection,
+)
+from kbmod_wf.utilities.memory_utilities import record_input_size
+from kbmod_wf.utilities.tracing_utilities import trace_span
+from kbmod_wf.utilities.uri_utilities import DEFAULT_N_THREADS, DirectoryIndex, resolve_uris
+
+MAX_MISSING_REPORTED = 20
+"""The most missing files named in the error, all of them are logged."""
 
 
 #! I believe that we can remove the `uris_base_dir` parameter from the function
@@ -29,7 +37,10 @@ def uri_to_ic(
         The fully resolved path to the output file where the ImageCollection will
         be saved, by default None
     runtime_config : dict, optional
-        Any parameters that must be set for this work to be performed, by default {}
+        Any parameters that must be set for this work to be performed, e.g.
+        ``n_threads`` to check that the files exist with, and ``header_workers``,
+        ``header_pool`` and ``header_cache_directory`` to read the headers of
+        the files with, see `build_image_collection`, by default {}
     logger : Logger, optional
         The logger to use for this work, by default None
 
@@ -38,8 +49,9 @@ def uri_to_ic(
     ValueError
         If a non-existent URIs base directory is provided
     FileNotFoundError
-        If we're unable to find a file referenced by a URI in the target_uris_file
-        after the URI has been cleaned up, and full path has been built
+        If we're unable to find any of the files referenced by a URI in the
+        target_uris_file after the URI has been cleaned up, and full path has
+        been built. Every missing file is reported.
     """
 
     # Load the list of images from our saved file "sample_uris.txt"
@@ -59,33 +71,34 @@ def uri_to_ic(
             logger.error(f"Invalid URIS base directory provided: {uris_base_dir}")
             raise ValueError(f"Invalid URIS base directory provided: {uris_base_dir}")
 
-    # Clean up the URI strings
-    for i in range(len(uris)):
-        # clean up character encoding
-        curr = uris[i].replace("%23", "#").strip()
-
-        # strip off the file:// prefix if it exists
-        file_prefix = "file://"
-        if curr.startswith(file_prefix):
-            curr = curr[len(file_prefix) :]
-
-        # if a base directory is provided, prepend it to the URI
-        if uris_base_dir is not None:
-            curr = os.path.join(uris_base_dir, curr.lstrip(os.path.sep))
-
-        # check if the file exists
-        if len(glob.glob(curr)) == 0:
-            logger.error(f"Could not find file: {curr}.")
-            raise FileNotFoundError(f"Could not find file: {curr}.")
+    # Clean up the URI strings, and check that every file exists, listing each directory once.
+    index = DirectoryIndex()
+    with trace_span("uris.resolve", logger=logger, n_images=len(uris)) as span:
+        uris, missing = resolve_uris(
+            uris, uris_base_dir, n_threads=runtime_config.get("n_threads", DEFAULT_N_THREADS), index=index
+        )
+        span.set(n_directories=len(index), n_missing=len(missing))
 
-        uris[i] = curr
+    if missing:
+        for filepath in missing:
+            logger.error(f"Could not find file: {filepath}.")
+        reported = ", ".join(missing[:MAX_MISSING_REPORTED])
+        if len(missing) > MAX_MISSING_REPORTED:
+            reported += f" and {len(missing) - MAX_MISSING_REPORTED} more"
+        raise FileNotFoundError(f"Could not find {len(missing)} of {len(uris)} files: {reported}.")
 
     logger.info("Creating ImageCollection")
     # Create an ImageCollection object from the list of URIs
-    last_time = time.time()
-    ic = ImageCollection.fromTargets(uris)
-    elapsed = round(time.time() - last_time, 1)
-    logger.debug(f"Required {elapsed}[s] to create ImageCollection.")
+    with trace_span("ic.create", logger=logger, n_images=len(uris)):
+        ic = build_image_collection(
+            uris,
+            n_workers=runtime_config.get("header_workers", DEFAULT_HEADER_WORKERS),
+            pool=runtime_config.get("header_pool", "thread"),
+            cache_directory=runtime_config.get("header_cache_directory"),
+            max_cache_bytes=runtime_config.get("header_cache_max_bytes", DEFAULT_HEADER_CACHE_MAX_BYTES),
+            logger=logger,
+        )
 
     logger.info(f"Writing ImageCollection to file {ic_filepath}")
+    record_input_size(n_images=len(ic))
     ic.write(ic_filepath, format="ascii.ecsv")
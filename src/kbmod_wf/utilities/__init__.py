@@ -1,4 +1,19 @@
-from .configuration_utilities import get_resource_config, apply_runtime_updates
-from .executor_utilities import get_executors
+import importlib
+
 from .logger_utilities import *
-from .memoization_utilities import id_for_memo_file
+
+# These pull in parsl and the resource configurations, so they are only
+# imported when they are first used, see `kbmod_wf.utilities.import_utilities`.
+_LAZY_ATTRIBUTES = {
+    "get_resource_config": "configuration_utilities",
+    "apply_runtime_updates": "configuration_utilities",
+    "get_executors": "executor_utilities",
+    "id_for_memo_file": "memoization_utilities",
+    "wait_for_futures": "future_utilities",
+}
+
+
+def __getattr__(name):
+    if name in _LAZY_ATTRIBUTES:
+        return getattr(importlib.import_module(f".{_LAZY_ATTRIBUTES[name]}", __name__), name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,215 @@
+import threading
+import time
+from contextlib import contextmanager
+
+from kbmod_wf.utilities.tracing_utilities import trace_span
+
+__all__ = ["ButlerPool", "borrow_butler", "get_butler", "invalidate_butlers"]
+
+
+DEFAULT_MAX_BUTLERS = 4
+"""Default number of Butlers kept alive by a pool, each holds its own registry connection."""
+
+
+def _create_butler(repo, collections=None):
+    from lsst.daf.butler import Butler
+
+    return Butler(repo, collections=collections)
+
+
+def _check_butler(butler):
+    # Refreshing the registry caches fails if the registry database can no longer be reached.
+    butler.registry.refresh()
+
+
+class ButlerPool:
+    """Keeps Butler instances alive for the lifetime of a worker process, so
+    that the cost of instantiating a Butler is paid once per worker rather than
+    once per task.
+
+    Parameters
+    ----------
+    factory : callable, optional
+        Called with ``(repo, collections)`` to create a new Butler, by default
+        None, which creates an `lsst.daf.butler.Butler`.
+    health_check : callable, optional
+        Called with a pooled Butler before it is reused, and should raise if the
+        Butler is no longer usable, by default None, which refreshes the registry.
+    health_check_interval : float, optional
+        Seconds that a pooled Butler may go unused before it is health checked
+        again, by default 60.0. 0 checks it before every reuse.
+    max_size : int, optional
+        The most Butlers kept in the pool, the least recently used is dropped
+        to make room for a new one, by default DEFAULT_MAX_BUTLERS
+    """
+
+    def __init__(
+        self, factory=None, health_check=None, health_check_interval=60.0, max_size=DEFAULT_MAX_BUTLERS
+    ):
+        if max_size < 1:
+            raise ValueError(f"A ButlerPool must hold at least one Butler, not {max_size}.")
+
+        self.factory = factory if factory is not None else _create_butler
+        self.health_check = health_check if health_check is not None else _check_butler
+        self.health_check_interval = health_check_interval
+        self.max_size = max_size
+
+        self._lock = threading.Lock()
+        self._key_locks = {}
+        self._butlers = {}
+        self._last_used = {}
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def _key(repo, collections):
+        if isinstance(collections, str):
+            collections = [collections]
+        return (repo, tuple(collections) if collections is not None else None)
+
+    def get(self, repo, collections=None, logger=None):
+        """Return a pooled Butler for a repository, creating it if required.
+
+        Parameters
+        ----------
+        repo : str
+            The Butler repository, or the path to its configuration file.
+        collections : str | list[str], optional
+            The default collections of the Butler, by default None
+        logger : logging.Logger, optional
+            Logger used to report on the pool, by default None
+
+        Returns
+        -------
+        lsst.daf.butler.Butler
+            The Butler.
+        """
+        key = self._key(repo, collections)
+        # Only one Butler is created, or checked, at a time for a key, without
+        # holding up the tasks that use the Butlers of the other keys.
+        with self._get_key_lock(key):
+            with self._lock:
+                butler = self._butlers.get(key)
+                stale = (
+                    butler is not None
+                    and time.monotonic() - self._last_used[key] >= self.health_check_interval
+                )
+
+            if stale:
+                try:
+                    self.health_check(butler)
+                except Exception as e:
+                    if logger is not None:
+                        logger.warning(
+                            f"Discarding pooled butler for {repo} that failed its health check: {e}"
+                        )
+                    butler = None
+
+            if butler is None:
+                with trace_span("butler.create", logger=logger, repo=repo):
+                    butler = self.factory(repo, collections)
+                with self._lock:
+                    self.misses += 1
+                    self._butlers.pop(key, None)
+                    while len(self._butlers) >= self.max_size:
+                        # Dicts keep their insertion order, and a reused Butler is moved to the end.
+                        evicted = next(iter(self._butlers))
+                        del self._butlers[evicted]
+                        del self._last_used[evicted]
+                        if logger is not None:
+                            logger.debug(f"Dropping the least recently used pooled butler for {evicted[0]}.")
+                    self._butlers[key] = butler
+                    self._last_used[key] = time.monotonic()
+                return butler
+
+            with self._lock:
+                self.hits += 1
+                # It may have been evicted, or dropped after failing a task, while it was checked.
+                if self._butlers.get(key) is butler:
+                    self._butlers[key] = self._butlers.pop(key)
+                    self._last_used[key] = time.monotonic()
+            if logger is not None:
+                logger.debug(f"Reusing pooled butler for {repo}.")
+            return butler
+
+    def _get_key_lock(self, key):
+        with self._lock:
+            return self._key_locks.setdefault(key, threading.Lock())
+
+    @contextmanager
+    def borrow(self, repo, collections=None, logger=None):
+        """Use a pooled Butler, dropping it from the pool if an exception is raised
+        while it is in use, so that a Butler that may be in a bad state isn't
+        handed to the next task.
+
+        Parameters
+        ----------
+        repo : str
+            The Butler repository, or the path to its configuration file.
+        collections : str | list[str], optional
+            The default collections of the Butler, by default None
+        logger : logging.Logger, optional
+            Logger used to report on the pool, by default None
+
+        Yields
+        ------
+        lsst.daf.butler.Butler
+            The Butler.
+        """
+        butler = self.get(repo, collections=collections, logger=logger)
+        try:
+            yield butler
+        except BaseException:
+            key = self._key(repo, collections)
+            with self._lock:
+                # Another task may already have replaced it.
+                if self._butlers.get(key) is butler:
+                    del self._butlers[key]
+                    del self._last_used[key]
+            raise
+
+    def invalidate(self, repo=None, collections=None):
+        """Drop pooled Butlers, so that the next request creates a new one.
+
+        Parameters
+        ----------
+        repo : str, optional
+            Only drop the Butlers for this repository, by default None, all of them.
+        collections : str | list[str], optional
+            With ``repo``, only drop the Butler with these default collections,
+            by default None, any collections.
+        """
+        with self._lock:
+            if repo is None:
+                keys = list(self._butlers)
+            elif collections is None:
+                keys = [key for key in self._butlers if key[0] == repo]
+            else:
+                keys = [self._key(repo, collections)]
+
+            for key in keys:
+                self._butlers.pop(key, None)
+                self._last_used.pop(key, None)
+
+    def __len__(self):
+        """The number of pooled Butlers."""
+        return len(self._butlers)
+
+
+_POOL = ButlerPool()
+"""The pool shared by every task that runs in this worker process."""
+
+
+def get_butler(repo, collections=None, logger=None):
+    """Return the worker's pooled Butler for a repository, see `ButlerPool.get`."""
+    return _POOL.get(repo, collections=collections, logger=logger)
+
+
+def borrow_butler(repo, collections=None, logger=None):
+    """Use the worker's pooled Butler for a repository, see `ButlerPool.borrow`."""
+    return _POOL.borrow(repo, collections=collections, logger=logger)
+
+
+def invalidate_butlers(repo=None, collections=None):
+    """Drop the worker's pooled Butlers, see `ButlerPool.invalidate`."""
+    _POOL.invalidate(repo=repo, collections=collections)
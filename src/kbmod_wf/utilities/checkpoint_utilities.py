@@ -0,0 +1,419 @@
+import argparse
+import inspect
+import logging
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from concurrent.futures import Future
+
+from parsl import Config, File
+from parsl.dataflow.memoization import make_hash
+from parsl.utils import get_all_checkpoints
+
+try:
+    from parsl.dataflow.memoization import BasicMemoizer, Memoizer
+except ImportError:
+    # Older versions of parsl have no pluggable memoizers, see `get_checkpoint_config`.
+    BasicMemoizer = Memoizer = None
+
+__all__ = [
+    "CheckpointStore",
+    "SQLiteMemoizer",
+    "compact_checkpoints",
+    "configure_checkpoints",
+    "get_checkpoint_config",
+]
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_DB_FILENAME = "checkpoints.sqlite"
+"""Name of the checkpoint database written in the base parsl run directory."""
+
+DEFAULT_FLUSH_INTERVAL = 5.0
+"""Default number of seconds between flushes of completed tasks to the checkpoint database."""
+
+DEFAULT_FLUSH_BATCH_SIZE = 100
+"""Default number of completed tasks that triggers a flush before the flush interval has passed."""
+
+DEFAULT_JOURNAL_MODE = "DELETE"
+"""Default SQLite journal mode of the checkpoint database. WAL relies on shared
+memory, which isn't coherent between nodes on GPFS, Lustre or NFS, so it should
+only be used when the database is on node-local disk."""
+
+JOURNAL_MODES = ("DELETE", "TRUNCATE", "PERSIST", "WAL")
+"""SQLite journal modes the checkpoint database may use, the others aren't crash safe."""
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS checkpoints (
+    hash TEXT PRIMARY KEY,
+    result BLOB NOT NULL,
+    outputs TEXT NOT NULL,
+    created REAL NOT NULL
+)
+"""
+
+
+def _get_output_filepaths(task_record, result):
+    """Return the files a task wrote, so that the checkpoint can be pruned once they are removed."""
+    filepaths = [o.filepath for o in task_record["kwargs"].get("outputs", []) if isinstance(o, File)]
+    if isinstance(result, File) and result.filepath not in filepaths:
+        filepaths.append(result.filepath)
+    return filepaths
+
+
+class CheckpointStore:
+    """A SQLite database of task results, keyed on the memoization hash of the task.
+
+    Unlike parsl's pickled checkpoint files, nothing is loaded up front, each
+    task looks up its own hash in the (indexed) database.
+
+    Parameters
+    ----------
+    db_filepath : str
+        The database file. It is created if required.
+    journal_mode : str, optional
+        One of JOURNAL_MODES, by default DEFAULT_JOURNAL_MODE
+    """
+
+    def __init__(self, db_filepath, journal_mode=DEFAULT_JOURNAL_MODE):
+        journal_mode = journal_mode.upper()
+        if journal_mode not in JOURNAL_MODES:
+            raise ValueError(
+                f"Unknown checkpoint journal_mode {journal_mode}, expected one of {JOURNAL_MODES}."
+            )
+
+        self.db_filepath = db_filepath
+        self.journal_mode = journal_mode
+        os.makedirs(os.path.dirname(os.path.abspath(db_filepath)), exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(db_filepath, timeout=60.0, check_same_thread=False)
+        self._connection.execute(f"PRAGMA journal_mode={journal_mode}")
+        # Only WAL is safe from corruption without syncing each commit, which are batched anyway.
+        self._connection.execute(f"PRAGMA synchronous={'NORMAL' if journal_mode == 'WAL' else 'FULL'}")
+        self._connection.execute(_SCHEMA)
+        self._connection.commit()
+
+    def get(self, hashsum):
+        """Return the pickled result for a memoization hash, or None."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT result FROM checkpoints WHERE hash = ?", (hashsum,)
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def get_with_outputs(self, hashsum):
+        """Return the pickled result and output filepaths for a memoization hash, or None."""
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT result, outputs FROM checkpoints WHERE hash = ?", (hashsum,)
+            ).fetchone()
+        if row is None:
+            return None
+        return row[0], [filepath for filepath in row[1].split("\n") if filepath]
+
+    def delete(self, hashsum):
+        """Remove the checkpoint for a memoization hash, if there is one."""
+        with self._lock, self._connection:
+            self._connection.execute("DELETE FROM checkpoints WHERE hash = ?", (hashsum,))
+
+    def put_many(self, rows):
+        """Store (hash, pickled result, output filepaths) rows in a single transaction."""
+        created = time.time()
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO checkpoints (hash, result, outputs, created) VALUES (?, ?, ?, ?)",
+                [(hashsum, result, "\n".join(outputs), created) for hashsum, result, outputs in rows],
+            )
+
+    def compact(self, dry_run=False):
+        """Remove the checkpoints of tasks whose outputs no longer exist.
+
+        Parameters
+        ----------
+        dry_run : bool, optional
+            Only count the checkpoints that would be removed, by default False
+
+        Returns
+        -------
+        tuple[int, int]
+            The number of checkpoints removed and kept.
+        """
+        with self._lock:
+            rows = self._connection.execute("SELECT hash, outputs FROM checkpoints").fetchall()
+        stale = [
+            (hashsum,)
+            for hashsum, outputs in rows
+            if any(not os.path.exists(filepath) for filepath in outputs.split("\n") if filepath)
+        ]
+
+        if not dry_run and len(stale) > 0:
+            with self._lock:
+                with self._connection:
+                    self._connection.executemany("DELETE FROM checkpoints WHERE hash = ?", stale)
+                self._connection.execute("VACUUM")
+        return len(stale), len(rows) - len(stale)
+
+    def __len__(self):
+        """The number of checkpoints."""
+        with self._lock:
+            return self._connection.execute("SELECT COUNT(*) FROM checkpoints").fetchone()[0]
+
+    def close(self):
+        """Close the connection to the database."""
+        with self._lock:
+            self._connection.close()
+
+
+class SQLiteMemoizer(Memoizer if Memoizer is not None else object):
+    """A parsl memoizer that checkpoints task results in a `CheckpointStore`.
+
+    Results are looked up lazily as each task is launched, and completed tasks
+    are written to the database in batches by a background thread, rather than
+    with a synchronous write as each task exits.
+
+    Parameters
+    ----------
+    db_filepath : str, optional
+        The checkpoint database, by default None, CHECKPOINT_DB_FILENAME in the
+        base parsl run directory.
+    flush_interval : float, optional
+        Seconds between flushes of completed tasks, by default DEFAULT_FLUSH_INTERVAL
+    batch_size : int, optional
+        Number of completed tasks that triggers an early flush, by default
+        DEFAULT_FLUSH_BATCH_SIZE
+    memoize : bool, optional
+        Enable memoization, by default True
+    journal_mode : str, optional
+        The journal mode of the database, see `CheckpointStore`, by default
+        DEFAULT_JOURNAL_MODE
+    """
+
+    def __init__(
+        self,
+        db_filepath=None,
+        flush_interval=DEFAULT_FLUSH_INTERVAL,
+        batch_size=DEFAULT_FLUSH_BATCH_SIZE,
+        memoize=True,
+        journal_mode=DEFAULT_JOURNAL_MODE,
+    ):
+        self.db_filepath = db_filepath
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.memoize = memoize
+        self.journal_mode = journal_mode
+
+        self.store = None
+        self.checkpointed_tasks = 0
+        # Results of this run, which are not necessarily flushed yet.
+        self._memo_lookup_table = {}
+        self._pending = []
+        self._pending_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._flush_thread = None
+
+    def start(self, *, run_dir, config_run_dir):
+        """Open the checkpoint database and start the background flushes, called when parsl is loaded."""
+        if self.db_filepath is None:
+            self.db_filepath = os.path.join(config_run_dir, CHECKPOINT_DB_FILENAME)
+        self.store = CheckpointStore(self.db_filepath, journal_mode=self.journal_mode)
+        logger.info(f"Using checkpoint database {self.db_filepath}")
+        self._memo_lookup_table = {}
+
+        self._stop.clear()
+        self._flush_thread = threading.Thread(target=self._flush_loop, name="Checkpoint-Flush", daemon=True)
+        self._flush_thread.start()
+
+    def check_memo(self, task):
+        """Return a completed future with the result of an identical task, from
+        this run or the checkpoint database, or None if the task must run. A
+        checkpoint whose output files no longer exist is removed, and the task rerun."""
+        if not self.memoize or not task["memoize"]:
+            task["hashsum"] = None
+            return None
+
+        hashsum = make_hash(task)
+        task["hashsum"] = hashsum
+
+        memo_fu = self._memo_lookup_table.get(hashsum)
+        if memo_fu is not None:
+            logger.info(f"Task {task['id']} using result from this run")
+            return memo_fu
+
+        checkpoint = self.store.get_with_outputs(hashsum)
+        if checkpoint is None:
+            logger.info(f"Task {task['id']} had no result in the checkpoint database")
+            return None
+
+        # The outputs may have been removed since, e.g. by the cleanup of a stage,
+        # so the task is rerun to write them again for the tasks that consume them.
+        pickled_result, outputs = checkpoint
+        missing = [filepath for filepath in outputs if not os.path.exists(filepath)]
+        if len(missing) > 0:
+            logger.info(
+                f"Task {task['id']} rerunning, {len(missing)} of its checkpointed outputs were removed"
+            )
+            self.store.delete(hashsum)
+            return None
+
+        try:
+            result = pickle.loads(pickled_result)
+        except Exception as e:
+            logger.warning(f"Task {task['id']} ignoring checkpoint that could not be loaded: {e}")
+            return None
+
+        memo_fu = Future()
+        memo_fu.set_result(result)
+        logger.info(f"Task {task['id']} using result from the checkpoint database")
+        return memo_fu
+
+    def update_memo_result(self, task, r):
+        """Memoize the result of a task, and queue it to be checkpointed."""
+        hashsum = task.get("hashsum")
+        if not self.memoize or not task["memoize"] or not isinstance(hashsum, str):
+            return
+        self._memo_lookup_table[hashsum] = task["app_fu"]
+
+        try:
+            pickled_result = pickle.dumps(r)
+        except Exception as e:
+            logger.warning(f"Task {task['id']} result can not be checkpointed: {e}")
+            return
+
+        with self._pending_lock:
+            self._pending.append((hashsum, pickled_result, _get_output_filepaths(task, r)))
+            if len(self._pending) >= self.batch_size:
+                self._wake.set()
+
+    def update_memo_exception(self, task, e):
+        """Memoize the failure of a task for the rest of this run, as with parsl's own
+        checkpoints, failures are not checkpointed."""
+        hashsum = task.get("hashsum")
+        if self.memoize and task["memoize"] and isinstance(hashsum, str):
+            self._memo_lookup_table[hashsum] = task["app_fu"]
+
+    def flush(self):
+        """Write the completed tasks that are waiting in memory to the checkpoint database."""
+        with self._pending_lock:
+            pending, self._pending = self._pending, []
+        if len(pending) == 0:
+            return
+
+        try:
+            self.store.put_many(pending)
+        except sqlite3.Error as e:
+            logger.error(f"Failed to checkpoint {len(pending)} tasks, retrying on the next flush: {e}")
+            with self._pending_lock:
+                self._pending = pending + self._pending
+            return
+        self.checkpointed_tasks += len(pending)
+        logger.debug(f"Checkpointed {len(pending)} tasks")
+
+    def _flush_loop(self):
+        while not self._stop.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self.flush()
+
+    def checkpoint(self):
+        """Flush immediately, the counterpart of `parsl.dataflow.memoization.BasicMemoizer.checkpoint`."""
+        self.flush()
+
+    def close(self):
+        """Stop the background flushes, flush the remaining tasks and close the database."""
+        if self._flush_thread is not None:
+            self._stop.set()
+            self._wake.set()
+            self._flush_thread.join()
+            self._flush_thread = None
+        if self.store is not None:
+            self.flush()
+            logger.info(f"Checkpointed {self.checkpointed_tasks} tasks in this run")
+            self.store.close()
+            self.store = None
+
+
+def supports_memoizer_plugins():
+    """Return True if the installed parsl accepts a ``memoizer`` in its Config."""
+    return Memoizer is not None and "memoizer" in inspect.signature(Config).parameters
+
+
+def get_checkpoint_config(run_dir):
+    """Return the memoization and checkpointing arguments of a resource configuration's parsl Config.
+
+    Parameters
+    ----------
+    run_dir : str
+        The base parsl run directory of the resource configuration.
+
+    Returns
+    -------
+    dict
+        A `SQLiteMemoizer` that keeps its database in ``run_dir``, or for
+        versions of parsl without pluggable memoizers, task exit checkpoints
+        loaded from every run in ``run_dir``.
+    """
+    if supports_memoizer_plugins():
+        return {"memoizer": SQLiteMemoizer(db_filepath=os.path.join(run_dir, CHECKPOINT_DB_FILENAME))}
+
+    return {
+        "app_cache": True,
+        "checkpoint_mode": "task_exit",
+        "checkpoint_files": get_all_checkpoints(run_dir),
+    }
+
+
+def configure_checkpoints(resource_config, checkpoint_config):
+    """Apply the ``[checkpoint]`` section of a runtime configuration to a resource configuration.
+
+    Parameters
+    ----------
+    resource_config : parsl.config.Config
+        The configuration object that will be passed to parsl.load().
+    checkpoint_config : dict
+        May set ``db_filepath``, ``flush_interval``, ``batch_size`` and
+        ``journal_mode`` of the `SQLiteMemoizer`.
+    """
+    memoizer = getattr(resource_config, "memoizer", None)
+    if not isinstance(memoizer, SQLiteMemoizer):
+        return
+    for key in ("db_filepath", "flush_interval", "batch_size", "journal_mode"):
+        if key in checkpoint_config:
+            setattr(memoizer, key, checkpoint_config[key])
+
+
+def compact_checkpoints(db_filepath, dry_run=False):
+    """Remove the checkpoints of tasks whose outputs no longer exist, see `CheckpointStore.compact`."""
+    store = CheckpointStore(db_filepath)
+    try:
+        return store.compact(dry_run=dry_run)
+    finally:
+        store.close()
+
+
+def main():
+    """Compact a checkpoint database from the command line."""
+    parser = argparse.ArgumentParser(
+        description="Remove the checkpoints of tasks whose outputs no longer exist."
+    )
+    parser.add_argument(
+        "db_filepath", type=str, help="The checkpoint database, e.g. run_logs/checkpoints.sqlite"
+    )
+    parser.add_argument(
+        "--dry-run", action="store_true", help="Only report the checkpoints that would be removed."
+    )
+    args = parser.parse_args()
+
+    if not os.path.exists(args.db_filepath):
+        parser.error(f"No checkpoint database at {args.db_filepath}")
+
+    removed, kept = compact_checkpoints(args.db_filepath, dry_run=args.dry_run)
+    action = "Would remove" if args.dry_run else "Removed"
+    print(f"{action} {removed} checkpoints, keeping {kept}.")
+
+
+if __name__ == "__main__":
+    main()
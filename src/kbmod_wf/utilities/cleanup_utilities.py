@@ -0,0 +1,289 @@
+import os
+import re
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait
+from functools import partial
+
+__all__ = ["ArtifactCollector", "BackgroundDeleter", "get_deleter", "list_artifact_files"]
+
+
+DEFAULT_DELETE_THREADS = 4
+"""Default number of threads that delete files in the background."""
+
+DEFAULT_DELETE_BATCH_SIZE = 256
+"""Default number of files of one directory that a thread deletes in one go."""
+
+# The deleter shared by the tasks that run in this process, see `get_deleter`.
+_deleter = None
+_deleter_lock = threading.Lock()
+
+
+def list_artifact_files(filepath):
+    """Return a file, followed by any WorkUnit shards, i.e. "<i>_<filename>", written
+    next to it, and the sidecar that caches its memoization digest, if there is one.
+    The directory is listed once, so the WorkUnit doesn't need to be read to know
+    how many images it has.
+
+    Parameters
+    ----------
+    filepath : str
+        The file, e.g. the head file of a sharded WorkUnit.
+
+    Returns
+    -------
+    list[str]
+        The file, which may not exist, its shards in order, and its digest
+        sidecar, see `kbmod_wf.utilities.memoization_utilities`.
+    """
+    from kbmod_wf.utilities.memoization_utilities import DIGEST_SIDECAR_SUFFIX
+
+    directory, filename = os.path.split(filepath)
+    shard_name = re.compile(r"(\d+)_" + re.escape(filename))
+    sidecar_name = filename + DIGEST_SIDECAR_SUFFIX
+    shards = []
+    has_sidecar = False
+    try:
+        with os.scandir(directory or os.curdir) as entries:
+            for entry in entries:
+                if entry.name == sidecar_name:
+                    has_sidecar = True
+                    continue
+                match = shard_name.fullmatch(entry.name)
+                if match is not None:
+                    shards.append((int(match.group(1)), entry.name))
+    except FileNotFoundError:
+        pass
+    filepaths = [filepath] + [os.path.join(directory, name) for _, name in sorted(shards)]
+    if has_sidecar:
+        filepaths.append(os.path.join(directory, sidecar_name))
+    return filepaths
+
+
+class BackgroundDeleter:
+    """Deletes files from a pool of threads, so that the task retiring them
+    doesn't wait on the filesystem.
+
+    The files are grouped by directory, and each batch is unlinked relative to
+    an open descriptor of its directory, so the directory's path is resolved
+    once per batch rather than once per file. Files that are already gone are
+    ignored, and other failures are logged rather than raised.
+
+    Parameters
+    ----------
+    n_threads : int, optional
+        The number of threads deleting files, by default DEFAULT_DELETE_THREADS
+    batch_size : int, optional
+        The most files of a directory deleted by one thread in one go, by
+        default DEFAULT_DELETE_BATCH_SIZE
+    logger : logging.Logger, optional
+        Logs the files that couldn't be deleted, by default None
+    """
+
+    def __init__(self, n_threads=DEFAULT_DELETE_THREADS, batch_size=DEFAULT_DELETE_BATCH_SIZE, logger=None):
+        self.batch_size = max(1, int(batch_size))
+        self.logger = logger
+        self.n_deleted = 0
+        self.n_failed = 0
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(n_threads)), thread_name_prefix="deleter")
+        self._pending = set()
+        self._lock = threading.Lock()
+
+    def _submit(self, fn, *args):
+        future = self._pool.submit(fn, *args)
+        with self._lock:
+            self._pending.add(future)
+        future.add_done_callback(self._done)
+        return future
+
+    def _done(self, future):
+        with self._lock:
+            self._pending.discard(future)
+        if future.exception() is not None and self.logger is not None:
+            self.logger.warning(f"Failed to delete files in the background: {future.exception()}")
+
+    def delete(self, filepaths):
+        """Queue files to be deleted, returning immediately.
+
+        Parameters
+        ----------
+        filepaths : list[str]
+            The files to delete.
+        """
+        by_directory = {}
+        for filepath in filepaths:
+            directory, name = os.path.split(filepath)
+            by_directory.setdefault(directory, []).append(name)
+
+        for directory, names in by_directory.items():
+            for start in range(0, len(names), self.batch_size):
+                self._submit(self._unlink_batch, directory, names[start : start + self.batch_size])
+
+    def delete_artifact(self, filepath):
+        """Queue a file and its WorkUnit shards to be deleted, see `list_artifact_files`.
+        The directory is listed in the background too."""
+        self._submit(lambda: self.delete(list_artifact_files(filepath)))
+
+    def _unlink_batch(self, directory, names):
+        directory = directory or os.curdir
+        dir_fd = None
+        if os.unlink in os.supports_dir_fd:
+            try:
+                dir_fd = os.open(directory, os.O_RDONLY | getattr(os, "O_DIRECTORY", 0))
+            except FileNotFoundError:
+                return
+
+        n_deleted = 0
+        n_failed = 0
+        try:
+            for name in names:
+                try:
+                    if dir_fd is not None:
+                        os.unlink(name, dir_fd=dir_fd)
+                    else:
+                        os.unlink(os.path.join(directory, name))
+                    n_deleted += 1
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    n_failed += 1
+                    if self.logger is not None:
+                        self.logger.warning(f"Failed to remove {os.path.join(directory, name)}: {e}")
+        finally:
+            if dir_fd is not None:
+                os.close(dir_fd)
+
+        with self._lock:
+            self.n_deleted += n_deleted
+            self.n_failed += n_failed
+
+    def wait(self, timeout=None):
+        """Wait for the queued files to be deleted, including files queued while waiting.
+
+        Parameters
+        ----------
+        timeout : float, optional
+            The most seconds to wait for each round of deletions, by default None
+
+        Returns
+        -------
+        bool
+            True if nothing is left to delete.
+        """
+        while True:
+            with self._lock:
+                pending = set(self._pending)
+            if len(pending) == 0:
+                return True
+            _, not_done = wait(pending, timeout=timeout)
+            if len(not_done) > 0:
+                return False
+
+    def close(self):
+        """Wait for the queued files to be deleted, and stop the threads."""
+        self.wait()
+        self._pool.shutdown(wait=True)
+
+    def __len__(self):
+        """The number of batches queued or being deleted."""
+        with self._lock:
+            return len(self._pending)
+
+
+def get_deleter(logger=None):
+    """Return the BackgroundDeleter shared by the tasks running in this process.
+
+    The deletions continue after the task that queued them has returned, and
+    the interpreter waits for them to finish before exiting. A worker that is
+    killed leaves the files it hadn't deleted yet.
+
+    Parameters
+    ----------
+    logger : logging.Logger, optional
+        Logs the files that couldn't be deleted, replacing the logger of an
+        existing deleter, by default None
+
+    Returns
+    -------
+    BackgroundDeleter
+        The deleter.
+    """
+    global _deleter
+
+    with _deleter_lock:
+        if _deleter is None:
+            _deleter = BackgroundDeleter()
+        if logger is not None:
+            _deleter.logger = logger
+        return _deleter
+
+
+class ArtifactCollector:
+    """Reference counts the intermediate outputs, i.e. artifacts, of a workflow,
+    and deletes each with a BackgroundDeleter once every task that consumes it
+    has finished.
+
+    An artifact is retained by the task that writes it and once for each
+    consumer, and released when that task succeeds, so an artifact whose
+    producer or consumers failed is kept, e.g. to
+    debug or rerun them.
+
+    Parameters
+    ----------
+    deleter : BackgroundDeleter, optional
+        The deleter, by default None, see `get_deleter`.
+    logger : logging.Logger, optional
+        Logs the artifacts that are kept, by default None
+    """
+
+    def __init__(self, deleter=None, logger=None):
+        self.deleter = deleter if deleter is not None else get_deleter()
+        self.logger = logger
+        self.n_collected = 0
+        self._refcounts = {}
+        self._lock = threading.Lock()
+
+    def retain(self, filepath, n=1):
+        """Add ``n`` references to an artifact."""
+        with self._lock:
+            self._refcounts[filepath] = self._refcounts.get(filepath, 0) + n
+
+    def release(self, filepath):
+        """Remove a reference to an artifact, deleting it if it was the last.
+
+        Returns
+        -------
+        bool
+            True if the artifact is being deleted.
+        """
+        with self._lock:
+            refcount = self._refcounts.get(filepath, 0) - 1
+            if refcount > 0:
+                self._refcounts[filepath] = refcount
+                return False
+            self._refcounts.pop(filepath, None)
+            self.n_collected += 1
+
+        if self.logger is not None:
+            self.logger.debug(f"Deleting {filepath}, every task that consumes it has finished")
+        self.deleter.delete_artifact(filepath)
+        return True
+
+    def consumed_by(self, filepath, future):
+        """Retain an artifact until a consumer's future completes, releasing it only if it succeeds."""
+        self.retain(filepath)
+        future.add_done_callback(partial(self._consumer_done, filepath))
+
+    def _consumer_done(self, filepath, future):
+        if not future.cancelled() and future.exception() is None:
+            self.release(filepath)
+        elif self.logger is not None:
+            self.logger.info(f"Keeping {filepath}, a task that consumes it failed")
+
+    def wait(self, timeout=None):
+        """Wait for the artifacts that were released to be deleted, see `BackgroundDeleter.wait`."""
+        return self.deleter.wait(timeout=timeout)
+
+    def __len__(self):
+        """The number of artifacts that are still retained."""
+        with self._lock:
+            return len(self._refcounts)
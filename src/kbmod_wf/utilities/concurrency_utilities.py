@@ -0,0 +1,257 @@
+import os
+
+from kbmod_wf.utilities.cost_model_utilities import BYTES_PER_PIXEL
+
+__all__ = [
+    "get_cpu_limit",
+    "get_available_memory",
+    "estimate_reprojection_worker_bytes",
+    "resolve_n_workers",
+    "resolve_reprojection_workers",
+]
+
+
+DEFAULT_N_WORKERS = 8
+"""Number of worker processes used when n_workers is not set in the runtime configuration."""
+
+MAX_N_WORKERS = 64
+"""The most worker processes a single task will start."""
+
+DEFAULT_MEMORY_FRACTION = 0.8
+"""Fraction of the available memory that ``n_workers = "auto"`` plans to use."""
+
+WORKER_BASELINE_BYTES = 512 * 1024**2
+"""Memory used by a worker process before it is handed an image, i.e. the interpreter and kbmod."""
+
+REPROJECT_BYTES_PER_PATCH_PIXEL = 6 * 8
+"""Memory used by the reprojection per pixel of the target patch, i.e. the 64-bit
+pixel and world coordinates of each pixel, and the 64-bit output of each layer."""
+
+_CGROUP_ROOT = "/sys/fs/cgroup"
+_PROC_CGROUP = "/proc/self/cgroup"
+_PROC_MEMINFO = "/proc/meminfo"
+
+
+def _read_cgroup_file(filepath):
+    try:
+        with open(filepath, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def _get_cgroup_directories(controller):
+    """Return the cgroup directories of this process for a controller, from the
+    innermost to the outermost, as the limit of any of them may apply."""
+    try:
+        with open(_PROC_CGROUP, "r") as f:
+            lines = f.read().splitlines()
+    except OSError:
+        return []
+
+    for line in lines:
+        hierarchy, controllers, path = line.split(":", 2)
+        if hierarchy == "0" and controllers == "":
+            base = _CGROUP_ROOT
+            if not os.path.exists(os.path.join(base, "cgroup.controllers")):
+                # A hybrid hierarchy, the v1 controllers are used instead.
+                continue
+        elif controller in controllers.split(","):
+            base = os.path.join(_CGROUP_ROOT, controllers)
+        else:
+            continue
+
+        directories = []
+        path = path.strip("/")
+        while True:
+            directory = os.path.join(base, path)
+            # Inside a container the cgroup path of the host may not be visible.
+            if os.path.isdir(directory):
+                directories.append(directory)
+            if path == "":
+                break
+            path = os.path.dirname(path)
+        return directories
+    return []
+
+
+def get_cpu_limit():
+    """Return the number of CPUs this process may use, i.e. the smallest of its
+    CPU affinity and any cgroup CPU quota, such as a Slurm allocation's."""
+    try:
+        n_cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        n_cpus = os.cpu_count() or 1
+
+    for directory in _get_cgroup_directories("cpu"):
+        # cgroup v2: "<quota> <period>" or "max <period>".
+        cpu_max = _read_cgroup_file(os.path.join(directory, "cpu.max"))
+        if cpu_max is not None:
+            quota, _, period = cpu_max.partition(" ")
+            if quota != "max":
+                n_cpus = min(n_cpus, max(1, int(int(quota) / int(period))))
+            continue
+        # cgroup v1: a quota of -1 is no limit.
+        quota = _read_cgroup_file(os.path.join(directory, "cpu.cfs_quota_us"))
+        period = _read_cgroup_file(os.path.join(directory, "cpu.cfs_period_us"))
+        if quota is not None and period is not None and int(quota) > 0:
+            n_cpus = min(n_cpus, max(1, int(int(quota) / int(period))))
+    return n_cpus
+
+
+def get_available_memory():
+    """Return the memory in bytes that this process can still allocate, i.e. the
+    smallest of the host's available memory and the headroom of any cgroup limit."""
+    available = None
+    try:
+        with open(_PROC_MEMINFO, "r") as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    available = int(line.split()[1]) * 1024
+                    break
+    except OSError:
+        pass
+    if available is None:
+        try:
+            available = os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (ValueError, OSError, AttributeError):
+            return None
+
+    for directory in _get_cgroup_directories("memory"):
+        # cgroup v2, then v1. A v1 cgroup without a limit reports a huge number.
+        for limit_filename, usage_filename in (
+            ("memory.max", "memory.current"),
+            ("memory.limit_in_bytes", "memory.usage_in_bytes"),
+        ):
+            limit = _read_cgroup_file(os.path.join(directory, limit_filename))
+            usage = _read_cgroup_file(os.path.join(directory, usage_filename))
+            if limit is None or usage is None or limit == "max":
+                continue
+            available = min(available, max(0, int(limit) - int(usage)))
+            break
+    return available
+
+
+def estimate_reprojection_worker_bytes(image_shape=None, patch_shape=None):
+    """Estimate the peak memory of a worker process that reprojects one image at a time.
+
+    Parameters
+    ----------
+    image_shape : tuple[int, int], optional
+        The shape of the original images, by default None
+    patch_shape : tuple[int, int], optional
+        The shape of the target patch, by default None
+
+    Returns
+    -------
+    int
+        The estimated memory in bytes.
+    """
+    worker_bytes = WORKER_BASELINE_BYTES
+    if image_shape is not None:
+        worker_bytes += int(image_shape[0]) * int(image_shape[1]) * BYTES_PER_PIXEL
+    if patch_shape is not None:
+        worker_bytes += int(patch_shape[0]) * int(patch_shape[1]) * REPROJECT_BYTES_PER_PATCH_PIXEL
+    return worker_bytes
+
+
+def resolve_n_workers(
+    n_workers=DEFAULT_N_WORKERS,
+    worker_bytes=WORKER_BASELINE_BYTES,
+    reserved_bytes=0,
+    n_tasks=None,
+    memory_fraction=DEFAULT_MEMORY_FRACTION,
+    logger=None,
+):
+    """Return the number of worker processes to start.
+
+    Parameters
+    ----------
+    n_workers : int | str, optional
+        The ``n_workers`` of the runtime configuration, by default DEFAULT_N_WORKERS.
+        "auto" picks the most workers that fit both the CPU limit and the
+        memory that is available now, otherwise the value is clamped to
+        1..MAX_N_WORKERS.
+    worker_bytes : int, optional
+        The peak memory of each worker, see `estimate_reprojection_worker_bytes`,
+        by default WORKER_BASELINE_BYTES
+    reserved_bytes : int, optional
+        Memory the task will still allocate regardless of the number of
+        workers, e.g. the reprojected WorkUnit, by default 0
+    n_tasks : int, optional
+        The number of independent pieces of work, i.e. images, by default None
+    memory_fraction : float, optional
+        Fraction of the available memory to plan for, by default DEFAULT_MEMORY_FRACTION
+    logger : logging.Logger, optional
+        Logs how "auto" was resolved, by default None
+
+    Returns
+    -------
+    int
+        The number of workers.
+    """
+    if n_workers != "auto":
+        return max(1, min(int(n_workers), MAX_N_WORKERS))
+
+    n_cpus = get_cpu_limit()
+    available = get_available_memory()
+    n_fit = MAX_N_WORKERS
+    if available is not None:
+        n_fit = int((available * memory_fraction - reserved_bytes) // max(1, worker_bytes))
+
+    resolved = max(1, min(n_cpus, n_fit, MAX_N_WORKERS, n_tasks if n_tasks else MAX_N_WORKERS))
+    if logger is not None:
+        available_gb = "unknown" if available is None else round(available / 1024**3, 1)
+        logger.info(
+            f"Using {resolved} workers for {n_cpus} CPUs, {available_gb}[GB] available memory, "
+            f"{round(worker_bytes / 1024**3, 2)}[GB] per worker"
+            + (f" and {n_tasks} images." if n_tasks else ".")
+        )
+    return resolved
+
+
+def resolve_reprojection_workers(
+    n_workers,
+    n_images,
+    image_shape=None,
+    patch_shape=None,
+    in_memory=False,
+    memory_fraction=DEFAULT_MEMORY_FRACTION,
+    logger=None,
+):
+    """Return the number of worker processes to reproject a WorkUnit with, see `resolve_n_workers`.
+
+    Parameters
+    ----------
+    n_workers : int | str
+        The ``n_workers`` of the runtime configuration.
+    n_images : int
+        The number of images in the WorkUnit.
+    image_shape : tuple[int, int], optional
+        The shape of the original images, by default None
+    patch_shape : tuple[int, int], optional
+        The shape of the target patch, by default None
+    in_memory : bool, optional
+        Whether the reprojected WorkUnit is kept in memory, rather than written
+        out as each image is reprojected, by default False
+    memory_fraction : float, optional
+        Fraction of the available memory to plan for, by default DEFAULT_MEMORY_FRACTION
+    logger : logging.Logger, optional
+        Logs how "auto" was resolved, by default None
+
+    Returns
+    -------
+    int
+        The number of workers.
+    """
+    reserved_bytes = 0
+    if in_memory and patch_shape is not None:
+        reserved_bytes = n_images * int(patch_shape[0]) * int(patch_shape[1]) * BYTES_PER_PIXEL
+    return resolve_n_workers(
+        n_workers,
+        worker_bytes=estimate_reprojection_worker_bytes(image_shape, patch_shape),
+        reserved_bytes=reserved_bytes,
+        n_tasks=n_images,
+        memory_fraction=memory_fraction,
+        logger=logger,
+    )
@@ -1,9 +1,6 @@
 import platform
-import toml
 from typing import Literal
 
-from kbmod_wf.resource_configs import *
-
 
 def get_resource_config(env: Literal["dev", "klone", "usdf"] | None = None):
     """A naive attempt to return a reasonable configuration using platform.system.
@@ -26,22 +23,23 @@ def get_resource_config(env: Literal["dev", "klone", "usdf"] | None = None):
     ValueError
         If an unknown environment is provided, raise a ValueError.
     """
-    print(f"env was {env}")
+    from kbmod_wf import resource_configs
+
     if env is None:
         if platform.node().startswith("sdf"):
-            config = usdf_resource_config()
+            config = resource_configs.usdf_resource_config()
         elif platform.system().lower() == "darwin":
-            config = dev_resource_config()
+            config = resource_configs.dev_resource_config()
         elif is_running_on_wsl():
-            config = dev_resource_config()
+            config = resource_configs.dev_resource_config()
         else:
-            config = klone_resource_config()
+            config = resource_configs.klone_resource_config()
     elif env == "dev":
-        config = dev_resource_config()
+        config = resource_configs.dev_resource_config()
     elif env == "klone":
-        config = klone_resource_config()
+        config = resource_configs.klone_resource_config()
     elif env == "usdf":
-        config = usdf_resource_config()
+        config = resource_configs.usdf_resource_config()
     else:
         raise ValueError(f"Unknown environment: {env}")
 
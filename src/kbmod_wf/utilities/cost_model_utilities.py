@@ -0,0 +1,378 @@
+import ast
+import contextlib
+import functools
+import json
+import math
+import os
+import threading
+import time
+from collections import deque
+
+__all__ = [
+    "CostModel",
+    "estimate_memory_bytes",
+    "get_entry_features",
+    "get_history_filepath",
+    "timed_app_function",
+]
+
+
+DEFAULT_SECONDS_PER_IMAGE_PIXEL = {
+    "uri_to_ic": 1e-9,
+    "ic_to_wu": 2e-7,
+    "reproject_wu": 1.5e-6,
+    "kbmod_search": 1e-7,
+}
+"""Rough starting estimates for the runtime of each stage per image pixel. These
+are only used until timings from previous runs are available."""
+
+FALLBACK_SECONDS_PER_IMAGE_PIXEL = 1e-6
+"""Starting estimate used for a stage without an entry in DEFAULT_SECONDS_PER_IMAGE_PIXEL."""
+
+DEFAULT_IMAGE_PIXELS = 4000 * 4000
+"""Pixel area assumed for each image when it can not be determined from the manifest entry."""
+
+HISTORY_FILENAME = "task_timings.jsonl"
+"""Name of the file, next to the per-run parsl directories, that task timings are recorded in."""
+
+MIN_RECORDS_TO_FIT = 2
+"""Number of recorded timings required before the starting estimates are replaced by a fit."""
+
+MAX_RECORDS_PER_STAGE = 1000
+"""Number of the most recent timings of each stage that the fit is made from."""
+
+TASK_SECONDS_ATTRIBUTE = "task_seconds"
+"""Attribute of a task's result that `timed_app_function` sets to the seconds the task ran for."""
+
+BYTES_PER_PIXEL = 12
+"""Bytes per pixel of a layered image, i.e. 32-bit science, variance and mask layers."""
+
+SEARCH_BYTES_PER_PIXEL = 8
+"""Additional bytes per pixel used by the search for its 32-bit psi and phi images."""
+
+BASELINE_MEMORY_BYTES = 2 * 1024**3
+"""Memory used by a task before any image is loaded, i.e. the interpreter and imported packages."""
+
+
+def get_history_filepath(run_dir):
+    """Return the default task timing history of a resource configuration.
+
+    Parsl writes each run to a numbered sub-directory of the configured
+    ``run_dir``, e.g. "runinfo/000", so the history is kept in ``run_dir``
+    itself, where it is shared by every run.
+
+    Parameters
+    ----------
+    run_dir : str
+        The ``run_dir`` of the parsl Config, not the DataFlowKernel's
+        ``run_dir``, which is one of its numbered sub-directories.
+
+    Returns
+    -------
+    str
+        The path to the history file.
+    """
+    return os.path.join(run_dir, HISTORY_FILENAME)
+
+
+def get_entry_features(filepath):
+    """Read the features used to predict the cost of processing a manifest entry.
+
+    For an ImageCollection (ECSV) the number of images is the number of rows and
+    the pixel area is taken from the global WCS pixel shape. For a URI list the
+    number of images is the number of URIs and the pixel area is derived from the
+    ``#patch_size`` and ``#pixel_scale`` header comments.
+
+    Parameters
+    ----------
+    filepath : str
+        The path to the manifest entry.
+
+    Returns
+    -------
+    dict
+        A dictionary with ``n_images`` and ``patch_pixels``.
+    """
+    with open(filepath, "r") as f:
+        first_line = f.readline()
+
+    if first_line.startswith("# %ECSV"):
+        from astropy.table import Table
+
+        data = Table.read(filepath, format="ascii.ecsv")
+        n_images = len(data)
+        patch_pixels = DEFAULT_IMAGE_PIXELS
+        if "global_wcs_pixel_shape_0" in data.colnames and n_images > 0:
+            patch_pixels = int(data["global_wcs_pixel_shape_0"][0]) * int(data["global_wcs_pixel_shape_1"][0])
+        return {"n_images": n_images, "patch_pixels": patch_pixels}
+
+    n_images = 0
+    params = {}
+    with open(filepath, "r") as f:
+        for line in f:
+            line = line.strip()
+            if line == "":
+                continue
+            if line.startswith("#"):
+                lhs, _, rhs = line.lstrip("#").partition("=")
+                try:
+                    params[lhs.strip()] = ast.literal_eval(rhs.strip())
+                except (ValueError, SyntaxError):
+                    continue
+            else:
+                n_images += 1
+
+    patch_pixels = DEFAULT_IMAGE_PIXELS
+    if "patch_size" in params and params.get("pixel_scale"):
+        # patch_size is in arcminutes and pixel_scale is in arcseconds per pixel.
+        width, height = [math.ceil(size * 60 / params["pixel_scale"]) for size in params["patch_size"]]
+        patch_pixels = int(width * height)
+
+    return {"n_images": n_images, "patch_pixels": patch_pixels}
+
+
+def estimate_memory_bytes(stage_name, features):
+    """Estimate the peak memory of a stage's task for a manifest entry.
+
+    Parameters
+    ----------
+    stage_name : str
+        The name of the stage.
+    features : dict
+        The features of the manifest entry, see `get_entry_features`.
+
+    Returns
+    -------
+    int
+        The estimated peak memory in bytes.
+    """
+    n_images = features["n_images"]
+    if stage_name == "uri_to_ic":
+        pixels = 0
+    elif stage_name == "ic_to_wu":
+        pixels = n_images * DEFAULT_IMAGE_PIXELS * BYTES_PER_PIXEL
+    elif stage_name == "reproject_wu":
+        # Both the original and the reprojected images are held in memory.
+        pixels = n_images * (DEFAULT_IMAGE_PIXELS + features["patch_pixels"]) * BYTES_PER_PIXEL
+    elif stage_name == "kbmod_search":
+        pixels = n_images * features["patch_pixels"] * (BYTES_PER_PIXEL + SEARCH_BYTES_PER_PIXEL)
+    else:
+        pixels = n_images * features["patch_pixels"] * BYTES_PER_PIXEL
+    return int(BASELINE_MEMORY_BYTES + pixels)
+
+
+def timed_app_function(func):
+    """Wrap the function of a python_app so that the wall time spent running it,
+    excluding the time the task was queued, is attached to its result as
+    ``TASK_SECONDS_ATTRIBUTE``. The wrapper keeps the function's name and module,
+    so the memoization hash of the app is unchanged.
+
+    Parameters
+    ----------
+    func : callable
+        The function of the app, i.e. ``app.func``.
+
+    Returns
+    -------
+    callable
+        The wrapped function.
+    """
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        result = func(*args, **kwargs)
+        # A result without attributes, e.g. None, only loses its runtime for the cost model.
+        with contextlib.suppress(AttributeError):
+            setattr(result, TASK_SECONDS_ATTRIBUTE, time.perf_counter() - start)
+        return result
+
+    return wrapper
+
+
+class CostModel:
+    """Predicts the runtime of each stage for a manifest entry.
+
+    The prediction is linear in the amount of work, i.e. the number of images
+    multiplied by the pixel area of the patch. The model starts from rough
+    per-pixel estimates, and is refit from the timings of previous runs that are
+    appended to ``history_filepath``. Only the last MAX_RECORDS_PER_STAGE timings
+    of each stage are kept, and a stage is only refit when it is next predicted.
+
+    Parameters
+    ----------
+    history_filepath : str, optional
+        A JSON lines file where task timings are recorded and read back from
+        on the next run, by default None (timings are not persisted).
+    seconds_per_image_pixel : dict, optional
+        Overrides for the starting estimate of each stage, by default None.
+    """
+
+    def __init__(self, history_filepath=None, seconds_per_image_pixel=None):
+        self.history_filepath = history_filepath
+        self.seconds_per_image_pixel = dict(DEFAULT_SECONDS_PER_IMAGE_PIXEL)
+        if seconds_per_image_pixel is not None:
+            self.seconds_per_image_pixel.update(seconds_per_image_pixel)
+
+        self._lock = threading.Lock()
+        self._features = {}
+        self._records = {}
+        self._fits = {}
+        self._stale = set()
+
+        if self.history_filepath is not None and os.path.exists(self.history_filepath):
+            n_read = 0
+            with open(self.history_filepath, "r") as f:
+                for line in f:
+                    line = line.strip()
+                    if line == "":
+                        continue
+                    record = json.loads(line)
+                    self._stage_records(record["stage"]).append(record)
+                    n_read += 1
+            self._stale.update(self._records)
+
+            # Drop the timings that are no longer used, once they make up half of the file.
+            if n_read >= 2 * sum(len(records) for records in self._records.values()):
+                self._rewrite_history()
+
+    def _rewrite_history(self):
+        tmp_filepath = f"{self.history_filepath}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_filepath, "w") as f:
+                for records in self._records.values():
+                    f.writelines(json.dumps(record) + "\n" for record in records)
+            os.replace(tmp_filepath, self.history_filepath)
+        except OSError:
+            # The history is only ever read back, it's fine to leave it as it was.
+            with contextlib.suppress(OSError):
+                os.remove(tmp_filepath)
+
+    def _stage_records(self, stage_name):
+        if stage_name not in self._records:
+            self._records[stage_name] = deque(maxlen=MAX_RECORDS_PER_STAGE)
+        return self._records[stage_name]
+
+    @classmethod
+    def from_config(cls, cost_model_config, default_history_filepath=None):
+        """Create a CostModel from the ``[cost_model]`` section of the runtime configuration.
+
+        Parameters
+        ----------
+        cost_model_config : dict
+            The ``[cost_model]`` section of the runtime configuration.
+        default_history_filepath : str, optional
+            The timing history file to use if none is configured, by default None
+
+        Returns
+        -------
+        CostModel | None
+            The cost model, or None unless it has been enabled with ``enabled = true``.
+        """
+        if not cost_model_config.get("enabled", False):
+            return None
+        return cls(
+            history_filepath=cost_model_config.get("history_filepath", default_history_filepath),
+            seconds_per_image_pixel=cost_model_config.get("seconds_per_image_pixel", None),
+        )
+
+    def features(self, filepath):
+        """Return the (cached) features of a manifest entry, see `get_entry_features`."""
+        if filepath not in self._features:
+            try:
+                self._features[filepath] = get_entry_features(filepath)
+            except Exception:
+                # An unreadable entry will fail in its first task, don't fail the ordering.
+                self._features[filepath] = {"n_images": 0, "patch_pixels": 0}
+        return self._features[filepath]
+
+    def predict(self, stage_name, features):
+        """Predict the runtime of a stage in seconds.
+
+        Parameters
+        ----------
+        stage_name : str
+            The name of the stage.
+        features : dict
+            The features of the manifest entry, see `get_entry_features`.
+
+        Returns
+        -------
+        float
+            The predicted runtime in seconds.
+        """
+        work = features["n_images"] * features["patch_pixels"]
+        with self._lock:
+            if stage_name in self._stale:
+                self._refit(stage_name)
+                self._stale.discard(stage_name)
+            fit = self._fits.get(stage_name)
+        if fit is not None:
+            slope, intercept = fit
+            return max(0.0, slope * work + intercept)
+        return work * self.seconds_per_image_pixel.get(stage_name, FALLBACK_SECONDS_PER_IMAGE_PIXEL)
+
+    def order(self, filepaths, stage_names):
+        """Order manifest entries longest-processing-time first.
+
+        Parameters
+        ----------
+        filepaths : list[str]
+            The manifest entries.
+        stage_names : list[str]
+            The stages each entry will be processed by.
+
+        Returns
+        -------
+        list[tuple[str, float]]
+            The manifest entries and their total predicted runtime in seconds,
+            sorted from most to least expensive.
+        """
+        costs = []
+        for filepath in filepaths:
+            features = self.features(filepath)
+            costs.append((filepath, sum(self.predict(stage, features) for stage in stage_names)))
+        return sorted(costs, key=lambda c: c[1], reverse=True)
+
+    def record(self, stage_name, filepath, seconds):
+        """Record the observed runtime of a stage, the model is refit from it on
+        the next prediction for the stage.
+
+        Parameters
+        ----------
+        stage_name : str
+            The name of the stage.
+        filepath : str
+            The manifest entry that was processed.
+        seconds : float
+            The observed runtime in seconds.
+        """
+        record = {"stage": stage_name, "seconds": seconds, **self.features(filepath)}
+        with self._lock:
+            self._stage_records(stage_name).append(record)
+            self._stale.add(stage_name)
+            if self.history_filepath is not None:
+                with open(self.history_filepath, "a") as f:
+                    f.write(json.dumps(record) + "\n")
+
+    def _refit(self, stage_name):
+        import numpy as np
+
+        records = self._records[stage_name]
+        if len(records) < MIN_RECORDS_TO_FIT:
+            return
+
+        work = np.array([r["n_images"] * r["patch_pixels"] for r in records], dtype=float)
+        seconds = np.array([r["seconds"] for r in records], dtype=float)
+        if np.ptp(work) > 0:
+            slope, intercept = np.polyfit(work, seconds, 1)
+        elif work[0] > 0:
+            slope, intercept = np.mean(seconds) / work[0], 0.0
+        else:
+            slope, intercept = 0.0, np.mean(seconds)
+
+        # A negative slope is noise from too few, too similar, entries.
+        if slope < 0:
+            slope, intercept = 0.0, np.mean(seconds)
+
+        self._fits[stage_name] = (float(slope), float(intercept))
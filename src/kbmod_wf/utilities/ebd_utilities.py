@@ -0,0 +1,273 @@
+import contextlib
+import hashlib
+import multiprocessing
+import os
+import pickle
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+
+from kbmod_wf.utilities.tracing_utilities import trace_span
+
+__all__ = ["EBDCache", "get_ebd_cache", "transform_wcses_to_ebd_cached"]
+
+
+DEFAULT_EBD_SEED = 0
+"""Seed for the EBD WCS fits, fixed so that the fits are reproducible and cacheable."""
+
+DEFAULT_EBD_CACHE_MAX_BYTES = 1024**3
+"""Default size budget of the on-disk EBD WCS cache."""
+
+EVICTION_TARGET_FRACTION = 0.9
+"""Fraction of the size budget that the cache is evicted down to, so that the
+writes that follow don't each trigger another eviction."""
+
+# The caches shared by the tasks that run in this process, see `get_ebd_cache`.
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+class EBDCache:
+    """An on-disk cache of per-image EBD (estimated barycentric distance) WCS fits.
+
+    Each fit is stored in its own file, named by a hash of everything the fit
+    depends on. Files are touched when read, and the least recently used files
+    are evicted when a write grows the cache beyond its size budget. The cache
+    can be shared by every worker, e.g. on a shared filesystem. The size of the
+    cache is counted once, and then kept up to date with this process's writes,
+    and recounted whenever it is evicted, which picks up the other workers' writes.
+
+    Parameters
+    ----------
+    cache_directory : str
+        The directory the fits are stored in. It is created if required.
+    max_bytes : int, optional
+        The size budget of the cache, by default DEFAULT_EBD_CACHE_MAX_BYTES
+    """
+
+    def __init__(self, cache_directory, max_bytes=DEFAULT_EBD_CACHE_MAX_BYTES):
+        self.cache_directory = cache_directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._n_bytes = None
+        os.makedirs(self.cache_directory, exist_ok=True)
+
+    @staticmethod
+    def key(wcs, width, height, obstime_mjd, guess_dist, point_on_earth, npoints, seed):
+        """Return the cache key of a single image's EBD WCS fit."""
+        geocentric = point_on_earth.to_geocentric()
+        digest = hashlib.blake2b(digest_size=20)
+        for part in (
+            wcs.to_header_string(relax=True),
+            repr((width, height)),
+            repr(float(obstime_mjd)),
+            repr(float(guess_dist)),
+            repr(tuple(float(c.to_value("m")) for c in geocentric)),
+            repr((npoints, seed)),
+        ):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_directory, f"{key}.pkl")
+
+    def get(self, key):
+        """Return the cached (ebd_wcs, geocentric_dist) for a key, or None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return value
+
+    def put(self, key, value):
+        """Store the (ebd_wcs, geocentric_dist) for a key, evicting the least
+        recently used fits if it grows the cache beyond its size budget."""
+        path = self._path(key)
+        # Write to a temporary file first, so that concurrent readers never see a partial file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f)
+            n_bytes = f.tell()
+        replaced_bytes = 0
+        with contextlib.suppress(OSError):
+            replaced_bytes = os.stat(path).st_size
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._n_bytes is None:
+                self._n_bytes = self._scan()[1]
+            else:
+                self._n_bytes += n_bytes - replaced_bytes
+            if self._n_bytes > self.max_bytes:
+                self._evict(int(self.max_bytes * EVICTION_TARGET_FRACTION))
+
+    def _scan(self):
+        """Return the (mtime, size, path) of every fit, and their total size."""
+        entries = []
+        total = 0
+        with os.scandir(self.cache_directory) as it:
+            for entry in it:
+                if not entry.name.endswith(".pkl"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    # Evicted by another worker.
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        return entries, total
+
+    def _evict(self, target_bytes):
+        entries, total = self._scan()
+        for _, size, path in sorted(entries):
+            if total <= target_bytes:
+                break
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(path)
+            total -= size
+        self._n_bytes = total
+
+    def evict(self):
+        """Remove the least recently used fits until the cache is within its size budget."""
+        with self._lock:
+            self._evict(self.max_bytes)
+
+
+def get_ebd_cache(cache_directory, max_bytes=DEFAULT_EBD_CACHE_MAX_BYTES):
+    """Return the EBDCache of a directory shared by the tasks running in this
+    process, so that the size of the cache is only counted once per process.
+
+    Parameters
+    ----------
+    cache_directory : str
+        The directory the fits are stored in.
+    max_bytes : int, optional
+        The size budget of the cache, by default DEFAULT_EBD_CACHE_MAX_BYTES
+
+    Returns
+    -------
+    EBDCache
+        The cache.
+    """
+    with _caches_lock:
+        key = (os.path.abspath(cache_directory), max_bytes)
+        if key not in _caches:
+            _caches[key] = EBDCache(cache_directory, max_bytes=max_bytes)
+        return _caches[key]
+
+
+def _fit_ebd_wcs(wcs, width, height, guess_dist, obstime_mjd, point_on_earth, npoints, seed):
+    """Fit the EBD WCS of a single image."""
+    from astropy.time import Time
+    from kbmod.reprojection_utils import transform_wcses_to_ebd
+
+    ebd_wcs, geocentric_dists = transform_wcses_to_ebd(
+        [wcs],
+        width,
+        height,
+        guess_dist,
+        Time([obstime_mjd], format="mjd"),
+        point_on_earth,
+        npoints=npoints,
+        seed=seed,
+    )
+    return ebd_wcs[0], geocentric_dists[0]
+
+
+def _fit_ebd_wcs_from_args(args):
+    """Unpack the arguments of `_fit_ebd_wcs`, for `ProcessPoolExecutor.map`."""
+    return _fit_ebd_wcs(*args)
+
+
+def transform_wcses_to_ebd_cached(
+    wcs_list,
+    width,
+    height,
+    guess_dist,
+    obstimes,
+    point_on_earth,
+    npoints=10,
+    seed=DEFAULT_EBD_SEED,
+    cache_directory=None,
+    max_cache_bytes=DEFAULT_EBD_CACHE_MAX_BYTES,
+    n_workers=1,
+    logger=None,
+):
+    """A drop in replacement for `kbmod.reprojection_utils.transform_wcses_to_ebd`
+    that fits each image with a fixed seed, in parallel, and caches the fits on disk.
+
+    Parameters
+    ----------
+    wcs_list : list[astropy.wcs.WCS]
+        The WCS of each image.
+    width : int
+        The width of the images in pixels.
+    height : int
+        The height of the images in pixels.
+    guess_dist : float
+        The heliocentric guess distance in AU.
+    obstimes : astropy.time.Time
+        The observation time of each image.
+    point_on_earth : astropy.coordinates.EarthLocation
+        The observatory site.
+    npoints : int, optional
+        The number of points used for each fit, by default 10
+    seed : int, optional
+        The seed for each fit, by default DEFAULT_EBD_SEED
+    cache_directory : str, optional
+        The directory of the on-disk cache, by default None (no caching)
+    max_cache_bytes : int, optional
+        The size budget of the on-disk cache, by default DEFAULT_EBD_CACHE_MAX_BYTES
+    n_workers : int, optional
+        The number of processes used to fit the images missing from the cache,
+        by default 1
+    logger : logging.Logger, optional
+        Logger used to report cache hits, by default None
+
+    Returns
+    -------
+    tuple[list[astropy.wcs.WCS], list[float]]
+        The EBD WCS and the geocentric distance of each image.
+    """
+    obstimes_mjd = [float(t) for t in obstimes.mjd]
+    cache = get_ebd_cache(cache_directory, max_bytes=max_cache_bytes) if cache_directory is not None else None
+
+    results = [None] * len(wcs_list)
+    keys = [None] * len(wcs_list)
+    if cache is not None:
+        for i, (wcs, obstime_mjd) in enumerate(zip(wcs_list, obstimes_mjd, strict=True)):
+            keys[i] = cache.key(wcs, width, height, obstime_mjd, guess_dist, point_on_earth, npoints, seed)
+            results[i] = cache.get(keys[i])
+
+    missing = [i for i, result in enumerate(results) if result is None]
+    if logger is not None:
+        logger.debug(f"Found {len(wcs_list) - len(missing)} of {len(wcs_list)} EBD WCS fits in the cache.")
+
+    if len(missing) > 0:
+        args = [
+            (wcs_list[i], width, height, guess_dist, obstimes_mjd[i], point_on_earth, npoints, seed)
+            for i in missing
+        ]
+        with trace_span("ebd.fit", n_images=len(missing), n_cached=len(wcs_list) - len(missing)):
+            if n_workers > 1 and len(missing) > 1:
+                # The task's process has threads, e.g. the logging listener, that a forked
+                # worker would inherit the locks of, so the workers are started afresh.
+                with ProcessPoolExecutor(
+                    max_workers=min(n_workers, len(missing)), mp_context=multiprocessing.get_context("spawn")
+                ) as pool:
+                    fits = list(pool.map(_fit_ebd_wcs_from_args, args))
+            else:
+                fits = [_fit_ebd_wcs(*a) for a in args]
+
+        for i, fit in zip(missing, fits, strict=True):
+            results[i] = fit
+            if cache is not None:
+                cache.put(keys[i], fit)
+
+    return [r[0] for r in results], [r[1] for r in results]
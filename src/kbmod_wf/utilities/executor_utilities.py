@@ -1,8 +1,85 @@
-from kbmod_wf.utilities.configuration_utilities import get_resource_config
+import weakref
+
+import parsl
+from parsl.errors import NoDataFlowKernelError
+
+_UNRESOLVED = object()
+
+
+class ExecutorLabels(list):
+    """The executor labels available to an app, that remembers every label the
+    app could have used. This allows the workflow planner to map an app onto the
+    executors of a different resource configuration.
+
+    The labels are resolved lazily, against the executors of the parsl
+    DataFlowKernel that is loaded when they are first read, and again whenever
+    a different DataFlowKernel is loaded. Until one is loaded, every candidate
+    is available.
+
+    Parameters
+    ----------
+    candidates : list[str]
+        The labels of all the executors the app can use.
+    """
+
+    def __init__(self, candidates):
+        super().__init__()
+        self.candidates = list(candidates)
+        self._resolved_for = _UNRESOLVED
+
+    def _resolve(self):
+        try:
+            dfk = parsl.dfk()
+        except NoDataFlowKernelError:
+            dfk = None
+
+        resolved_for = self._resolved_for
+        if isinstance(resolved_for, weakref.ref):
+            # A DataFlowKernel that has since been garbage collected resolves again.
+            resolved_for = resolved_for() or _UNRESOLVED
+        if resolved_for is dfk:
+            return
+        self._resolved_for = weakref.ref(dfk) if dfk is not None else None
+        labels = self.candidates
+        if dfk is not None:
+            labels = [label for label in self.candidates if label in dfk.executors]
+        super().clear()
+        super().extend(labels)
+
+    def __len__(self):
+        self._resolve()
+        return super().__len__()
+
+    def __getitem__(self, index):
+        self._resolve()
+        return super().__getitem__(index)
+
+    def __iter__(self):
+        self._resolve()
+        return super().__iter__()
+
+    def __contains__(self, label):
+        self._resolve()
+        return super().__contains__(label)
+
+    def __eq__(self, other):
+        self._resolve()
+        return super().__eq__(other)
+
+    def __repr__(self):
+        self._resolve()
+        return super().__repr__()
+
+    def __copy__(self):
+        return ExecutorLabels(self.candidates)
 
 
 def get_executors(possible_executors=[]):
-    """Get the list of executors that are available on the system.
+    """Get the list of executors that are available on the system, i.e. the
+    executors of the loaded resource configuration that the app can use.
+
+    Nothing is resolved when this is called, which is when the app is declared,
+    see `ExecutorLabels`.
 
     Parameters
     ----------
@@ -11,11 +88,7 @@ def get_executors(possible_executors=[]):
 
     Returns
     -------
-    List[str]
+    ExecutorLabels
         A list of executors that are available on the system.
     """
-
-    config = get_resource_config()
-    available_executors = [e.label for e in config.executors]
-
-    return [executor for executor in possible_executors if executor in available_executors]
+    return ExecutorLabels(possible_executors)
@@ -0,0 +1,46 @@
+from concurrent.futures import as_completed
+
+__all__ = ["wait_for_futures"]
+
+
+def wait_for_futures(futures, logger=None):
+    """Block until every future has resolved, harvesting each one as soon as it
+    completes rather than in submission order.
+
+    A failure in any single future is logged and returned, but will not crash
+    the parent process or prevent the remaining futures from being harvested.
+    It is up to the caller to raise once every future has resolved, see
+    `kbmod_wf.pipeline.run_workflow`.
+
+    Parameters
+    ----------
+    futures : list[concurrent.futures.Future]
+        The futures to wait on. Parsl AppFutures and DataFutures are both
+        subclasses of `concurrent.futures.Future`.
+    logger : logging.Logger, optional
+        Logger used to report completed and failed futures, by default None
+
+    Returns
+    -------
+    tuple[list, list]
+        A list of results from the futures that completed successfully, and
+        a list of (future, exception) tuples for the futures that failed. Both
+        lists are in order of completion.
+    """
+    results = []
+    failures = []
+    for future in as_completed(futures):
+        try:
+            results.append(future.result())
+        except Exception as e:
+            failures.append((future, e))
+            if logger is not None:
+                logger.error(f"Error occurred while processing a future: {e}")
+        else:
+            if logger is not None:
+                logger.debug(f"Completed {len(results) + len(failures)} of {len(futures)} futures")
+
+    if logger is not None:
+        logger.info(f"{len(results)} futures completed successfully, {len(failures)} failed")
+
+    return results, failures
@@ -0,0 +1,380 @@
+import fcntl
+import math
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+from contextlib import contextmanager
+
+from kbmod_wf.utilities.cost_model_utilities import SEARCH_BYTES_PER_PIXEL
+
+__all__ = [
+    "GPUDevice",
+    "GPUAllocator",
+    "enumerate_devices",
+    "estimate_search_device_bytes",
+    "gpu_slot",
+    "pin_gpu",
+]
+
+
+FAKE_GPUS_ENV = "KBMOD_WF_FAKE_GPUS"
+"""Environment variable that replaces the devices found by nvidia-smi, for testing.
+Either a number of devices, or a comma separated list of the memory of each device in MiB."""
+
+FAKE_GPU_MEMORY_BYTES = 16 * 1024**3
+"""Memory of each fake device when only a number of devices is given."""
+
+DEFAULT_SLOTS_PER_DEVICE = 1
+"""Default number of slots each device is divided into, i.e. the most searches that may share it."""
+
+DEFAULT_MEMORY_FRACTION = 0.9
+"""Fraction of each device's memory that is handed out as slots."""
+
+DEFAULT_TIMEOUT = 24 * 3600.0
+"""Default number of seconds to wait for a slot."""
+
+POLL_INTERVAL = 5.0
+"""Seconds between attempts to take a slot when every device is busy."""
+
+CONTEXT_BYTES = 512 * 1024**2
+"""Device memory used by a search before any image is copied to it, i.e. the CUDA context."""
+
+TRAJECTORY_BYTES = 40
+"""Device memory of each candidate trajectory kept by the search."""
+
+DEFAULT_RESULTS_PER_PIXEL = 8
+"""Candidate trajectories kept per pixel when the search configuration doesn't set results_per_pixel."""
+
+# Once CUDA has been initialized, the devices this process can see can't be changed,
+# so a worker process keeps to the device of its first slot.
+_pinned_device = None
+
+
+class GPUDevice:
+    """A GPU, as numbered on the host, i.e. ignoring CUDA_VISIBLE_DEVICES.
+
+    Parameters
+    ----------
+    index : int
+        The index of the device.
+    memory_bytes : int
+        The memory of the device in bytes.
+    name : str, optional
+        The name of the device, by default ""
+    """
+
+    def __init__(self, index, memory_bytes, name=""):
+        self.index = index
+        self.memory_bytes = memory_bytes
+        self.name = name
+
+    def __repr__(self):
+        return f"GPUDevice({self.index}, {round(self.memory_bytes / 1024**3, 1)}GB, {self.name!r})"
+
+
+def enumerate_devices():
+    """Return the GPUs of this host, from FAKE_GPUS_ENV if it is set, otherwise from nvidia-smi.
+
+    Returns
+    -------
+    list[GPUDevice]
+        The devices, an empty list if there are none.
+    """
+    fake = os.environ.get(FAKE_GPUS_ENV)
+    if fake:
+        if "," not in fake and fake.strip().isdigit():
+            return [GPUDevice(i, FAKE_GPU_MEMORY_BYTES, "fake") for i in range(int(fake))]
+        return [GPUDevice(i, int(mib) * 1024**2, "fake") for i, mib in enumerate(fake.split(","))]
+
+    nvidia_smi = shutil.which("nvidia-smi")
+    if nvidia_smi is None:
+        return []
+    try:
+        output = subprocess.run(
+            [nvidia_smi, "--query-gpu=index,memory.total,name", "--format=csv,noheader,nounits"],
+            capture_output=True,
+            text=True,
+            check=True,
+            timeout=60,
+        ).stdout
+    except (subprocess.SubprocessError, OSError):
+        return []
+
+    devices = []
+    for line in output.splitlines():
+        if not line.strip():
+            continue
+        index, memory_mib, name = [field.strip() for field in line.split(",", 2)]
+        devices.append(GPUDevice(int(index), int(memory_mib) * 1024**2, name))
+    return devices
+
+
+def estimate_search_device_bytes(n_images, image_shape, results_per_pixel=None):
+    """Estimate the device memory of a search.
+
+    Parameters
+    ----------
+    n_images : int
+        The number of images in the WorkUnit.
+    image_shape : tuple[int, int] | None
+        The shape of each image, or None if it is unknown.
+    results_per_pixel : int, optional
+        The candidate trajectories kept per pixel, by default None, DEFAULT_RESULTS_PER_PIXEL
+
+    Returns
+    -------
+    int | None
+        The estimated device memory in bytes, or None if the image shape is unknown.
+    """
+    if image_shape is None:
+        return None
+    n_pixels = int(image_shape[0]) * int(image_shape[1])
+    results_per_pixel = results_per_pixel if results_per_pixel is not None else DEFAULT_RESULTS_PER_PIXEL
+    return (
+        CONTEXT_BYTES
+        + n_images * n_pixels * SEARCH_BYTES_PER_PIXEL
+        + n_pixels * results_per_pixel * TRAJECTORY_BYTES
+    )
+
+
+class GPUAllocator:
+    """Hands out slots of the host's GPUs to searches, using lock files.
+
+    Each device is divided into ``slots_per_device`` slots of equal memory, and
+    a search takes as many slots of a single device as its estimated device
+    memory requires. The slots are held with `fcntl.flock`, so they are given
+    back by the kernel if a worker dies.
+
+    Parameters
+    ----------
+    lock_directory : str, optional
+        A directory local to the host for the slot lock files, by default None,
+        a directory in the temporary directory.
+    slots_per_device : int, optional
+        The number of slots of each device, by default DEFAULT_SLOTS_PER_DEVICE
+    memory_fraction : float, optional
+        The fraction of each device's memory handed out as slots, by default DEFAULT_MEMORY_FRACTION
+    devices : list[GPUDevice], optional
+        The devices, by default None, see `enumerate_devices`.
+    """
+
+    def __init__(
+        self,
+        lock_directory=None,
+        slots_per_device=DEFAULT_SLOTS_PER_DEVICE,
+        memory_fraction=DEFAULT_MEMORY_FRACTION,
+        devices=None,
+    ):
+        self.lock_directory = (
+            lock_directory
+            if lock_directory is not None
+            else os.path.join(tempfile.gettempdir(), f"kbmod_wf_gpu_slots_{os.getuid()}")
+        )
+        self.slots_per_device = max(1, int(slots_per_device))
+        self.memory_fraction = memory_fraction
+        self.devices = devices if devices is not None else enumerate_devices()
+        os.makedirs(self.lock_directory, exist_ok=True)
+
+    def slots_required(self, device, device_bytes):
+        """Return the number of slots of a device a search needs, at most all of them."""
+        if device_bytes is None:
+            return 1
+        slot_bytes = device.memory_bytes * self.memory_fraction / self.slots_per_device
+        return max(1, min(self.slots_per_device, math.ceil(device_bytes / slot_bytes)))
+
+    def _try_device(self, device, n_slots):
+        """Take ``n_slots`` free slots of a device without waiting, or return None."""
+        held = []
+        for slot in range(self.slots_per_device):
+            filepath = os.path.join(self.lock_directory, f"gpu{device.index}.slot{slot}.lock")
+            fd = os.open(filepath, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            held.append(fd)
+            if len(held) == n_slots:
+                return held
+        self._release(held)
+        return None
+
+    @staticmethod
+    def _release(fds):
+        for fd in fds:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+
+    def _n_free(self, device):
+        """Count the free slots of a device, to prefer the least loaded one."""
+        n_free = 0
+        for slot in range(self.slots_per_device):
+            filepath = os.path.join(self.lock_directory, f"gpu{device.index}.slot{slot}.lock")
+            fd = os.open(filepath, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                fcntl.flock(fd, fcntl.LOCK_UN)
+                n_free += 1
+            except BlockingIOError:
+                pass
+            finally:
+                os.close(fd)
+        return n_free
+
+    def acquire(self, device_bytes=None, devices=None, timeout=DEFAULT_TIMEOUT, logger=None):
+        """Wait for the slots a search needs on one of the devices.
+
+        Parameters
+        ----------
+        device_bytes : int, optional
+            The estimated device memory of the search, by default None, a single slot.
+        devices : list[GPUDevice], optional
+            The devices to choose from, by default None, all of them.
+        timeout : float, optional
+            Seconds to wait for the slots, by default DEFAULT_TIMEOUT
+        logger : logging.Logger, optional
+            Logs waits for a slot, by default None
+
+        Returns
+        -------
+        tuple[GPUDevice, list[int]]
+            The device, and the file descriptors of the slots held, see `release`.
+
+        Raises
+        ------
+        TimeoutError
+            If no device had enough free slots before the timeout.
+        """
+        devices = devices if devices is not None else self.devices
+        deadline = time.monotonic() + timeout
+        waiting = False
+        while True:
+            for device in sorted(devices, key=self._n_free, reverse=True):
+                held = self._try_device(device, self.slots_required(device, device_bytes))
+                if held is not None:
+                    return device, held
+
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                raise TimeoutError(f"No GPU slot became free within {timeout}[s].")
+            if not waiting and logger is not None:
+                logger.info(f"Waiting for a slot on GPUs {[d.index for d in devices]}")
+                waiting = True
+            time.sleep(min(POLL_INTERVAL, remaining))
+
+    def release(self, held):
+        """Give back the slots returned by `acquire`."""
+        self._release(held)
+
+
+def _get_allocator(gpu_config):
+    return GPUAllocator(
+        lock_directory=gpu_config.get("lock_directory"),
+        slots_per_device=gpu_config.get("slots_per_device", DEFAULT_SLOTS_PER_DEVICE),
+        memory_fraction=gpu_config.get("memory_fraction", DEFAULT_MEMORY_FRACTION),
+    )
+
+
+def _get_worker_devices(devices):
+    """Return the devices this worker may use, only the pinned one once there is one."""
+    if _pinned_device is not None:
+        return [d for d in devices if d.index == _pinned_device] or devices
+    # Keep to the devices that the scheduler, e.g. Slurm, gave this worker.
+    visible = os.environ.get("CUDA_VISIBLE_DEVICES", "").split(",")
+    if all(index.strip().isdigit() for index in visible):
+        return [d for d in devices if str(d.index) in visible] or devices
+    return devices
+
+
+def _pin_device(device):
+    global _pinned_device
+
+    if _pinned_device is None:
+        os.environ["CUDA_VISIBLE_DEVICES"] = str(device.index)
+        _pinned_device = device.index
+
+
+def pin_gpu(gpu_config=None, logger=None):
+    """Make the least loaded of the host's GPUs the only device visible to CUDA
+    in this process, unless a device has already been pinned.
+
+    CUDA only reads CUDA_VISIBLE_DEVICES when it is initialized, so this is
+    called before kbmod is first imported, or asked whether it has a GPU. The
+    slots of the device are then taken by `gpu_slot` for each search.
+
+    Parameters
+    ----------
+    gpu_config : dict, optional
+        The ``gpu`` table of the search's runtime configuration, see `gpu_slot`,
+        by default None
+    logger : logging.Logger, optional
+        Logs the device that was pinned, by default None
+
+    Returns
+    -------
+    GPUDevice | None
+        The device, or None if the host has no GPUs that could be found.
+    """
+    allocator = _get_allocator(gpu_config or {})
+    if len(allocator.devices) == 0:
+        if logger is not None:
+            logger.info("No GPUs found to pin, leaving CUDA_VISIBLE_DEVICES unchanged.")
+        return None
+
+    pinned = _pinned_device
+    device = max(_get_worker_devices(allocator.devices), key=allocator._n_free)
+    _pin_device(device)
+    if pinned is None and logger is not None:
+        logger.info(f"Pinned GPU {device.index} for the searches of this worker.")
+    return device
+
+
+@contextmanager
+def gpu_slot(device_bytes=None, gpu_config=None, logger=None):
+    """Hold a slot of a GPU for the duration of a search, and make it the only
+    device visible to CUDA in this process, see `pin_gpu`.
+
+    Parameters
+    ----------
+    device_bytes : int, optional
+        The estimated device memory of the search, see
+        `estimate_search_device_bytes`, by default None, a single slot.
+    gpu_config : dict, optional
+        The ``gpu`` table of the search's runtime configuration, which may set
+        ``slots_per_device``, ``memory_fraction``, ``lock_directory`` and
+        ``timeout``, by default None
+    logger : logging.Logger, optional
+        Logs the slot that was taken, by default None
+
+    Yields
+    ------
+    GPUDevice | None
+        The device, or None if the host has no GPUs that could be found.
+    """
+    gpu_config = gpu_config or {}
+    allocator = _get_allocator(gpu_config)
+    if len(allocator.devices) == 0:
+        if logger is not None:
+            logger.info("No GPUs found to allocate, leaving CUDA_VISIBLE_DEVICES unchanged.")
+        yield None
+        return
+
+    device, held = allocator.acquire(
+        device_bytes,
+        devices=_get_worker_devices(allocator.devices),
+        timeout=gpu_config.get("timeout", DEFAULT_TIMEOUT),
+        logger=logger,
+    )
+    try:
+        _pin_device(device)
+        if logger is not None:
+            estimate = "unknown" if device_bytes is None else f"{round(device_bytes / 1024**3, 2)}[GB]"
+            logger.info(
+                f"Using {len(held)} of {allocator.slots_per_device} slots of GPU {device.index} "
+                f"for an estimated {estimate} of device memory."
+            )
+        yield device
+    finally:
+        allocator.release(held)
@@ -0,0 +1,221 @@
+import contextlib
+import hashlib
+import multiprocessing
+import os
+import pickle
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from kbmod_wf.utilities.tracing_utilities import trace_span
+
+__all__ = ["HeaderCache", "build_image_collection"]
+
+
+DEFAULT_HEADER_WORKERS = 8
+"""Default number of threads, or processes, that read the headers of the images."""
+
+DEFAULT_HEADER_CACHE_MAX_BYTES = 1024**3
+"""Default size budget of the on-disk header cache."""
+
+
+class HeaderCache:
+    """An on-disk cache of the ImageCollection rows of each image, i.e. the
+    metadata and WCS read from its headers.
+
+    Each image's rows are stored in their own file, named by a hash of the
+    image's path, modification time and size, and of the kbmod version, so an
+    image that is restaged is read again. Files are touched when read, and the
+    least recently used files are evicted once the cache grows beyond its size
+    budget. The cache can be shared by every uri_to_ic task of a campaign, e.g.
+    on a shared filesystem, as overlapping patches list the same images.
+
+    Parameters
+    ----------
+    cache_directory : str
+        The directory the rows are stored in. It is created if required.
+    max_bytes : int, optional
+        The size budget of the cache, by default DEFAULT_HEADER_CACHE_MAX_BYTES
+    """
+
+    def __init__(self, cache_directory, max_bytes=DEFAULT_HEADER_CACHE_MAX_BYTES):
+        self.cache_directory = cache_directory
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_directory, exist_ok=True)
+
+    @staticmethod
+    def key(filepath, stat, version=""):
+        """Return the cache key of an image, given its `os.stat` result."""
+        digest = hashlib.blake2b(digest_size=20)
+        for part in (os.path.abspath(filepath), repr((stat.st_mtime_ns, stat.st_size)), version):
+            digest.update(part.encode())
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_directory, f"{key}.pkl")
+
+    def get(self, key):
+        """Return the cached rows for a key, or None."""
+        path = self._path(key)
+        try:
+            with open(path, "rb") as f:
+                value = pickle.load(f)
+        except (OSError, EOFError, pickle.UnpicklingError):
+            return None
+        with contextlib.suppress(OSError):
+            os.utime(path)
+        return value
+
+    def put(self, key, value):
+        """Store the rows for a key."""
+        # Write to a temporary file first, so that concurrent readers never see a partial file.
+        fd, tmp_path = tempfile.mkstemp(dir=self.cache_directory, suffix=".tmp")
+        with os.fdopen(fd, "wb") as f:
+            pickle.dump(value, f)
+        os.replace(tmp_path, self._path(key))
+
+    def evict(self):
+        """Remove the least recently used rows until the cache is within its size budget."""
+        with self._lock:
+            entries = []
+            total = 0
+            with os.scandir(self.cache_directory) as it:
+                for entry in it:
+                    if not entry.name.endswith(".pkl"):
+                        continue
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+                    total += stat.st_size
+
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(path)
+                total -= size
+
+
+def _read_collection_table(filepath):
+    """Read the ImageCollection rows of a single image. astropy only reads the
+    headers of a FITS file until its data is accessed, which the metadata
+    standardization doesn't do."""
+    from kbmod import ImageCollection
+
+    return ImageCollection.fromTargets([filepath]).data
+
+
+def _stack_collection_tables(tables):
+    """Stack the rows of single image ImageCollections into one ImageCollection,
+    renumbering the standardizer of each row as `ImageCollection.fromTargets` would."""
+    from astropy.table import vstack
+    from kbmod import ImageCollection
+
+    stacked = []
+    n_stds = 0
+    for table in tables:
+        # The same image may be listed twice, so a table is never modified in place.
+        table = table.copy(copy_data=True)
+        if "std_idx" in table.colnames:
+            table["std_idx"] += n_stds
+        n_stds += table.meta.get("n_stds", 1)
+        stacked.append(table)
+
+    data = vstack(stacked, metadata_conflicts="silent")
+    data.meta["n_stds"] = n_stds
+    return ImageCollection(data)
+
+
+def build_image_collection(
+    filepaths,
+    n_workers=DEFAULT_HEADER_WORKERS,
+    pool="thread",
+    cache_directory=None,
+    max_cache_bytes=DEFAULT_HEADER_CACHE_MAX_BYTES,
+    logger=None,
+):
+    """A drop in replacement for `ImageCollection.fromTargets` of a list of
+    files, that reads the headers of the images concurrently, and caches the
+    rows of each image on disk.
+
+    Parameters
+    ----------
+    filepaths : list[str]
+        The images, that are known to exist.
+    n_workers : int, optional
+        The number of threads, or processes, reading the headers of the images
+        missing from the cache, by default DEFAULT_HEADER_WORKERS
+    pool : str, optional
+        "thread" or "process". Threads hide the latency of a parallel
+        filesystem, processes also parallelize the parsing of the headers, but
+        are spawned, so each one imports kbmod before it reads a header, by
+        default "thread"
+    cache_directory : str, optional
+        The directory of the on-disk cache, by default None (no caching)
+    max_cache_bytes : int, optional
+        The size budget of the on-disk cache, by default DEFAULT_HEADER_CACHE_MAX_BYTES
+    logger : logging.Logger, optional
+        Logger used to report cache hits, by default None
+
+    Returns
+    -------
+    kbmod.ImageCollection
+        The ImageCollection of the images, in order.
+    """
+    import kbmod
+
+    if pool not in ("thread", "process"):
+        raise ValueError(f"Invalid header pool {pool!r}, expected 'thread' or 'process'.")
+    if len(filepaths) == 0:
+        return kbmod.ImageCollection.fromTargets(filepaths)
+
+    unique_filepaths = list(dict.fromkeys(filepaths))
+    n_workers = max(1, min(int(n_workers), len(unique_filepaths)))
+    cache = HeaderCache(cache_directory, max_bytes=max_cache_bytes) if cache_directory is not None else None
+
+    tables = {}
+    keys = {}
+    if cache is not None:
+        version = getattr(kbmod, "__version__", "")
+
+        def lookup(filepath):
+            key = HeaderCache.key(filepath, os.stat(filepath), version)
+            return filepath, key, cache.get(key)
+
+        with ThreadPoolExecutor(max_workers=n_workers, thread_name_prefix="header-cache") as lookups:
+            for filepath, key, table in lookups.map(lookup, unique_filepaths):
+                keys[filepath] = key
+                if table is not None:
+                    tables[filepath] = table
+
+    missing = [filepath for filepath in unique_filepaths if filepath not in tables]
+    if logger is not None:
+        logger.debug(f"Found the headers of {len(tables)} of {len(unique_filepaths)} images in the cache.")
+
+    if len(missing) > 0:
+        with trace_span("ic.headers", n_images=len(missing), n_cached=len(tables), pool=pool):
+            if n_workers > 1 and len(missing) > 1:
+                max_workers = min(n_workers, len(missing))
+                if pool == "process":
+                    # The task's process has threads, e.g. the logging listener, that a forked
+                    # reader would inherit the locks of, so the readers are started afresh.
+                    readers = ProcessPoolExecutor(
+                        max_workers, mp_context=multiprocessing.get_context("spawn")
+                    )
+                else:
+                    readers = ThreadPoolExecutor(max_workers)
+                with readers:
+                    read = list(readers.map(_read_collection_table, missing))
+            else:
+                read = [_read_collection_table(filepath) for filepath in missing]
+
+        for filepath, table in zip(missing, read, strict=True):
+            tables[filepath] = table
+            if cache is not None:
+                cache.put(keys[filepath], table)
+
+        if cache is not None:
+            cache.evict()
+
+    return _stack_collection_tables([tables[filepath] for filepath in filepaths])
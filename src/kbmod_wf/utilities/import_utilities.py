@@ -0,0 +1,175 @@
+import argparse
+import os
+import re
+import subprocess
+import sys
+
+__all__ = ["ImportTime", "measure_import_time", "check_import_budgets"]
+
+
+IMPORT_BUDGETS = {
+    "kbmod_wf": 0.1,
+    "kbmod_wf.multi_night_workflow": 0.5,
+    "kbmod_wf.planner": 0.5,
+}
+"""The most seconds that importing each module may take, i.e. the package itself,
+and a workflow's command line before it has parsed its arguments."""
+
+HEAVY_MODULES = ["parsl", "kbmod", "astropy", "reproject", "lsst", "numpy", "scipy"]
+"""Top level packages that the modules in IMPORT_BUDGETS must not import, they are
+imported by the code that needs them instead."""
+
+_IMPORT_TIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)\s*$")
+
+
+class ImportTime:
+    """The ``-X importtime`` measurement of importing a module in a fresh interpreter.
+
+    Parameters
+    ----------
+    module : str
+        The module that was imported.
+    seconds : float
+        The cumulative import time of the module.
+    imports : list[tuple[str, float, float, int]]
+        The name, own seconds, cumulative seconds and nesting depth of every
+        module that was imported, in the order they finished importing.
+    """
+
+    def __init__(self, module, seconds, imports):
+        self.module = module
+        self.seconds = seconds
+        self.imports = imports
+
+    @property
+    def heavy_modules(self):
+        """The HEAVY_MODULES that were imported."""
+        top_level = {name.split(".")[0] for name, *_ in self.imports}
+        return [name for name in HEAVY_MODULES if name in top_level]
+
+    def report(self, top=15):
+        """Return the slowest ``top`` imports by their own time, as ``-X importtime`` lines."""
+        lines = [f"{self.module}: {round(self.seconds * 1000, 1)}[ms]"]
+        if self.heavy_modules:
+            lines[0] += f", importing {', '.join(self.heavy_modules)}"
+        lines.append("     self [us] | cumulative [us] | imported package")
+        slowest = sorted(self.imports, key=lambda item: item[1], reverse=True)[:top]
+        for name, own, cumulative, depth in slowest:
+            lines.append(f"{round(own * 1e6):>14} | {round(cumulative * 1e6):>15} | {'  ' * depth}{name}")
+        return "\n".join(lines)
+
+
+def measure_import_time(module, repeat=3, python=None):
+    """Measure the import time of a module with ``python -X importtime``.
+
+    Parameters
+    ----------
+    module : str
+        The module to import, e.g. "kbmod_wf".
+    repeat : int, optional
+        The number of fresh interpreters to import the module in, the fastest
+        is kept, so that a cold filesystem cache is not counted, by default 3
+    python : str, optional
+        The python executable, by default None, the current one.
+
+    Returns
+    -------
+    ImportTime
+        The fastest of the measurements.
+    """
+    fastest = None
+    for _ in range(max(1, repeat)):
+        completed = subprocess.run(
+            [python or sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True,
+            text=True,
+            env={**os.environ, "PYTHONDONTWRITEBYTECODE": "1"},
+        )
+        if completed.returncode != 0:
+            raise ImportError(f"Failed to import {module}:\n{completed.stderr}")
+
+        imports = []
+        for line in completed.stderr.splitlines():
+            match = _IMPORT_TIME_LINE.match(line)
+            if match is None:
+                continue
+            own, cumulative, indent, name = match.groups()
+            imports.append((name, int(own) / 1e6, int(cumulative) / 1e6, (len(indent) - 1) // 2))
+
+        # The interpreter's own startup, up to and including site, is not part of the module's import.
+        startup = [i for i, (name, _, _, depth) in enumerate(imports) if name == "site" and depth == 0]
+        if startup:
+            imports = imports[startup[-1] + 1 :]
+        seconds = sum(cumulative for _, _, cumulative, depth in imports if depth == 0)
+        if fastest is None or seconds < fastest.seconds:
+            fastest = ImportTime(module, seconds, imports)
+    return fastest
+
+
+def check_import_budgets(budgets=None, repeat=3, top=15, forbid_heavy=True, verbose=True):
+    """Measure each module against its budget, and that it doesn't import any of HEAVY_MODULES.
+
+    Parameters
+    ----------
+    budgets : dict[str, float], optional
+        The most seconds the import of each module may take, by default None, IMPORT_BUDGETS
+    repeat : int, optional
+        The number of measurements of each module, see `measure_import_time`, by default 3
+    top : int, optional
+        The number of slowest imports to print for each module, by default 15
+    forbid_heavy : bool, optional
+        Fail a module that imports any of HEAVY_MODULES, by default True
+    verbose : bool, optional
+        Print the report of each module, by default True
+
+    Returns
+    -------
+    list[str]
+        A description of each budget that was exceeded, empty if none were.
+    """
+    budgets = budgets if budgets is not None else IMPORT_BUDGETS
+    failures = []
+    for module, budget in budgets.items():
+        measured = measure_import_time(module, repeat=repeat)
+        if verbose:
+            print(measured.report(top=top) + "\n")
+        if measured.seconds > budget:
+            failures.append(f"{module} took {round(measured.seconds, 3)}[s], over its budget of {budget}[s]")
+        if forbid_heavy and measured.heavy_modules:
+            failures.append(f"{module} imported {', '.join(measured.heavy_modules)}")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Report the import time of kbmod_wf modules, failing if any exceeds its budget."
+    )
+    parser.add_argument(
+        "modules", type=str, nargs="*", help="The modules to measure, by default those in IMPORT_BUDGETS"
+    )
+    parser.add_argument(
+        "--budget", type=float, help="The budget in seconds of every module, by default from IMPORT_BUDGETS"
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Fresh interpreters per module, the fastest is kept"
+    )
+    parser.add_argument("--top", type=int, default=15, help="The number of slowest imports to print")
+    args = parser.parse_args()
+
+    budgets = {}
+    for module in args.modules or IMPORT_BUDGETS:
+        budgets[module] = IMPORT_BUDGETS.get(module, max(IMPORT_BUDGETS.values()))
+        if args.budget is not None:
+            budgets[module] = args.budget
+
+    # Other modules, e.g. the workflow_tasks, are expected to import parsl and the like.
+    failures = check_import_budgets(
+        budgets, repeat=args.repeat, top=args.top, forbid_heavy=len(args.modules) == 0
+    )
+    for failure in failures:
+        print(f"FAILED: {failure}")
+    sys.exit(1 if failures else 0)
+
+
+if __name__ == "__main__":
+    main()
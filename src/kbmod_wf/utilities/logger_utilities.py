@@ -1,69 +1,358 @@
-import traceback
+import argparse
+import atexit
+import glob
+import heapq
 import logging
-from logging import config
-
-__all__ = ["LOGGING_CONFIG", "get_configured_logger", "ErrorLogger"]
-
-
-LOGGING_CONFIG = {
-    "version": 1.0,
-    "formatters": {
-        "standard": {
-            "format": (
-                "[%(processName)s-%(process)d %(threadName)s-%(thread)d "
-                "%(asctime)s %(levelname)s %(name)s] %(message)s"
-            ),
-        },
-    },
-    "handlers": {
-        "stdout": {
-            "level": "DEBUG",
-            "formatter": "standard",
-            "class": "logging.StreamHandler",
-            "stream": "ext://sys.stdout",
-        },
-        "stderr": {
-            "level": "DEBUG",
-            "formatter": "standard",
-            "class": "logging.StreamHandler",
-            "stream": "ext://sys.stderr",
-        },
-        "file": {
-            "level": "DEBUG",
-            "formatter": "standard",
-            "class": "logging.FileHandler",
-            "filename": "parsl.log",
-        },
-    },
-    "loggers": {
-        "task": {"level": "DEBUG", "handlers": ["file", "stdout"], "propagate": False},
-        "task.create_manifest": {},
-        "task.ic_to_wu": {},
-        "task.reproject_wu": {},
-        "task.kbmod_search": {},
-        "kbmod": {"level": "DEBUG", "handlers": ["file", "stdout"], "propagate": False},
-    },
+import multiprocessing.util
+import os
+import queue
+import re
+import socket
+import sys
+import threading
+import time
+import traceback
+from logging.handlers import QueueHandler, QueueListener
+
+__all__ = [
+    "LOGGING_FORMAT",
+    "DEFAULT_LOGGING_CONFIG",
+    "get_configured_logger",
+    "get_worker_log_filepath",
+    "merge_logs",
+    "ErrorLogger",
+]
+
+
+LOGGING_FORMAT = (
+    "[%(processName)s-%(process)d %(threadName)s-%(thread)d "
+    "%(asctime)s %(levelname)s %(name)s] %(message)s"
+)
+"""Format of every log record."""
+
+DEFAULT_LOGGING_CONFIG = {
+    "level": "DEBUG",
+    "stdout_level": "WARNING",
+    "flush_interval": 2.0,
+    "buffer_size": 1024 * 1024,
+    "stages": {},
+    "trace": False,
 }
-"""Default logging configuration for Parsl."""
+"""Default logging configuration, overridden by the ``[logging]`` section of the runtime configuration:
+
+- level, the level of the per-worker log files.
+- stdout_level, the level of the records that are also written to stdout.
+- flush_interval, the most seconds a record is buffered before it is written
+  to the log file. Records of WARNING and above are written immediately.
+- buffer_size, the size of the log file's write buffer in bytes.
+- stages, a ``level`` and a ``rate_limit``, in records per second, for the
+  loggers of individual tasks, keyed by the task name, e.g. "kbmod_search".
+- trace, record the spans of every task, see `kbmod_wf.utilities.tracing_utilities`.
+"""
+
+_CONFIGURED_LOGGERS = ("task", "kbmod", "workflow")
+
+# The settings that are applied once per process, unlike those of the stages, which apply to each logger.
+_PROCESS_SETTINGS = ("level", "stdout_level", "flush_interval", "buffer_size")
+
+_TIMESTAMP_PATTERN = re.compile(r"\d{4}-\d\d-\d\d \d\d:\d\d:\d\d,\d{3}")
+
+# The logging state of this process, which is configured once, by the first task to log.
+_lock = threading.Lock()
+_state = {
+    "pid": None,
+    "file_path": None,
+    "settings": None,
+    "ignored_settings": set(),
+    "listener": None,
+    "queue_handler": None,
+    "filters": {},
+}
+
+
+def get_worker_log_filepath(file_path, hostname=None, pid=None):
+    """Return the log file written by a single worker process, next to the workflow's log file.
+
+    Parameters
+    ----------
+    file_path : str
+        The workflow's log file, e.g. "<run_dir>/kbmod.log".
+    hostname : str, optional
+        The host of the worker, by default None, this host.
+    pid : int, optional
+        The process id of the worker, by default None, this process.
+
+    Returns
+    -------
+    str
+        e.g. "<run_dir>/kbmod.<hostname>.<pid>.log"
+    """
+    root, ext = os.path.splitext(file_path)
+    hostname = hostname if hostname is not None else socket.gethostname().split(".")[0]
+    pid = pid if pid is not None else os.getpid()
+    return f"{root}.{hostname}.{pid}{ext}"
+
+
+class _BufferedFileHandler(logging.FileHandler):
+    """A FileHandler that only flushes its write buffer periodically, or for
+    records of WARNING and above, rather than after every record."""
+
+    def __init__(self, filename, buffer_size, flush_interval):
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self._last_flush = time.monotonic()
+        super().__init__(filename, mode="a", delay=False)
+
+    def _open(self):
+        return open(self.baseFilename, self.mode, buffering=self.buffer_size, encoding=self.encoding)
+
+    def emit(self, record):
+        try:
+            self.stream.write(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+            return
+        if record.levelno >= logging.WARNING or time.monotonic() - self._last_flush >= self.flush_interval:
+            self.flush()
+
+    def flush(self):
+        super().flush()
+        self._last_flush = time.monotonic()
+
+
+class _FlushingQueueListener(QueueListener):
+    """A QueueListener that flushes its handlers whenever the queue has been idle for a while."""
+
+    def __init__(self, log_queue, *handlers, flush_interval):
+        super().__init__(log_queue, *handlers, respect_handler_level=True)
+        self.flush_interval = flush_interval
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(block, timeout=self.flush_interval if block else None)
+            except queue.Empty:
+                if not block:
+                    raise
+                for handler in self.handlers:
+                    handler.flush()
+
+
+class _RateLimitFilter(logging.Filter):
+    """Allows at most ``rate_limit`` records per second through, reporting how
+    many were dropped with the next record that is allowed through."""
+
+    def __init__(self, rate_limit):
+        super().__init__()
+        self.rate_limit = rate_limit
+        self._window_start = time.monotonic()
+        self._count = 0
+        self._dropped = 0
+
+    def filter(self, record):
+        # Problems are never dropped.
+        if record.levelno >= logging.WARNING:
+            return True
+
+        now = time.monotonic()
+        if now - self._window_start >= 1.0:
+            self._window_start = now
+            self._count = 0
+        if self._count >= self.rate_limit:
+            self._dropped += 1
+            return False
+
+        self._count += 1
+        if self._dropped > 0:
+            record.msg = f"{record.msg} [{self._dropped} records dropped by the rate limit]"
+            self._dropped = 0
+        return True
+
+
+def _configure_process(file_path, logging_config):
+    """Route the task loggers of this process through a queue, to a buffered
+    per-worker log file and stdout, both written by a listener thread."""
+    # A listener inherited from a forked parent process has no thread to stop.
+    previous_listener = _state["listener"]
+    if previous_listener is not None and _state["pid"] == os.getpid():
+        previous_listener.stop()
 
+    formatter = logging.Formatter(LOGGING_FORMAT)
+    handlers = []
+    if file_path is not None:
+        file_handler = _BufferedFileHandler(
+            get_worker_log_filepath(file_path),
+            buffer_size=logging_config["buffer_size"],
+            flush_interval=logging_config["flush_interval"],
+        )
+        file_handler.setLevel(logging_config["level"])
+        handlers.append(file_handler)
+    stdout_handler = logging.StreamHandler(sys.stdout)
+    stdout_handler.setLevel(logging_config["stdout_level"])
+    handlers.append(stdout_handler)
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    listener = _FlushingQueueListener(log_queue, *handlers, flush_interval=logging_config["flush_interval"])
+    listener.start()
+
+    queue_handler = QueueHandler(log_queue)
+    for name in _CONFIGURED_LOGGERS:
+        logger = logging.getLogger(name)
+        if _state["queue_handler"] is not None:
+            logger.removeHandler(_state["queue_handler"])
+        logger.addHandler(queue_handler)
+        logger.setLevel(min(logging_config["level"], logging_config["stdout_level"], key=_level_number))
+        logger.propagate = False
+
+    if _state["pid"] != os.getpid():
+        # Worker processes started by multiprocessing exit without running atexit handlers.
+        multiprocessing.util.Finalize(None, _stop_listener, exitpriority=10)
+    _state.update(
+        pid=os.getpid(),
+        file_path=file_path,
+        settings=_get_process_settings(logging_config),
+        ignored_settings=set(),
+        listener=listener,
+        queue_handler=queue_handler,
+    )
+
+
+def _get_process_settings(logging_config):
+    return tuple((name, logging_config[name]) for name in _PROCESS_SETTINGS)
+
+
+def _level_number(level):
+    return logging.getLevelName(level) if isinstance(level, str) else level
+
+
+def _configure_stage(logger, stage_config):
+    """Apply the level and rate limit of a stage to its logger."""
+    if "level" in stage_config:
+        logger.setLevel(stage_config["level"])
 
-def get_configured_logger(logger_name, file_path=None):
-    """Configure logging to output to the given file.
+    rate_limit = stage_config.get("rate_limit")
+    previous_filter = _state["filters"].get(logger.name)
+    if previous_filter is not None and previous_filter.rate_limit == rate_limit:
+        return
+
+    if previous_filter is not None:
+        logger.removeFilter(_state["filters"].pop(logger.name))
+    if rate_limit is not None:
+        rate_filter = _RateLimitFilter(rate_limit)
+        logger.addFilter(rate_filter)
+        _state["filters"][logger.name] = rate_filter
+
+
+def _stop_listener():
+    if _state["listener"] is not None and _state["pid"] == os.getpid():
+        _state["listener"].stop()
+        _state["listener"] = None
+
+
+atexit.register(_stop_listener)
+
+
+def get_configured_logger(logger_name, file_path=None, logging_config=None):
+    """Return a logger that writes to this worker's log file, see `get_worker_log_filepath`.
+
+    Logging is configured once per process. Records are handed to a queue, and
+    written by a background thread, so logging never blocks on the filesystem.
+    A later ``logging_config`` with different process wide settings, e.g. the
+    level of the log file, is ignored with a warning, only its ``stages`` apply.
 
     Parameters
     ----------
     logger_name : `str`
-        Name of the created logger instance.
+        Name of the created logger instance, e.g. "task.kbmod_search".
     file_path : `str` or `None`, optional
-        Path to the log file, if any
+        Path to the workflow's log file, if any
+    logging_config : `dict` or `None`, optional
+        The ``[logging]`` section of the runtime configuration, by default None,
+        see DEFAULT_LOGGING_CONFIG.
     """
-    logconf = LOGGING_CONFIG.copy()
-    if file_path is not None:
-        logconf["handlers"]["file"]["filename"] = file_path
-    config.dictConfig(logconf)
-    logger = logging.getLogger()
+    logging_config = {**DEFAULT_LOGGING_CONFIG, **(logging_config or {})}
+    file_path = os.fspath(file_path) if file_path is not None else None
 
-    return logging.getLogger(logger_name)
+    logger = logging.getLogger(logger_name)
+    ignored = None
+    with _lock:
+        settings = _get_process_settings(logging_config)
+        if (
+            _state["listener"] is None
+            or _state["pid"] != os.getpid()
+            or (file_path is not None and file_path != _state["file_path"])
+        ):
+            _configure_process(file_path, logging_config)
+        elif settings != _state["settings"] and settings not in _state["ignored_settings"]:
+            # Only warned about once, as every task of the worker passes the same configuration.
+            _state["ignored_settings"].add(settings)
+            ignored = settings
+        stage_name = logger_name.split(".", 1)[-1]
+        _configure_stage(logger, logging_config["stages"].get(stage_name, {}))
+
+    if ignored is not None:
+        logger.warning(
+            f"Ignoring the logging configuration {dict(ignored)}, this process was already "
+            f"configured with {dict(_state['settings'])}"
+        )
+    return logger
+
+
+def _read_records(filepath):
+    """Yield (timestamp, record) from a log file, keeping multi-line records, e.g. tracebacks, together."""
+    timestamp, lines = None, []
+    with open(filepath, "r", errors="replace") as f:
+        for line in f:
+            match = _TIMESTAMP_PATTERN.search(line) if line.startswith("[") else None
+            if match is not None:
+                if lines:
+                    yield timestamp, "".join(lines)
+                timestamp, lines = match.group(0), [line]
+            elif lines:
+                lines.append(line)
+            else:
+                # Lines before the first record are kept at the start.
+                timestamp, lines = "", [line]
+    if lines:
+        yield timestamp, "".join(lines)
+
+
+def merge_logs(file_path, output_filepath=None):
+    """Merge the per-worker log files of a workflow into a single, time ordered, log.
+
+    Parameters
+    ----------
+    file_path : str
+        The workflow's log file, e.g. "<run_dir>/kbmod.log".
+    output_filepath : str, optional
+        The merged log file, by default None, "<run_dir>/kbmod.merged.log".
+
+    Returns
+    -------
+    tuple[str, int]
+        The merged log file, and the number of per-worker log files merged into it.
+    """
+    root, ext = os.path.splitext(file_path)
+    output_filepath = output_filepath if output_filepath is not None else f"{root}.merged{ext}"
+
+    worker_filepaths = [
+        path
+        for path in glob.glob(f"{glob.escape(root)}.*{ext}")
+        if os.path.abspath(path) != os.path.abspath(output_filepath)
+    ]
+    # Logs written before the logs were split per worker.
+    if os.path.exists(file_path):
+        worker_filepaths.append(file_path)
+
+    # Each file is already time ordered, so they only need to be interleaved.
+    records = heapq.merge(*[_read_records(path) for path in sorted(worker_filepaths)], key=lambda r: r[0])
+    with open(output_filepath, "w") as f:
+        for _, record in records:
+            f.write(record)
+
+    return output_filepath, len(worker_filepaths)
 
 
 class ErrorLogger:
@@ -91,3 +380,20 @@ class ErrorLogger:
             msg = "".join(msg)
             self.logger.error(msg)
             return self.silence_errors
+
+
+def main():
+    """Merge the per-worker log files of a run from the command line, see `merge_logs`."""
+    parser = argparse.ArgumentParser(description="Merge the per-worker log files of a workflow run.")
+    parser.add_argument("log_filepath", type=str, help="The workflow's log file, e.g. <run_dir>/kbmod.log")
+    parser.add_argument(
+        "--output", type=str, help="The merged log file, by default <run_dir>/kbmod.merged.log"
+    )
+    args = parser.parse_args()
+
+    output_filepath, n_files = merge_logs(args.log_filepath, args.output)
+    print(f"Merged {n_files} log files into {output_filepath}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,444 @@
+import errno
+import fcntl
+import fnmatch
+import json
+import os
+import shutil
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = [
+    "FileStager",
+    "StagingIndex",
+    "scan_staging_directory",
+    "stage_file",
+    "stream_manifest_entries",
+]
+
+
+STAGING_STRATEGIES = ("auto", "reflink", "hardlink", "symlink", "copy")
+"""The ways a file can be placed in the output directory. "auto" tries a reflink,
+then a hard link, then a copy, see `FileStager`."""
+
+DEFAULT_STAGING = "copy"
+"""Default staging strategy, a full copy of each file."""
+
+DEFAULT_STAGING_THREADS = 8
+"""Default number of threads that stage the files of a batch."""
+
+STAGING_INDEX_FILENAME = ".staging_index.json"
+"""Name of the file in the output directory that records what has been staged, see `StagingIndex`."""
+
+FICLONE = getattr(fcntl, "FICLONE", 0x40049409)
+"""The Linux ioctl that clones a file, sharing its blocks until either copy is written to."""
+
+# Errors that mean a strategy can't be used for a file, so the next one is tried.
+_FALLBACK_ERRNOS = {
+    errno.EXDEV,
+    errno.EPERM,
+    errno.EMLINK,
+    errno.EOPNOTSUPP,
+    errno.ENOTSUP,
+    errno.ENOTTY,
+    errno.EINVAL,
+    errno.ENOSYS,
+}
+
+# Errors that mean a strategy can't be used for any file of the output directory.
+_UNSUPPORTED_ERRNOS = {errno.EXDEV, errno.EOPNOTSUPP, errno.ENOTSUP, errno.ENOTTY, errno.ENOSYS}
+
+
+def _strategies(staging):
+    """Return the strategies to try in turn for a staging option, always ending with a copy."""
+    if staging not in STAGING_STRATEGIES:
+        raise ValueError(f"Invalid staging strategy {staging!r}, expected one of {STAGING_STRATEGIES}.")
+    if staging == "auto":
+        return ["reflink", "hardlink", "copy"]
+    if staging == "copy":
+        return ["copy"]
+    return [staging, "copy"]
+
+
+def _reflink(source, destination):
+    """Clone a file on a filesystem that supports it, e.g. XFS or Btrfs, keeping
+    its metadata like `shutil.copy2`."""
+    if not sys.platform.startswith("linux"):
+        raise OSError(errno.ENOTSUP, "Reflinks are only supported on Linux", destination)
+    with open(source, "rb") as src, open(destination, "wb") as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+    shutil.copystat(source, destination)
+
+
+class StagingIndex:
+    """The modification time and size of every file staged into an output
+    directory, as of the last manifest, so that restaging only touches the files
+    that have changed since.
+
+    The index is kept in STAGING_INDEX_FILENAME in the output directory. A file
+    is up to date if its modification time, size and staging strategy are
+    unchanged, and its staged copy is still in the output directory.
+
+    Parameters
+    ----------
+    output_directory : str
+        The directory the files are staged into.
+    """
+
+    def __init__(self, output_directory):
+        self.filepath = os.path.join(output_directory, STAGING_INDEX_FILENAME)
+        self._lock = threading.Lock()
+        self._changed = False
+        try:
+            with open(self.filepath, "r") as f:
+                self._entries = json.load(f)
+        except (OSError, ValueError):
+            self._entries = {}
+
+        # One listing, rather than checking that each staged file still exists.
+        with os.scandir(output_directory) as entries:
+            self._staged = {entry.name for entry in entries}
+
+    def is_current(self, filepath, stat, staging):
+        """Return True if a file, given its `os.stat` result, was staged with the
+        same strategy and hasn't changed since."""
+        entry = self._entries.get(os.path.abspath(filepath))
+        if entry != [stat.st_mtime_ns, stat.st_size, staging]:
+            return False
+        return os.path.basename(filepath) in self._staged
+
+    def record(self, filepath, stat, staging):
+        """Record that a file, given its `os.stat` result, has been staged."""
+        with self._lock:
+            self._entries[os.path.abspath(filepath)] = [stat.st_mtime_ns, stat.st_size, staging]
+            self._staged.add(os.path.basename(filepath))
+            self._changed = True
+
+    def save(self):
+        """Write the index, if anything was staged since it was read or last written."""
+        with self._lock:
+            if not self._changed:
+                return
+            # Write to a temporary file first, so that a run that is killed never leaves a partial index.
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(self.filepath), suffix=".tmp")
+            with os.fdopen(fd, "w") as f:
+                json.dump(self._entries, f)
+            os.replace(tmp_path, self.filepath)
+            self._changed = False
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class FileStager:
+    """Places files in an output directory, without copying their data where
+    the filesystem allows it, and a pool of threads for the copies that remain.
+
+    The "reflink", "hardlink" and "symlink" strategies fall back to a copy for
+    a file they can't be used for, e.g. a hard link across filesystems. Once a
+    strategy is found to be unsupported by the output directory's filesystem
+    it isn't tried again. Hard and symbolic links share the staged file with
+    the staging directory, so it must not be modified or removed while the
+    workflow runs; a reflink is an independent copy.
+
+    Parameters
+    ----------
+    output_directory : str
+        The directory the files are staged into.
+    staging : str, optional
+        One of STAGING_STRATEGIES, by default DEFAULT_STAGING
+    n_threads : int, optional
+        The number of threads staging the files of a batch, by default DEFAULT_STAGING_THREADS
+    index : StagingIndex, optional
+        The files staged by the last manifest, that are skipped if they haven't
+        changed, by default None, every file is staged.
+    logger : logging.Logger, optional
+        Logs the strategies that are unsupported, by default None
+    """
+
+    def __init__(
+        self,
+        output_directory,
+        staging=DEFAULT_STAGING,
+        n_threads=DEFAULT_STAGING_THREADS,
+        index=None,
+        logger=None,
+    ):
+        self.output_directory = output_directory
+        self.staging = staging
+        self.strategies = _strategies(staging)
+        self.n_threads = max(1, int(n_threads))
+        self.index = index
+        self.logger = logger
+        self.n_staged = 0
+        self.n_unchanged = 0
+        self._lock = threading.Lock()
+
+    def _place(self, strategy, filepath, destination):
+        # Staged under a temporary name and renamed, so that a restaged file is replaced
+        # atomically, and a hard link to the previous version is never written through.
+        tmp_path = os.path.join(
+            self.output_directory,
+            f".{os.path.basename(destination)}.{os.getpid()}.{threading.get_ident()}.staging",
+        )
+        try:
+            if strategy == "reflink":
+                _reflink(filepath, tmp_path)
+            elif strategy == "hardlink":
+                os.link(filepath, tmp_path)
+            elif strategy == "symlink":
+                os.symlink(os.path.abspath(filepath), tmp_path)
+            else:
+                shutil.copy2(filepath, tmp_path)
+            os.replace(tmp_path, destination)
+        finally:
+            # rename does nothing if both names are already hard links to the same file.
+            if os.path.lexists(tmp_path):
+                os.remove(tmp_path)
+
+    def _unsupported(self, strategy, error):
+        """Stop trying a strategy that the output directory's filesystem doesn't support."""
+        with self._lock:
+            if strategy not in self.strategies:
+                return
+            self.strategies = [s for s in self.strategies if s != strategy]
+        if self.logger is not None:
+            self.logger.info(
+                f"Can't stage files into {self.output_directory} with a {strategy} ({error.strerror}), "
+                f"using {self.strategies[0]} instead."
+            )
+
+    def stage(self, filepath):
+        """Place a file in the output directory, unless it is already there and unchanged.
+
+        Parameters
+        ----------
+        filepath : str
+            The file to stage.
+
+        Returns
+        -------
+        str
+            The path to the staged file.
+        """
+        destination = os.path.join(self.output_directory, os.path.basename(filepath))
+        if os.path.abspath(destination) == os.path.abspath(filepath):
+            return filepath
+
+        stat = os.stat(filepath)
+        if self.index is not None and self.index.is_current(filepath, stat, self.staging):
+            with self._lock:
+                self.n_unchanged += 1
+            return destination
+
+        for strategy in list(self.strategies):
+            try:
+                self._place(strategy, filepath, destination)
+                break
+            except OSError as e:
+                if strategy == "copy" or e.errno not in _FALLBACK_ERRNOS:
+                    raise
+                if e.errno in _UNSUPPORTED_ERRNOS:
+                    self._unsupported(strategy, e)
+
+        with self._lock:
+            self.n_staged += 1
+        if self.index is not None:
+            self.index.record(filepath, stat, self.staging)
+        return destination
+
+    def stage_batch(self, filepaths):
+        """Stage a batch of files concurrently.
+
+        Parameters
+        ----------
+        filepaths : list[str]
+            The files to stage.
+
+        Returns
+        -------
+        list[str]
+            The paths to the staged files, in order.
+        """
+        n_threads = min(self.n_threads, len(filepaths))
+        if n_threads <= 1:
+            return [self.stage(filepath) for filepath in filepaths]
+        with ThreadPoolExecutor(max_workers=n_threads, thread_name_prefix="stage-files") as pool:
+            return list(pool.map(self.stage, filepaths))
+
+
+def scan_staging_directory(
+    directory_path, file_pattern="*.collection", seen=None, batch_size=None, pending=None
+):
+    """Find the files in a directory that match a pattern, yielding them in
+    batches as the directory listing is read.
+
+    Parameters
+    ----------
+    directory_path : str
+        The directory to scan. Sub-directories are not descended into.
+    file_pattern : str, optional
+        A shell-style pattern that the file names must match, by default "*.collection"
+    seen : set, optional
+        Paths that have already been discovered. These are skipped, and newly
+        discovered paths are added to the set, by default None
+    batch_size : int, optional
+        The maximum number of paths in each batch, by default None, a single batch.
+    pending : dict, optional
+        The size and modification time of the files found by the previous scan
+        that have not been yielded yet. When given, a file is only yielded once
+        its size and modification time are the same as in the previous scan, so
+        a file that is still being written is left for a later scan. The dict is
+        updated in place, by default None, every file is yielded when found.
+
+    Yields
+    ------
+    list[str]
+        The paths of newly discovered files.
+    """
+    if seen is None:
+        seen = set()
+
+    found = set()
+    batch = []
+    with os.scandir(directory_path) as entries:
+        for entry in entries:
+            if entry.path in seen or not fnmatch.fnmatch(entry.name, file_pattern):
+                continue
+            if not entry.is_file():
+                continue
+
+            if pending is not None:
+                stat = entry.stat()
+                identity = (stat.st_size, stat.st_mtime_ns)
+                found.add(entry.path)
+                if pending.get(entry.path) != identity:
+                    pending[entry.path] = identity
+                    continue
+                del pending[entry.path]
+
+            seen.add(entry.path)
+            batch.append(entry.path)
+            if batch_size is not None and len(batch) >= batch_size:
+                yield batch
+                batch = []
+
+    if pending is not None:
+        # Forget the files that were removed before they were yielded.
+        for path in set(pending) - found:
+            del pending[path]
+
+    if len(batch) > 0:
+        yield batch
+
+
+def stage_file(filepath, output_directory, staging=DEFAULT_STAGING):
+    """Place a staged file in the output directory.
+
+    Parameters
+    ----------
+    filepath : str
+        The file to stage.
+    output_directory : str
+        The directory the file is staged into.
+    staging : str, optional
+        One of STAGING_STRATEGIES, see `FileStager`, by default DEFAULT_STAGING
+
+    Returns
+    -------
+    str
+        The path to the staged file.
+    """
+    return FileStager(output_directory, staging).stage(filepath)
+
+
+def stream_manifest_entries(
+    staging_directory,
+    output_directory,
+    manifest_filepath,
+    file_pattern="*.collection",
+    batch_size=100,
+    watch=False,
+    poll_interval=30.0,
+    idle_timeout=600.0,
+    staging=DEFAULT_STAGING,
+    n_threads=DEFAULT_STAGING_THREADS,
+    logger=None,
+):
+    """Discover and stage files incrementally, yielding each batch of manifest
+    entries as soon as it is found, and appending it to the manifest file.
+
+    Parameters
+    ----------
+    staging_directory : str
+        The directory containing the files to be processed.
+    output_directory : str
+        The directory the files are staged into.
+    manifest_filepath : str
+        The manifest file. It is rewritten from the start, and each batch of
+        entries is flushed to it as it is yielded.
+    file_pattern : str, optional
+        A shell-style pattern that the file names must match, by default "*.collection"
+    batch_size : int, optional
+        The maximum number of entries in each batch, by default 100
+    watch : bool, optional
+        Keep polling the staging directory for new files, by default False.
+        A file is only staged once its size and modification time haven't
+        changed between two polls, so that files still being written are not
+        staged before they are complete.
+    poll_interval : float, optional
+        Seconds between scans of the staging directory when watching, by default 30.0
+    idle_timeout : float, optional
+        When watching, stop once no new files have been found for this many
+        seconds, by default 600.0. None will watch forever.
+    staging : str, optional
+        One of STAGING_STRATEGIES, see `FileStager`, by default DEFAULT_STAGING
+    n_threads : int, optional
+        The number of threads staging each batch, by default DEFAULT_STAGING_THREADS
+    logger : logging.Logger, optional
+        Logger used to report progress, by default None
+
+    Yields
+    ------
+    list[str]
+        The paths of the newly staged files. A file is never yielded twice.
+    """
+    if not os.path.exists(output_directory):
+        os.makedirs(output_directory)
+
+    # Files that are unchanged since the last manifest are not staged again.
+    index = StagingIndex(output_directory)
+    stager = FileStager(output_directory, staging, n_threads=n_threads, index=index, logger=logger)
+
+    seen = set()
+    pending = {} if watch else None
+    last_found = time.monotonic()
+    with open(manifest_filepath, "w") as manifest_file:
+        while True:
+            for batch in scan_staging_directory(staging_directory, file_pattern, seen, batch_size, pending):
+                staged = stager.stage_batch(batch)
+                index.save()
+                for f in staged:
+                    manifest_file.write(f + "\n")
+                manifest_file.flush()
+                last_found = time.monotonic()
+
+                if logger is not None:
+                    logger.info(
+                        f"Discovered {len(staged)} new files, {len(seen)} in total, "
+                        f"{stager.n_unchanged} unchanged since the last manifest"
+                    )
+                yield staged
+
+            if not watch:
+                break
+            # Files that are still being written keep the watch going.
+            if len(pending) > 0:
+                last_found = time.monotonic()
+            if idle_timeout is not None and time.monotonic() - last_found >= idle_timeout:
+                if logger is not None:
+                    logger.info(f"No new files found in {staging_directory} for {idle_timeout}[s]")
+                break
+            time.sleep(poll_interval)
@@ -1,9 +1,118 @@
+import glob
+import hashlib
+import json
 import os
 import pickle
 from parsl.dataflow.memoization import id_for_memo
 from parsl import File
 
+FILE_IDENTITY_MODES = ("path", "stat", "digest")
+"""How the content of a file is identified in memoization keys:
+
+- "path", the filepath alone.
+- "stat", the filepath, size and modification time of the file and its shards.
+- "digest", the filepath and a blake2b digest of the file and its shards.
+"""
+
+DIGEST_SIDECAR_SUFFIX = ".memo_digest"
+"""Suffix of the sidecar file that caches the digest of a file."""
+
+_DIGEST_CHUNK_SIZE = 8 * 1024 * 1024
+
+_file_identity_mode = "stat"
+
+
+def set_file_identity_mode(mode):
+    """Set how files are identified in the memoization keys of the apps.
+
+    Parameters
+    ----------
+    mode : str
+        One of FILE_IDENTITY_MODES.
+    """
+    global _file_identity_mode
+    if mode not in FILE_IDENTITY_MODES:
+        raise ValueError(f"Unknown file identity mode '{mode}', must be one of {FILE_IDENTITY_MODES}")
+    _file_identity_mode = mode
+
+
+def _get_related_filepaths(filepath):
+    """Return the file, followed by any WorkUnit shards, i.e. "<i>_<filename>", written next to it."""
+    directory, filename = os.path.split(filepath)
+    # Avoid listing the directory for the common case of a file without shards.
+    if not os.path.exists(os.path.join(directory, f"0_{filename}")):
+        return [filepath]
+    shards = glob.glob(os.path.join(glob.escape(directory), f"[0-9]*_{glob.escape(filename)}"))
+    return [filepath] + sorted(shards)
+
+
+def _stat_identity(filepaths):
+    identity = []
+    for path in filepaths:
+        stat = os.stat(path)
+        identity.append((os.path.basename(path), stat.st_size, stat.st_mtime_ns))
+    return identity
+
+
+def _digest_identity(filepath, filepaths):
+    """Return the digest of the files, reusing the sidecar digest if none of them have changed."""
+    stats = _stat_identity(filepaths)
+    sidecar_filepath = filepath + DIGEST_SIDECAR_SUFFIX
+    try:
+        with open(sidecar_filepath, "r") as f:
+            sidecar = json.load(f)
+        if [tuple(s) for s in sidecar["stats"]] == stats:
+            return sidecar["digest"]
+    except (OSError, ValueError, KeyError):
+        pass
+
+    digest = hashlib.blake2b(digest_size=32)
+    for path in filepaths:
+        digest.update(os.path.basename(path).encode() + b"\0")
+        with open(path, "rb") as f:
+            while chunk := f.read(_DIGEST_CHUNK_SIZE):
+                digest.update(chunk)
+    digest = digest.hexdigest()
+
+    try:
+        with open(sidecar_filepath, "w") as f:
+            json.dump({"stats": stats, "digest": digest}, f)
+    except OSError:
+        # The sidecar is only an optimization, e.g. the directory may be read only.
+        pass
+    return digest
+
+
+def get_file_identity(filepath, mode=None):
+    """Return the identity of a file's content, as used in memoization keys.
+
+    Parameters
+    ----------
+    filepath : str
+        The file.
+    mode : str, optional
+        One of FILE_IDENTITY_MODES, by default None, the mode set with
+        `set_file_identity_mode`.
+
+    Returns
+    -------
+    object
+        The identity of the file, or None if the file does not exist.
+    """
+    mode = mode if mode is not None else _file_identity_mode
+    if mode == "path" or not os.path.exists(filepath):
+        return None
+
+    filepaths = _get_related_filepaths(filepath)
+    if mode == "stat":
+        return _stat_identity(filepaths)
+    return _digest_identity(filepath, filepaths)
+
 
 @id_for_memo.register(File)
 def id_for_memo_file(parsl_file_object: File, output_ref: bool = False) -> bytes:
-    return pickle.dumps(parsl_file_object.filepath)
+    # Outputs are identified by path alone, they will be (re)written by the task.
+    identity = None if output_ref else get_file_identity(parsl_file_object.filepath)
+    if identity is None:
+        return pickle.dumps(parsl_file_object.filepath)
+    return pickle.dumps((parsl_file_object.filepath, identity))
@@ -0,0 +1,400 @@
+import argparse
+import csv
+import glob
+import json
+import os
+import resource
+import socket
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+__all__ = [
+    "DEFAULT_MEMORY_CONFIG",
+    "TaskMemory",
+    "task_memory",
+    "record_input_size",
+    "record_work_unit",
+    "merge_memory",
+    "fit_memory",
+]
+
+
+DEFAULT_MEMORY_CONFIG = {
+    "enabled": False,
+    "tracemalloc": 0,
+}
+"""Default memory tracking configuration, overridden by the ``[memory]`` section of the runtime configuration:
+
+- enabled, record the peak memory of every task, see `task_memory`.
+- tracemalloc, the number of top allocators to record with the peak memory of
+  every task. 0 disables tracemalloc.
+"""
+
+MEMORY_DIRECTORY_NAME = "memory"
+"""Name of the directory, in the parsl run directory, that the per-worker memory records are written to."""
+
+RSS_SAMPLE_INTERVAL = 0.1
+"""Seconds between samples of the RSS, when the kernel's peak RSS can not be reset for each task."""
+
+TABLE_COLUMNS = [
+    "task",
+    "host",
+    "pid",
+    "start",
+    "seconds",
+    "failed",
+    "n_images",
+    "image_height",
+    "image_width",
+    "n_pixels",
+    "rss_before_bytes",
+    "peak_rss_bytes",
+    "children_peak_rss_bytes",
+    "output",
+]
+"""Columns of the per-run memory table, the tracemalloc results are only kept in the JSONL records."""
+
+_local = threading.local()
+
+
+def _read_status_bytes(field):
+    """Return a "<field>: <n> kB" value of /proc/self/status in bytes, or None."""
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(f"{field}:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    return None
+
+
+def _reset_peak_rss():
+    """Reset the kernel's peak RSS of this process, so that it only covers the
+    current task. Returns False where that isn't supported, i.e. not on Linux."""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        return False
+    return _read_status_bytes("VmHWM") is not None
+
+
+def _children_peak_rss_bytes():
+    # ru_maxrss is in kilobytes on Linux, and bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss
+    return peak if os.uname().sysname == "Darwin" else peak * 1024
+
+
+class _RSSSampler:
+    """Polls the RSS of this process, for platforms where its peak can't be reset."""
+
+    def __init__(self, interval):
+        self.interval = interval
+        self.peak = _read_status_bytes("VmRSS") or 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="RSS-Sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.peak = max(self.peak, _read_status_bytes("VmRSS") or 0)
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+        return max(self.peak, _read_status_bytes("VmRSS") or 0)
+
+
+class TaskMemory:
+    """The memory used by a single task, and the size of its input.
+
+    Parameters
+    ----------
+    task : str
+        The name of the task, e.g. "kbmod_search".
+    output : str, optional
+        The task's output, by default None
+    """
+
+    def __init__(self, task, output=None):
+        self.task = task
+        self.output = output
+        self.host = socket.gethostname().split(".")[0]
+        self.pid = os.getpid()
+        self.start = time.time()
+        self.seconds = None
+        self.failed = False
+        self.n_images = None
+        self.image_height = None
+        self.image_width = None
+        self.rss_before_bytes = _read_status_bytes("VmRSS")
+        self.peak_rss_bytes = None
+        self.children_peak_rss_bytes = None
+        self.traced_peak_bytes = None
+        self.top_allocators = None
+
+    @property
+    def n_pixels(self):
+        """The total number of pixels of the task's input images, or None if their size wasn't recorded."""
+        if None in (self.n_images, self.image_height, self.image_width):
+            return None
+        return self.n_images * self.image_height * self.image_width
+
+    def to_dict(self):
+        """Return the record as a dict, with the tracemalloc results if the task was traced."""
+        record = {column: getattr(self, column) for column in TABLE_COLUMNS}
+        if self.top_allocators is not None:
+            record["traced_peak_bytes"] = self.traced_peak_bytes
+            record["top_allocators"] = self.top_allocators
+        return record
+
+
+def _get_task_memory():
+    return getattr(_local, "task_memory", None)
+
+
+def record_input_size(n_images=None, image_height=None, image_width=None):
+    """Record the size of the current task's input, if its memory is being tracked.
+
+    Parameters
+    ----------
+    n_images : int, optional
+        The number of images, by default None
+    image_height : int, optional
+        The height of each image in pixels, by default None
+    image_width : int, optional
+        The width of each image in pixels, by default None
+    """
+    record = _get_task_memory()
+    if record is None:
+        return
+    if n_images is not None:
+        record.n_images = int(n_images)
+    if image_height is not None:
+        record.image_height = int(image_height)
+    if image_width is not None:
+        record.image_width = int(image_width)
+
+
+def record_work_unit(wu):
+    """Record the number of images, and their pixel dimensions, of the WorkUnit
+    that the current task is processing, see `record_input_size`."""
+    if _get_task_memory() is None:
+        return
+    shape = None
+    if len(wu) > 0:
+        wcs = wu.get_wcs(0)
+        shape = getattr(wcs, "array_shape", None) if wcs is not None else None
+    if shape is None:
+        record_input_size(n_images=len(wu))
+    else:
+        record_input_size(n_images=len(wu), image_height=shape[0], image_width=shape[1])
+
+
+@contextmanager
+def task_memory(task_name, logging_file=None, memory_config=None, logger=None, output_filepath=None):
+    """Track the peak memory of a task, and append it, with the size of the task's
+    input, to this worker's memory records in the run's memory directory.
+
+    The peak of the memory allocated by python, and the top allocators, by the
+    size of the memory they still held when the task completed, are also
+    recorded when ``tracemalloc`` is set in the ``[memory]`` section of the
+    runtime configuration. Tracing allocations slows a task down.
+    The peak RSS is that of the whole process, so tasks run concurrently by a
+    thread executor are not told apart.
+
+    Parameters
+    ----------
+    task_name : str
+        The name of the task, e.g. "kbmod_search".
+    logging_file : parsl.File | str, optional
+        The workflow's log file, the memory records are written next to it, by default None
+    memory_config : dict, optional
+        The ``[memory]`` section of the runtime configuration, see
+        DEFAULT_MEMORY_CONFIG, by default None, the task's memory isn't tracked.
+    logger : logging.Logger, optional
+        Logs the peak memory of the task, by default None
+    output_filepath : str, optional
+        The task's output, by default None
+
+    Yields
+    ------
+    TaskMemory | None
+        The record of the task, or None if its memory isn't tracked, or no log file was given.
+    """
+    memory_config = {**DEFAULT_MEMORY_CONFIG, **(memory_config or {})}
+    if logging_file is None or not memory_config["enabled"]:
+        yield None
+        return
+
+    n_top_allocators = memory_config["tracemalloc"]
+    record = TaskMemory(task_name, output=os.fspath(output_filepath) if output_filepath is not None else None)
+    children_peak_before = _children_peak_rss_bytes()
+    sampler = None if _reset_peak_rss() else _RSSSampler(RSS_SAMPLE_INTERVAL)
+    started_tracemalloc = n_top_allocators > 0 and not tracemalloc.is_tracing()
+    if started_tracemalloc:
+        tracemalloc.start()
+
+    _local.task_memory = record
+    start = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        record.failed = True
+        raise
+    finally:
+        _local.task_memory = None
+        record.seconds = time.perf_counter() - start
+        record.peak_rss_bytes = sampler.stop() if sampler is not None else _read_status_bytes("VmHWM")
+        # Only the peak of the child processes that exited during this task can be attributed to it.
+        children_peak = _children_peak_rss_bytes()
+        if children_peak > children_peak_before:
+            record.children_peak_rss_bytes = children_peak
+        if started_tracemalloc:
+            snapshot = tracemalloc.take_snapshot()
+            record.traced_peak_bytes = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            record.top_allocators = [
+                {"location": str(stat.traceback), "bytes": stat.size, "count": stat.count}
+                for stat in snapshot.statistics("lineno")[:n_top_allocators]
+            ]
+        _write_record(record, logging_file, logger)
+
+
+def _write_record(record, logging_file, logger=None):
+    memory_directory = os.path.join(os.path.dirname(os.fspath(logging_file)), MEMORY_DIRECTORY_NAME)
+    filepath = os.path.join(memory_directory, f"{record.host}.{record.pid}.jsonl")
+    # A memory record is never worth failing the task over.
+    try:
+        os.makedirs(memory_directory, exist_ok=True)
+        with open(filepath, "a") as f:
+            f.write(json.dumps(record.to_dict(), separators=(",", ":"), default=str) + "\n")
+    except OSError as e:
+        if logger is not None:
+            logger.warning(f"Failed to write the memory record of {record.task}: {e}")
+        return
+    if logger is not None and record.peak_rss_bytes is not None:
+        logger.info(
+            f"Peak memory of {record.task} was {round(record.peak_rss_bytes / 1024**3, 2)}[GB] "
+            f"for {record.n_images} images of {record.image_height}x{record.image_width} pixels."
+        )
+
+
+def merge_memory(memory_directory, output_filepath=None):
+    """Merge the per-worker memory records of a run into a single CSV table.
+
+    Parameters
+    ----------
+    memory_directory : str
+        The run's memory directory, e.g. "<run_dir>/memory".
+    output_filepath : str, optional
+        The table, by default None, "memory.csv" in ``memory_directory``.
+
+    Returns
+    -------
+    tuple[str, list[dict]]
+        The table, and its rows in order of the start of each task.
+    """
+    output_filepath = (
+        output_filepath if output_filepath is not None else os.path.join(memory_directory, "memory.csv")
+    )
+
+    rows = []
+    for filepath in sorted(glob.glob(os.path.join(glob.escape(memory_directory), "*.jsonl"))):
+        with open(filepath, "r") as f:
+            rows.extend(json.loads(line) for line in f if line.strip())
+    rows.sort(key=lambda row: row["start"])
+
+    with open(output_filepath, "w", newline="") as f:
+        writer = csv.DictWriter(f, fieldnames=TABLE_COLUMNS, extrasaction="ignore")
+        writer.writeheader()
+        writer.writerows(rows)
+
+    return output_filepath, rows
+
+
+def fit_memory(rows):
+    """Fit the peak memory of each task as linear in the number of pixels of its input.
+
+    Parameters
+    ----------
+    rows : list[dict]
+        The rows of the memory table, see `merge_memory`.
+
+    Returns
+    -------
+    dict
+        For each task name, the ``n_tasks``, the ``baseline_bytes`` and
+        ``bytes_per_pixel`` of the fit, the largest ``max_residual_bytes`` above
+        the fit, and the largest ``max_peak_rss_bytes`` and ``max_n_pixels`` seen.
+        The fit is None for a task without at least two distinct input sizes.
+    """
+    import numpy as np
+
+    by_task = {}
+    for row in rows:
+        peak = row.get("peak_rss_bytes")
+        if row.get("failed") or peak is None:
+            continue
+        # Memory used by worker processes of the task, e.g. the reprojection's pool.
+        peak = max(int(peak), int(row.get("children_peak_rss_bytes") or 0))
+        by_task.setdefault(row["task"], []).append((row.get("n_pixels"), peak))
+
+    fits = {}
+    for task, points in by_task.items():
+        peaks = np.array([peak for _, peak in points], dtype=float)
+        sized = np.array([(n, peak) for n, peak in points if n is not None], dtype=float).reshape(-1, 2)
+        fit = {
+            "n_tasks": len(points),
+            "baseline_bytes": None,
+            "bytes_per_pixel": None,
+            "max_residual_bytes": None,
+            "max_peak_rss_bytes": int(peaks.max()),
+            "max_n_pixels": int(sized[:, 0].max()) if len(sized) > 0 else None,
+        }
+        if len(np.unique(sized[:, 0])) >= 2:
+            bytes_per_pixel, baseline = np.polyfit(sized[:, 0], sized[:, 1], 1)
+            residuals = sized[:, 1] - (baseline + bytes_per_pixel * sized[:, 0])
+            fit.update(
+                baseline_bytes=float(baseline),
+                bytes_per_pixel=float(bytes_per_pixel),
+                max_residual_bytes=float(max(residuals.max(), 0.0)),
+            )
+        fits[task] = fit
+    return fits
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Merge the per-task memory records of a run into a table, and fit them."
+    )
+    parser.add_argument(
+        "memory_directory", type=str, help="The run's memory directory, e.g. <run_dir>/memory"
+    )
+    parser.add_argument("--output", type=str, help="The table, by default <memory_directory>/memory.csv")
+    parser.add_argument(
+        "--n-pixels", type=float, help="Predict the memory of each task for an input of this many pixels."
+    )
+    args = parser.parse_args()
+
+    output_filepath, rows = merge_memory(args.memory_directory, args.output)
+    print(f"Wrote {len(rows)} tasks to {output_filepath}")
+
+    gb = 1024**3
+    for task, fit in sorted(fit_memory(rows).items()):
+        line = f"{task}: {fit['n_tasks']} tasks, max peak {fit['max_peak_rss_bytes'] / gb:.2f} GB"
+        if fit["bytes_per_pixel"] is not None:
+            line += f", {fit['baseline_bytes'] / gb:.2f} GB + {fit['bytes_per_pixel']:.1f} bytes/pixel"
+            if args.n_pixels is not None:
+                predicted = fit["baseline_bytes"] + fit["bytes_per_pixel"] * args.n_pixels
+                line += (
+                    f", {(predicted + fit['max_residual_bytes']) / gb:.2f} GB for {args.n_pixels:.3g} pixels"
+                )
+        print(line)
+
+
+if __name__ == "__main__":
+    main()
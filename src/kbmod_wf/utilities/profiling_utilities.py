@@ -0,0 +1,186 @@
+import cProfile
+import os
+import sys
+import threading
+import time
+import zlib
+from collections import Counter
+from contextlib import contextmanager
+
+__all__ = ["DEFAULT_PROFILE_CONFIG", "StackSampler", "get_profile_config", "is_profiled", "task_profile"]
+
+
+DEFAULT_PROFILE_CONFIG = {
+    "every": 1,
+    "deterministic": True,
+    "interval": 0.005,
+}
+"""Default profiling configuration, overridden by ``profile`` in the ``[apps.<name>]``
+section of the runtime configuration:
+
+- every, profile 1 in ``every`` tasks of the stage.
+- deterministic, also profile every function call with cProfile, and write a
+  ``.pstats`` file. The collapsed stacks are always written.
+- interval, seconds between samples of the task's stack.
+"""
+
+
+def get_profile_config(profile):
+    """Return the profiling configuration of a stage, or None if it is not profiled.
+
+    Parameters
+    ----------
+    profile : bool | int | dict | None
+        The ``profile`` option of the stage. True profiles every task, an integer
+        N profiles 1 in N tasks, and a table overrides DEFAULT_PROFILE_CONFIG.
+
+    Returns
+    -------
+    dict | None
+        The profiling configuration.
+    """
+    if profile is None or profile is False:
+        return None
+    if profile is True:
+        return dict(DEFAULT_PROFILE_CONFIG)
+    if isinstance(profile, int):
+        return {**DEFAULT_PROFILE_CONFIG, "every": profile}
+    if isinstance(profile, dict):
+        return {**DEFAULT_PROFILE_CONFIG, **profile}
+    raise ValueError(f"Invalid profile option {profile!r}, expected a bool, an integer or a table.")
+
+
+def is_profiled(key, every):
+    """Return True for 1 in ``every`` keys. The choice depends only on the key, so
+    the same tasks are profiled by every worker, and again when a run is resumed."""
+    if every <= 1:
+        return True
+    return zlib.crc32(os.fspath(key).encode()) % every == 0
+
+
+def _frame_name(frame):
+    code = frame.f_code
+    return f"{getattr(code, 'co_qualname', code.co_name)} ({os.path.basename(code.co_filename)})"
+
+
+class StackSampler:
+    """Samples the stack of a thread at a fixed interval, and counts each
+    distinct stack, i.e. the collapsed stacks read by flame graph tools.
+
+    Parameters
+    ----------
+    thread_id : int
+        The `threading.get_ident` of the thread to sample.
+    interval : float
+        Seconds between samples.
+    root : str, optional
+        A frame prepended to every stack, e.g. the task name, by default None
+    """
+
+    def __init__(self, thread_id, interval, root=None):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.root = root
+        self.counts = Counter()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        """Start sampling in a background thread."""
+        self._thread = threading.Thread(target=self._run, name="Profile-Sampler", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stop sampling, and wait for the background thread to exit."""
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                stack.append(_frame_name(frame))
+                frame = frame.f_back
+            if self.root is not None:
+                stack.append(self.root)
+            if stack:
+                self.counts[";".join(reversed(stack))] += 1
+
+    def write(self, filepath):
+        """Write the collapsed stacks, one "frame;frame;... count" line per distinct stack."""
+        with open(filepath, "w") as f:
+            for stack, count in sorted(self.counts.items()):
+                f.write(f"{stack} {count}\n")
+
+
+@contextmanager
+def task_profile(task_name, output_filepath, profile_config=None, logger=None):
+    """Profile a task, writing "<output>.pstats" and "<output>.collapsed" next to
+    its output when ``profile`` is set in the ``[apps.<name>]`` section of the
+    runtime configuration.
+
+    Only the task's own thread is profiled, work done in other processes, e.g.
+    the reprojection's worker pool, shows up as time spent waiting on them.
+
+    Parameters
+    ----------
+    task_name : str
+        The name of the task, e.g. "kbmod_search".
+    output_filepath : str
+        The task's output, which also decides whether the task is one of the 1
+        in ``every`` that are profiled.
+    profile_config : bool | int | dict, optional
+        The ``profile`` option of the stage, see `get_profile_config`, by default None
+    logger : logging.Logger, optional
+        Logs where the profile was written, by default None
+
+    Yields
+    ------
+    cProfile.Profile | StackSampler | None
+        The profiler, or None if the task is not being profiled.
+    """
+    config = get_profile_config(profile_config)
+    if config is None or output_filepath is None or not is_profiled(output_filepath, config["every"]):
+        yield None
+        return
+
+    output_filepath = os.fspath(output_filepath)
+    sampler = StackSampler(threading.get_ident(), config["interval"], root=task_name)
+    profiler = cProfile.Profile() if config["deterministic"] else None
+
+    start = time.perf_counter()
+    sampler.start()
+    try:
+        if profiler is not None:
+            try:
+                profiler.enable()
+            except ValueError as e:
+                # From Python 3.12 only one cProfile can be active in a process, e.g. another
+                # task's on the same thread pool, so only the stack is sampled.
+                if logger is not None:
+                    logger.warning(f"Only sampling the stack of {task_name}: {e}")
+                profiler = None
+        yield profiler if profiler is not None else sampler
+    finally:
+        if profiler is not None:
+            profiler.disable()
+        sampler.stop()
+
+        # A profile is never worth failing the task over.
+        try:
+            os.makedirs(os.path.dirname(os.path.abspath(output_filepath)), exist_ok=True)
+            sampler.write(f"{output_filepath}.collapsed")
+            if profiler is not None:
+                profiler.dump_stats(f"{output_filepath}.pstats")
+        except OSError as e:
+            if logger is not None:
+                logger.warning(f"Failed to write the profile of {task_name}: {e}")
+        else:
+            if logger is not None:
+                logger.info(
+                    f"Profiled {task_name} for {round(time.perf_counter() - start, 1)}[s], "
+                    f"{sum(sampler.counts.values())} samples written to {output_filepath}.collapsed"
+                )
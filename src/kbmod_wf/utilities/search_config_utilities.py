@@ -0,0 +1,37 @@
+import copy
+import os
+import threading
+
+__all__ = ["load_search_config"]
+
+
+_lock = threading.Lock()
+_search_configs = {}
+
+
+def load_search_config(search_config_filepath):
+    """Load a KBMOD SearchConfiguration, parsing each file only once per worker.
+
+    Parsed configurations are memoized by their path and modification time, so
+    that a configuration file that is edited between tasks is read again.
+
+    Parameters
+    ----------
+    search_config_filepath : str
+        The path to the search configuration YAML file.
+
+    Returns
+    -------
+    kbmod.configuration.SearchConfiguration
+        A copy of the parsed configuration, that may be modified by the caller.
+    """
+    from kbmod.configuration import SearchConfiguration
+
+    key = (os.path.abspath(search_config_filepath), os.stat(search_config_filepath).st_mtime_ns)
+    with _lock:
+        config = _search_configs.get(key)
+        if config is None:
+            config = SearchConfiguration.from_file(search_config_filepath)
+            _search_configs[key] = config
+
+    return copy.deepcopy(config)
@@ -0,0 +1,87 @@
+import functools
+import json
+
+__all__ = ["get_observation_site", "KNOWN_SITES"]
+
+
+KNOWN_SITES = {
+    "ctio": {"latitude": -30.16527778, "longitude": -70.815, "height": 2215.0},
+    "lsst": {"latitude": -30.244639, "longitude": -70.749417, "height": 2663.0},
+}
+"""Geodetic coordinates (degrees, and meters above the ellipsoid) of the
+observatory sites, matching astropy's site registry. These are bundled so that
+resolving a site never requires network access."""
+
+SITE_ALIASES = {
+    "cerro tololo": "ctio",
+    "cerro tololo interamerican observatory": "ctio",
+    "rubin": "lsst",
+    "rubin observatory": "lsst",
+    "vera c. rubin observatory": "lsst",
+    "cerro pachon": "lsst",
+}
+"""Alternative names for the known sites."""
+
+
+@functools.cache
+def _read_site_registry(registry_filepath):
+    with open(registry_filepath, "r") as f:
+        registry = json.load(f)
+
+    sites = {}
+    for name, site in registry.items():
+        sites[name.lower()] = {
+            "latitude": site["latitude"],
+            "longitude": site["longitude"],
+            "height": site.get("elevation", site.get("height", 0.0)),
+        }
+        for alias in site.get("aliases", []):
+            sites[alias.lower()] = sites[name.lower()]
+    return sites
+
+
+@functools.cache
+def get_observation_site(site="ctio", registry_filepath=None):
+    """Resolve the location of an observatory site without any network access.
+
+    Parameters
+    ----------
+    site : str, optional
+        The name of the site, case insensitive, by default "ctio"
+    registry_filepath : str, optional
+        A JSON file of additional sites, in the format of astropy's site registry
+        (``sites.json``), which takes precedence over the bundled sites, by
+        default None
+
+    Returns
+    -------
+    astropy.coordinates.EarthLocation
+        The location of the site.
+
+    Raises
+    ------
+    KeyError
+        If the site is not known.
+    """
+    from astropy import units as u
+    from astropy.coordinates import EarthLocation
+
+    name = site.lower()
+    sites = {**KNOWN_SITES, **SITE_ALIASES}
+    if registry_filepath is not None:
+        sites.update(_read_site_registry(registry_filepath))
+
+    coordinates = sites.get(name)
+    if isinstance(coordinates, str):
+        coordinates = KNOWN_SITES[coordinates]
+    if coordinates is None:
+        raise KeyError(
+            f"Unknown observation site '{site}'. Known sites are {sorted(sites)}, "
+            "others can be added with a site registry file."
+        )
+
+    return EarthLocation.from_geodetic(
+        lon=coordinates["longitude"] * u.deg,
+        lat=coordinates["latitude"] * u.deg,
+        height=coordinates["height"] * u.m,
+    )
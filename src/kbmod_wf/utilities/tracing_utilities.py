@@ -0,0 +1,259 @@
+import argparse
+import contextlib
+import glob
+import json
+import os
+import socket
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+__all__ = ["Tracer", "Span", "trace_span", "task_trace", "merge_traces", "get_sharded_bytes"]
+
+
+TRACE_DIRECTORY_NAME = "traces"
+"""Name of the directory, in the parsl run directory, that the per-task spans are written to."""
+
+_local = threading.local()
+
+
+class Span:
+    """A named, timed, sub-step of a task, with attributes such as the number of
+    images, pixels or bytes that it processed.
+
+    Parameters
+    ----------
+    name : str
+        The name of the sub-step, e.g. "wu.write_shards".
+    attributes : dict
+        The attributes of the span.
+    recording : bool
+        Whether the span will be written to a trace. Attributes that are costly
+        to compute only need to be set when it is.
+    """
+
+    def __init__(self, name, attributes, recording):
+        self.name = name
+        self.attributes = attributes
+        self.recording = recording
+        self.start_ns = time.time_ns()
+        self.duration_ns = None
+
+    def set(self, **attributes):
+        """Add attributes to the span."""
+        self.attributes.update(attributes)
+
+    @property
+    def seconds(self):
+        """The duration of the span in seconds, or None if it hasn't ended."""
+        return self.duration_ns / 1e9 if self.duration_ns is not None else None
+
+
+class Tracer:
+    """Collects the spans of a single task, and writes them as compact JSONL.
+
+    Parameters
+    ----------
+    filepath : str
+        The JSONL file that the spans are written to.
+    task : str, optional
+        The name of the task, by default None
+    """
+
+    def __init__(self, filepath, task=None):
+        self.filepath = filepath
+        self.task = task
+        self.host = socket.gethostname().split(".")[0]
+        self.pid = os.getpid()
+        self._spans = []
+        self._lock = threading.Lock()
+
+    def record(self, span):
+        """Add a span that has ended to the trace."""
+        event = {
+            "name": span.name,
+            "ts": span.start_ns // 1000,
+            "dur": span.duration_ns // 1000,
+            "host": self.host,
+            "pid": self.pid,
+            "tid": threading.get_native_id(),
+        }
+        if self.task is not None:
+            event["task"] = self.task
+        if span.attributes:
+            event["attrs"] = span.attributes
+        with self._lock:
+            self._spans.append(event)
+
+    def flush(self):
+        """Append the recorded spans to the JSONL file."""
+        with self._lock:
+            spans, self._spans = self._spans, []
+        if len(spans) == 0:
+            return
+        os.makedirs(os.path.dirname(self.filepath), exist_ok=True)
+        with open(self.filepath, "a") as f:
+            f.writelines(json.dumps(s, separators=(",", ":"), default=str) + "\n" for s in spans)
+
+
+def _get_tracer():
+    stack = getattr(_local, "tracers", None)
+    return stack[-1] if stack else None
+
+
+@contextmanager
+def trace_span(name, logger=None, **attributes):
+    """Time a sub-step of a task, recording it in the task's trace if it is being traced.
+
+    Parameters
+    ----------
+    name : str
+        The name of the sub-step, e.g. "wu.write_shards".
+    logger : logging.Logger, optional
+        Logs the time taken at debug level, by default None
+    **attributes
+        Attributes of the span, e.g. ``n_images=len(wu)``. More can be added with
+        `Span.set` before the span ends.
+
+    Yields
+    ------
+    Span
+        The span.
+    """
+    tracer = _get_tracer()
+    span = Span(name, attributes, recording=tracer is not None)
+    start = time.perf_counter_ns()
+    try:
+        yield span
+    except BaseException as e:
+        span.set(error=type(e).__name__)
+        raise
+    finally:
+        span.duration_ns = time.perf_counter_ns() - start
+        if tracer is not None:
+            tracer.record(span)
+        if logger is not None:
+            logger.debug(f"Required {round(span.seconds, 1)}[s] for {name}.")
+
+
+@contextmanager
+def task_trace(task_name, logging_file=None, logging_config=None):
+    """Trace a task, writing its spans to a JSONL file in the run's trace directory
+    when ``trace = true`` is set in the ``[logging]`` section of the runtime configuration.
+
+    Parameters
+    ----------
+    task_name : str
+        The name of the task, e.g. "kbmod_search".
+    logging_file : parsl.File | str, optional
+        The workflow's log file, the traces are written next to it, by default None
+    logging_config : dict, optional
+        The ``[logging]`` section of the runtime configuration, by default None
+
+    Yields
+    ------
+    Tracer | None
+        The tracer, or None if the task is not being traced.
+    """
+    if logging_file is None or not (logging_config or {}).get("trace", False):
+        yield None
+        return
+
+    trace_directory = os.path.join(os.path.dirname(os.fspath(logging_file)), TRACE_DIRECTORY_NAME)
+    tracer = Tracer(os.path.join(trace_directory, f"{task_name}.{uuid.uuid4().hex}.jsonl"), task=task_name)
+
+    if not hasattr(_local, "tracers"):
+        _local.tracers = []
+    _local.tracers.append(tracer)
+    try:
+        with trace_span(task_name):
+            yield tracer
+    finally:
+        _local.tracers.pop()
+        # A trace is never worth failing the task over.
+        with contextlib.suppress(OSError):
+            tracer.flush()
+
+
+def get_sharded_bytes(filepath):
+    """Return the size in bytes of a file and any WorkUnit shards, i.e. "<i>_<filename>", next to it."""
+    directory, filename = os.path.split(filepath)
+    total = os.path.getsize(filepath) if os.path.exists(filepath) else 0
+    for shard in glob.glob(os.path.join(glob.escape(directory), f"[0-9]*_{glob.escape(filename)}")):
+        total += os.path.getsize(shard)
+    return total
+
+
+def merge_traces(trace_directory, output_filepath=None):
+    """Merge the per-task spans of a run into a Chrome trace, that can be opened
+    with chrome://tracing or https://ui.perfetto.dev.
+
+    Parameters
+    ----------
+    trace_directory : str
+        The run's trace directory, e.g. "<run_dir>/traces".
+    output_filepath : str, optional
+        The trace file, by default None, "trace.json" in ``trace_directory``.
+
+    Returns
+    -------
+    tuple[str, int]
+        The trace file, and the number of spans in it.
+    """
+    output_filepath = (
+        output_filepath if output_filepath is not None else os.path.join(trace_directory, "trace.json")
+    )
+
+    # Chrome traces identify processes by integer, so each (host, pid) is given its own.
+    process_ids = {}
+    events = []
+    for filepath in sorted(glob.glob(os.path.join(glob.escape(trace_directory), "*.jsonl"))):
+        with open(filepath, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                span = json.loads(line)
+                process = (span["host"], span["pid"])
+                if process not in process_ids:
+                    process_ids[process] = len(process_ids) + 1
+                args = dict(span.get("attrs", {}))
+                if "task" in span:
+                    args["task"] = span["task"]
+                events.append(
+                    {
+                        "name": span["name"],
+                        "cat": span.get("task", "task"),
+                        "ph": "X",
+                        "ts": span["ts"],
+                        "dur": span["dur"],
+                        "pid": process_ids[process],
+                        "tid": span["tid"],
+                        "args": args,
+                    }
+                )
+
+    n_spans = len(events)
+    for (host, pid), process_id in process_ids.items():
+        events.append(
+            {"name": "process_name", "ph": "M", "pid": process_id, "args": {"name": f"{host}:{pid}"}}
+        )
+
+    with open(output_filepath, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f, separators=(",", ":"))
+
+    return output_filepath, n_spans
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Merge the per-task spans of a run into a Chrome trace.")
+    parser.add_argument("trace_directory", type=str, help="The run's trace directory, e.g. <run_dir>/traces")
+    parser.add_argument("--output", type=str, help="The trace file, by default <trace_directory>/trace.json")
+    args = parser.parse_args()
+
+    output_filepath, n_spans = merge_traces(args.trace_directory, args.output)
+    print(f"Wrote {n_spans} spans to {output_filepath}")
+
+
+if __name__ == "__main__":
+    main()
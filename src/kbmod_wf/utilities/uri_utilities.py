@@ -0,0 +1,129 @@
+import glob
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+__all__ = ["DirectoryIndex", "clean_uri", "resolve_uris"]
+
+
+DEFAULT_N_THREADS = 16
+"""Default number of threads that list directories, enough to hide the latency of
+a parallel filesystem's metadata servers without flooding them."""
+
+FILE_PREFIX = "file://"
+
+
+class DirectoryIndex:
+    """The names in each directory, listed once with `os.scandir`, so that checking
+    that thousands of files exist costs one listing per directory rather than a
+    metadata round-trip per file.
+
+    The listings are not refreshed, an index should only live as long as the set
+    of files it is checking.
+    """
+
+    def __init__(self):
+        self._listings = {}
+        self._lock = threading.Lock()
+
+    def listing(self, directory):
+        """Return the names in a directory, an empty set if it doesn't exist, or
+        None if it can't be listed, e.g. a directory that is only searchable."""
+        directory = directory or os.curdir
+        with self._lock:
+            if directory in self._listings:
+                return self._listings[directory]
+
+        try:
+            with os.scandir(directory) as entries:
+                names = frozenset(entry.name for entry in entries)
+        except (FileNotFoundError, NotADirectoryError):
+            names = frozenset()
+        except PermissionError:
+            names = None
+
+        with self._lock:
+            self._listings[directory] = names
+        return names
+
+    def exists(self, filepath):
+        """Return True if the file exists, including broken symbolic links, like `glob.glob`."""
+        directory, name = os.path.split(filepath)
+        names = self.listing(directory)
+        if names is None:
+            return os.path.lexists(filepath)
+        return name in names
+
+    def __len__(self):
+        return len(self._listings)
+
+
+def clean_uri(uri, uris_base_dir=None):
+    """Turn a URI from a URI list into a filepath.
+
+    Parameters
+    ----------
+    uri : str
+        The URI, e.g. "file:///path/to/image%23step6.fits".
+    uris_base_dir : str, optional
+        A directory the URI is relative to, by default None
+
+    Returns
+    -------
+    str
+        The filepath.
+    """
+    # clean up character encoding
+    filepath = uri.replace("%23", "#").strip()
+
+    # strip off the file:// prefix if it exists
+    if filepath.startswith(FILE_PREFIX):
+        filepath = filepath[len(FILE_PREFIX) :]
+
+    # if a base directory is provided, prepend it to the URI
+    if uris_base_dir is not None:
+        filepath = os.path.join(uris_base_dir, filepath.lstrip(os.path.sep))
+    return filepath
+
+
+def resolve_uris(uris, uris_base_dir=None, n_threads=DEFAULT_N_THREADS, index=None):
+    """Turn URIs into filepaths, and check that each of them exists.
+
+    Every parent directory is listed once, by a pool of threads, instead of
+    globbing each file in turn. Filepaths that contain glob wildcards are
+    still globbed.
+
+    Parameters
+    ----------
+    uris : list[str]
+        The URIs.
+    uris_base_dir : str, optional
+        A directory the URIs are relative to, by default None
+    n_threads : int, optional
+        The number of threads listing directories, by default DEFAULT_N_THREADS
+    index : DirectoryIndex, optional
+        The listings to use and add to, by default None, a new index.
+
+    Returns
+    -------
+    tuple[list[str], list[str]]
+        The filepath of every URI, in order, and the filepaths that don't exist.
+    """
+    index = index if index is not None else DirectoryIndex()
+    filepaths = [clean_uri(uri, uris_base_dir) for uri in uris]
+
+    globbed = [filepath for filepath in filepaths if glob.has_magic(filepath)]
+    directories = {os.path.dirname(filepath) for filepath in filepaths if not glob.has_magic(filepath)}
+
+    n_threads = max(1, min(int(n_threads), len(directories) + len(globbed)))
+    with ThreadPoolExecutor(max_workers=n_threads, thread_name_prefix="resolve-uris") as pool:
+        # Listing fills the index, the results themselves aren't needed.
+        list(pool.map(index.listing, directories))
+        globbed = dict(zip(globbed, pool.map(glob.glob, globbed), strict=True))
+
+    missing = []
+    for filepath in filepaths:
+        found = len(globbed[filepath]) > 0 if filepath in globbed else index.exists(filepath)
+        if not found:
+            missing.append(filepath)
+    return filepaths, missing
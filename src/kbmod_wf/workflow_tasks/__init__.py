@@ -1,5 +1,21 @@
+# Registers how parsl Files are memoized, which the apps' outputs and inputs
+# need, before any app is called.
+from kbmod_wf.utilities import memoization_utilities  # noqa: F401
+
 from .create_manifest import create_manifest
+from .fused_stages import fused_stages
 from .ic_to_wu import ic_to_wu
 from .kbmod_search import kbmod_search
-from .reproject_wu import reproject_wu
+from .reproject_wu import reproject_multi_night_wu, reproject_single_chip_wu, reproject_wu
 from .uri_to_ic import uri_to_ic
+
+__all__ = [
+    "create_manifest",
+    "fused_stages",
+    "ic_to_wu",
+    "kbmod_search",
+    "reproject_multi_night_wu",
+    "reproject_single_chip_wu",
+    "reproject_wu",
+    "uri_to_ic",
+]
@@ -5,11 +5,12 @@ from kbmod_wf.utilities.executor_utilities import get_executors
 @python_app(
     cache=True,
     executors=get_executors(["local_dev_testing", "local_thread"]),
-    ignore_for_cache=["logging_file"],
+    ignore_for_cache=["logging_file", "logging_config"],
 )
-def create_manifest(inputs=(), outputs=(), runtime_config={}, logging_file=None):
+def create_manifest(inputs=(), outputs=(), runtime_config={}, logging_file=None, logging_config=None):
     """This app will go to a given directory, find all of the *.collection files there,
-    and copy the paths to a manifest file.
+    stage them into the output directory, and write their paths to a manifest file.
+    Files that are unchanged since the last manifest are not staged again.
 
     Parameters
     ----------
@@ -22,6 +23,8 @@ def create_manifest(inputs=(), outputs=(), runtime_config={}, logging_file=None)
         A dictionary of configuration setting specific to this task, by default {}
     logging_file : parsl.File, optional
         The parsl.File object the defines where the logs are written, by default None
+    logging_config : dict, optional
+        The ``[logging]`` section of the runtime configuration, by default None
 
     Returns
     -------
@@ -33,13 +36,18 @@ def create_manifest(inputs=(), outputs=(), runtime_config={}, logging_file=None)
     ValueError
         If the staging_directory is not provided in the runtime_config.
     """
-    import glob
     import os
-    import shutil
 
     from kbmod_wf.utilities.logger_utilities import get_configured_logger
+    from kbmod_wf.utilities.manifest_utilities import (
+        DEFAULT_STAGING,
+        DEFAULT_STAGING_THREADS,
+        FileStager,
+        StagingIndex,
+        scan_staging_directory,
+    )
 
-    logger = get_configured_logger("task.create_manifest", logging_file.filepath)
+    logger = get_configured_logger("task.create_manifest", logging_file.filepath, logging_config)
 
     directory_path = runtime_config.get("staging_directory")
     output_path = runtime_config.get("output_directory")
@@ -60,19 +68,26 @@ def create_manifest(inputs=(), outputs=(), runtime_config={}, logging_file=None)
 
     logger.info(f"Looking for staged files in {directory_path}")
 
-    # Gather all the *.collection entries in the directory
+    # Gather all the *.collection files in the directory.
+    # Stage files into the output directory, and adds them to the list of files
     file_pattern = runtime_config.get("file_pattern", "*.collection")
-    pattern = os.path.join(directory_path, file_pattern)
-    entries = glob.glob(pattern)
-
-    # Filter out directories, keep only files
-    # Copy files to the output directory, and adds them to the list of files
+    index = StagingIndex(output_path)
+    stager = FileStager(
+        output_path,
+        runtime_config.get("staging", DEFAULT_STAGING),
+        n_threads=runtime_config.get("staging_threads", DEFAULT_STAGING_THREADS),
+        index=index,
+        logger=logger,
+    )
     files = []
-    for f in entries:
-        if os.path.isfile(os.path.join(directory_path, f)):
-            files.append(shutil.copy2(f, output_path))
-
-    logger.info(f"Found {len(files)} files in {directory_path}")
+    for batch in scan_staging_directory(directory_path, file_pattern):
+        files.extend(stager.stage_batch(batch))
+    index.save()
+
+    logger.info(
+        f"Found {len(files)} files in {directory_path}, staged {stager.n_staged}, "
+        f"{stager.n_unchanged} unchanged since the last manifest"
+    )
 
     # Write the filenames to the manifest file
     logger.info(f"Writing manifest file: {outputs[0].filepath}")
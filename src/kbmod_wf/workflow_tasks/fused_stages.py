@@ -0,0 +1,92 @@
+from parsl import python_app
+
+from kbmod_wf.utilities.executor_utilities import get_executors
+
+FUSABLE_APPS = (
+    "ic_to_wu",
+    "reproject_wu",
+    "reproject_single_chip_wu",
+    "reproject_multi_night_wu",
+    "kbmod_search",
+)
+"""The apps whose stages can be fused with the adjacent stages into a single task."""
+
+
+@python_app(
+    cache=True,
+    executors=get_executors(["local_dev_testing", "large_mem", "sharded_reproject", "gpu"]),
+    ignore_for_cache=[
+        "logging_file",
+        "logging_config",
+        "profile_config",
+        "memory_config",
+        "parsl_resource_specification",
+    ],
+)
+def fused_stages(
+    inputs=(),
+    outputs=(),
+    runtime_config=None,
+    logging_file=None,
+    logging_config=None,
+    profile_config=None,
+    memory_config=None,
+    parsl_resource_specification=None,
+):
+    """This app will run adjacent workflow stages in a single task, passing the
+    WorkUnit between them in memory. The workflow Pipeline submits this app
+    for stages declared with ``fuse = true``, and binds it to the executors of
+    the last of the fused stages.
+
+    Parameters
+    ----------
+    inputs : tuple, optional
+        The inputs of the first of the fused stages, by default ()
+    outputs : tuple, optional
+        A tuple with a parsl.File object that references the output of the last
+        of the fused stages, followed by the outputs of any intermediate stage
+        that is kept, by default ()
+    runtime_config : dict, optional
+        A dictionary with the ``steps`` to run, see
+        `kbmod_wf.task_impls.fused_stages.run_fused_stages`, by default None
+    logging_file : parsl.File, optional
+        The parsl.File object the defines where the logs are written, by default None
+    logging_config : dict, optional
+        The ``[logging]`` section of the runtime configuration, by default None
+    profile_config : list, optional
+        The ``profile`` option of each of the fused stages, see
+        `kbmod_wf.utilities.profiling_utilities`, by default None
+    memory_config : dict, optional
+        The ``[memory]`` section of the runtime configuration, see
+        `kbmod_wf.utilities.memory_utilities`, by default None
+    parsl_resource_specification : dict, optional
+        Passed through to the executor, e.g. to set the task priority, by default None
+
+    Returns
+    -------
+    parsl.File
+        The file object that points to the output of the last of the fused stages.
+    """
+    from kbmod_wf.utilities.logger_utilities import ErrorLogger, get_configured_logger
+    from kbmod_wf.utilities.memory_utilities import task_memory
+    from kbmod_wf.utilities.tracing_utilities import task_trace
+
+    logger = get_configured_logger("task.fused_stages", logging_file, logging_config)
+
+    from parsl import File
+
+    from kbmod_wf.task_impls.fused_stages import run_fused_stages
+
+    steps = (runtime_config or {}).get("steps", [])
+    logger.info(f"Starting fused stages {[step['app'] for step in steps]}")
+    memory = task_memory("fused_stages", logging_file, memory_config, logger, outputs[0].filepath)
+    with ErrorLogger(logger), memory, task_trace("fused_stages", logging_file, logging_config):
+        run_fused_stages(
+            inputs=[i.filepath if isinstance(i, File) else i for i in inputs],
+            steps=steps,
+            profiles=profile_config,
+            logger=logger,
+        )
+    logger.info("Completed fused stages")
+
+    return outputs[0]
@@ -3,9 +3,26 @@ from kbmod_wf.utilities.executor_utilities import get_executors
 
 
 @python_app(
-    cache=True, executors=get_executors(["local_dev_testing", "gpu"]), ignore_for_cache=["logging_file"]
+    cache=True,
+    executors=get_executors(["local_dev_testing", "gpu"]),
+    ignore_for_cache=[
+        "logging_file",
+        "logging_config",
+        "profile_config",
+        "memory_config",
+        "parsl_resource_specification",
+    ],
 )
-def kbmod_search(inputs=(), outputs=(), runtime_config={}, logging_file=None):
+def kbmod_search(
+    inputs=(),
+    outputs=(),
+    runtime_config={},
+    logging_file=None,
+    logging_config=None,
+    profile_config=None,
+    memory_config=None,
+    parsl_resource_specification=None,
+):
     """This app will call the kbmod_search function for a given WorkUnit file.
 
     Parameters
@@ -20,6 +37,16 @@ def kbmod_search(inputs=(), outputs=(), runtime_config={}, logging_file=None):
         A dictionary of configuration setting specific to this task, by default {}
     logging_file : parsl.File, optional
         The parsl.File object the defines where the logs are written, by default None
+    logging_config : dict, optional
+        The ``[logging]`` section of the runtime configuration, by default None
+    profile_config : bool | int | dict, optional
+        The ``profile`` option of the ``[apps.<name>]`` section of the runtime
+        configuration, see `kbmod_wf.utilities.profiling_utilities`, by default None
+    memory_config : dict, optional
+        The ``[memory]`` section of the runtime configuration, see
+        `kbmod_wf.utilities.memory_utilities`, by default None
+    parsl_resource_specification : dict, optional
+        Passed through to the executor, e.g. to set the task priority, by default None
 
     Returns
     -------
@@ -27,13 +54,18 @@ def kbmod_search(inputs=(), outputs=(), runtime_config={}, logging_file=None):
         The file object that points to the search results file that was created.
     """
     from kbmod_wf.utilities.logger_utilities import get_configured_logger, ErrorLogger
+    from kbmod_wf.utilities.tracing_utilities import task_trace
+    from kbmod_wf.utilities.memory_utilities import task_memory
+    from kbmod_wf.utilities.profiling_utilities import task_profile
 
-    logger = get_configured_logger("task.kbmod_search", logging_file)
+    logger = get_configured_logger("task.kbmod_search", logging_file, logging_config)
 
     from kbmod_wf.task_impls.kbmod_search import kbmod_search
 
     logger.info("Starting kbmod_search")
-    with ErrorLogger(logger):
+    profile = task_profile("kbmod_search", outputs[0].filepath, profile_config, logger)
+    memory = task_memory("kbmod_search", logging_file, memory_config, logger, outputs[0].filepath)
+    with ErrorLogger(logger), memory, task_trace("kbmod_search", logging_file, logging_config), profile:
         kbmod_search(
             wu_filepath=inputs[0].filepath,
             result_filepath=inputs[0].filepath + ".search.parquet",
@@ -1,13 +1,29 @@
 from parsl import python_app
+
 from kbmod_wf.utilities.executor_utilities import get_executors
 
 
 @python_app(
     cache=True,
     executors=get_executors(["local_dev_testing", "sharded_reproject"]),
-    ignore_for_cache=["logging_file"],
+    ignore_for_cache=[
+        "logging_file",
+        "logging_config",
+        "profile_config",
+        "memory_config",
+        "parsl_resource_specification",
+    ],
 )
-def reproject_wu(inputs=(), outputs=(), runtime_config={}, logging_file=None):
+def reproject_wu(
+    inputs=(),
+    outputs=(),
+    runtime_config={},
+    logging_file=None,
+    logging_config=None,
+    profile_config=None,
+    memory_config=None,
+    parsl_resource_specification=None,
+):
     """This app will call the reproject_wu function to reproject and reflex correct
     a given WorkUnit file.
 
@@ -23,6 +39,16 @@ def reproject_wu(inputs=(), outputs=(), runtime_config={}, logging_file=None):
         A dictionary of configuration setting specific to this task, by default {}
     logging_file : parsl.File, optional
         The parsl.File object the defines where the logs are written, by default None
+    logging_config : dict, optional
+        The ``[logging]`` section of the runtime configuration, by default None
+    profile_config : bool | int | dict, optional
+        The ``profile`` option of the ``[apps.<name>]`` section of the runtime
+        configuration, see `kbmod_wf.utilities.profiling_utilities`, by default None
+    memory_config : dict, optional
+        The ``[memory]`` section of the runtime configuration, see
+        `kbmod_wf.utilities.memory_utilities`, by default None
+    parsl_resource_specification : dict, optional
+        Passed through to the executor, e.g. to set the task priority, by default None
 
     Returns
     -------
@@ -35,14 +61,19 @@ def reproject_wu(inputs=(), outputs=(), runtime_config={}, logging_file=None):
         Reraises any exceptions that occur during the execution of the reproject_wu
         function.
     """
-    from kbmod_wf.utilities.logger_utilities import get_configured_logger, ErrorLogger
+    from kbmod_wf.utilities.logger_utilities import ErrorLogger, get_configured_logger
+    from kbmod_wf.utilities.memory_utilities import task_memory
+    from kbmod_wf.utilities.profiling_utilities import task_profile
+    from kbmod_wf.utilities.tracing_utilities import task_trace
 
-    logger = get_configured_logger("task.ic_to_wu", logging_file)
+    logger = get_configured_logger("task.reproject_wu", logging_file, logging_config)
 
-    from kbmod_wf.task_impls.reproject_multi_chip_multi_night_wu_from_uris import reproject_wu
+    from kbmod_wf.task_impls.reproject_multi_chip_multi_night_from_uris import reproject_wu
 
     logger.info("Starting reproject_ic")
-    with ErrorLogger(logger):
+    profile = task_profile("reproject_wu", outputs[0].filepath, profile_config, logger)
+    memory = task_memory("reproject_wu", logging_file, memory_config, logger, outputs[0].filepath)
+    with ErrorLogger(logger), memory, task_trace("reproject_wu", logging_file, logging_config), profile:
         reproject_wu(
             original_wu_filepath=inputs[0].filepath,
             uri_filepath=inputs[1].filepath,
@@ -53,3 +84,184 @@ def reproject_wu(inputs=(), outputs=(), runtime_config={}, logging_file=None):
     logger.info("Completed reproject_ic")
 
     return outputs[0]
+
+
+@python_app(
+    cache=True,
+    executors=get_executors(["local_dev_testing", "sharded_reproject"]),
+    ignore_for_cache=[
+        "logging_file",
+        "logging_config",
+        "profile_config",
+        "memory_config",
+        "parsl_resource_specification",
+    ],
+)
+def reproject_single_chip_wu(
+    inputs=(),
+    outputs=(),
+    runtime_config=None,
+    logging_file=None,
+    logging_config=None,
+    profile_config=None,
+    memory_config=None,
+    parsl_resource_specification=None,
+):
+    """This app will call the single chip, single night reproject_wu function to
+    reproject a given WorkUnit file to a common WCS.
+
+    Parameters
+    ----------
+    inputs : tuple, optional
+        A tuple with a single parsl.File object that references the original WorkUnit
+        file, by default ()
+    outputs : tuple, optional
+        A tuple with a single parsl.File object that references the reprojected
+        WorkUnit file, by default ()
+    runtime_config : dict, optional
+        A dictionary of configuration setting specific to this task, by default None
+    logging_file : parsl.File, optional
+        The parsl.File object the defines where the logs are written, by default None
+    logging_config : dict, optional
+        The ``[logging]`` section of the runtime configuration, by default None
+    profile_config : bool | int | dict, optional
+        The ``profile`` option of the ``[apps.<name>]`` section of the runtime
+        configuration, see `kbmod_wf.utilities.profiling_utilities`, by default None
+    memory_config : dict, optional
+        The ``[memory]`` section of the runtime configuration, see
+        `kbmod_wf.utilities.memory_utilities`, by default None
+    parsl_resource_specification : dict, optional
+        Passed through to the executor, e.g. to set the task priority, by default None
+
+    Returns
+    -------
+    parsl.File
+        The file object that points to the resulting WorkUnit file that was created.
+    """
+    from kbmod_wf.utilities.logger_utilities import ErrorLogger, get_configured_logger
+    from kbmod_wf.utilities.memory_utilities import task_memory
+    from kbmod_wf.utilities.profiling_utilities import task_profile
+    from kbmod_wf.utilities.tracing_utilities import task_trace
+
+    runtime_config = runtime_config if runtime_config is not None else {}
+    logger = get_configured_logger("task.reproject_wu", logging_file.filepath, logging_config)
+
+    from kbmod_wf.task_impls.reproject_single_chip_single_night_wu import reproject_wu
+
+    logger.info("Starting reproject_ic")
+    profile = task_profile("reproject_single_chip_wu", outputs[0].filepath, profile_config, logger)
+    memory = task_memory("reproject_single_chip_wu", logging_file, memory_config, logger, outputs[0].filepath)
+    with (
+        ErrorLogger(logger),
+        memory,
+        task_trace("reproject_single_chip_wu", logging_file, logging_config),
+        profile,
+    ):
+        reproject_wu(
+            original_wu_filepath=inputs[0].filepath,
+            reprojected_wu_filepath=outputs[0].filepath,
+            runtime_config=runtime_config,
+            logger=logger,
+        )
+    logger.info("Completed reproject_ic")
+
+    return outputs[0]
+
+
+@python_app(
+    cache=True,
+    executors=get_executors(["local_dev_testing", "sharded_reproject"]),
+    ignore_for_cache=[
+        "logging_file",
+        "logging_config",
+        "profile_config",
+        "memory_config",
+        "parsl_resource_specification",
+    ],
+)
+def reproject_multi_night_wu(
+    inputs=(),
+    outputs=(),
+    runtime_config=None,
+    logging_file=None,
+    logging_config=None,
+    profile_config=None,
+    memory_config=None,
+    parsl_resource_specification=None,
+):
+    """This app will build a WorkUnit from an ImageCollection file, then reflex
+    correct and reproject it for a heliocentric guess distance. When a list of
+    guess distances is given, the WorkUnit is built only once and reprojected
+    to each of them in turn.
+
+    Parameters
+    ----------
+    inputs : tuple, optional
+        A tuple with a parsl.File object that references the ImageCollection file,
+        and the heliocentric guess distance in AU, or a list of them, by default ()
+    outputs : tuple, optional
+        A tuple with a parsl.File object that references the reprojected WorkUnit
+        file for each guess distance, by default ()
+    runtime_config : dict, optional
+        A dictionary of configuration setting specific to this task, by default None
+    logging_file : parsl.File, optional
+        The parsl.File object the defines where the logs are written, by default None
+    logging_config : dict, optional
+        The ``[logging]`` section of the runtime configuration, by default None
+    profile_config : bool | int | dict, optional
+        The ``profile`` option of the ``[apps.<name>]`` section of the runtime
+        configuration, see `kbmod_wf.utilities.profiling_utilities`, by default None
+    memory_config : dict, optional
+        The ``[memory]`` section of the runtime configuration, see
+        `kbmod_wf.utilities.memory_utilities`, by default None
+    parsl_resource_specification : dict, optional
+        Passed through to the executor, e.g. to set the task priority, by default None
+
+    Returns
+    -------
+    parsl.File
+        The file object that points to the (first) resulting WorkUnit file that
+        was created.
+    """
+    from kbmod_wf.utilities.logger_utilities import ErrorLogger, get_configured_logger
+    from kbmod_wf.utilities.memory_utilities import task_memory
+    from kbmod_wf.utilities.profiling_utilities import task_profile
+    from kbmod_wf.utilities.tracing_utilities import task_trace
+
+    runtime_config = runtime_config if runtime_config is not None else {}
+    logger = get_configured_logger("task.reproject_wu", logging_file.filepath, logging_config)
+
+    from kbmod_wf.task_impls.reproject_multi_chip_multi_night_wu import (
+        reproject_wu,
+        reproject_wu_to_distances,
+    )
+
+    guess_dist = inputs[1]  # heliocentric guess distance(s) in AU
+    logger.info(f"Starting reproject_ic for guess distance {guess_dist}")
+    profile = task_profile("reproject_multi_night_wu", outputs[0].filepath, profile_config, logger)
+    memory = task_memory("reproject_multi_night_wu", logging_file, memory_config, logger, outputs[0].filepath)
+    with (
+        ErrorLogger(logger),
+        memory,
+        task_trace("reproject_multi_night_wu", logging_file, logging_config),
+        profile,
+    ):
+        if isinstance(guess_dist, (list, tuple)):
+            reproject_wu_to_distances(
+                guess_dist,
+                ic_filepath=inputs[0].filepath,
+                reprojected_wu_filepaths=[output.filepath for output in outputs],
+                runtime_config=runtime_config,
+                logger=logger,
+            )
+        else:
+            reproject_wu(
+                guess_dist,
+                ic_filepath=inputs[0].filepath,
+                reprojected_wu_filepath=outputs[0].filepath,
+                runtime_config=runtime_config,
+                logger=logger,
+            )
+    logger.info("Completed reproject_ic")
+
+    return outputs[0]
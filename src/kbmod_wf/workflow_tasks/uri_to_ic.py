@@ -3,9 +3,26 @@ from kbmod_wf.utilities.executor_utilities import get_executors
 
 
 @python_app(
-    cache=True, executors=get_executors(["local_dev_testing", "small_cpu"]), ignore_for_cache=["logging_file"]
+    cache=True,
+    executors=get_executors(["local_dev_testing", "small_cpu"]),
+    ignore_for_cache=[
+        "logging_file",
+        "logging_config",
+        "profile_config",
+        "memory_config",
+        "parsl_resource_specification",
+    ],
 )
-def uri_to_ic(inputs=(), outputs=(), runtime_config={}, logging_file=None):
+def uri_to_ic(
+    inputs=(),
+    outputs=(),
+    runtime_config={},
+    logging_file=None,
+    logging_config=None,
+    profile_config=None,
+    memory_config=None,
+    parsl_resource_specification=None,
+):
     """This app will call the uri_to_ic function to convert a given list of URIs
     file into an ImageCollection file.
 
@@ -21,6 +38,16 @@ def uri_to_ic(inputs=(), outputs=(), runtime_config={}, logging_file=None):
         A dictionary of configuration setting specific to this task, by default {}
     logging_file : parsl.File, optional
         The parsl.File object the defines where the logs are written, by default None
+    logging_config : dict, optional
+        The ``[logging]`` section of the runtime configuration, by default None
+    profile_config : bool | int | dict, optional
+        The ``profile`` option of the ``[apps.<name>]`` section of the runtime
+        configuration, see `kbmod_wf.utilities.profiling_utilities`, by default None
+    memory_config : dict, optional
+        The ``[memory]`` section of the runtime configuration, see
+        `kbmod_wf.utilities.memory_utilities`, by default None
+    parsl_resource_specification : dict, optional
+        Passed through to the executor, e.g. to set the task priority, by default None
 
     Returns
     -------
@@ -34,20 +61,26 @@ def uri_to_ic(inputs=(), outputs=(), runtime_config={}, logging_file=None):
         function.
     """
     import traceback
-    from kbmod_wf.utilities.logger_utilities import configure_logger
+    from kbmod_wf.utilities.logger_utilities import get_configured_logger
+    from kbmod_wf.utilities.tracing_utilities import task_trace
+    from kbmod_wf.utilities.memory_utilities import task_memory
+    from kbmod_wf.utilities.profiling_utilities import task_profile
     from kbmod_wf.task_impls.uri_to_ic import uri_to_ic
 
-    logger = configure_logger("task.uri_to_ic", logging_file.filepath)
+    logger = get_configured_logger("task.uri_to_ic", logging_file.filepath, logging_config)
 
     logger.info("Starting uri_to_ic")
     try:
-        uri_to_ic(
-            uris_filepath=inputs[0].filepath,
-            uris_base_dir=None,  # determine what, if any, value should be used.
-            ic_filepath=outputs[0].filepath,
-            runtime_config=runtime_config,
-            logger=logger,
-        )
+        profile = task_profile("uri_to_ic", outputs[0].filepath, profile_config, logger)
+        memory = task_memory("uri_to_ic", logging_file, memory_config, logger, outputs[0].filepath)
+        with memory, task_trace("uri_to_ic", logging_file, logging_config), profile:
+            uri_to_ic(
+                uris_filepath=inputs[0].filepath,
+                uris_base_dir=None,  # determine what, if any, value should be used.
+                ic_filepath=outputs[0].filepath,
+                runtime_config=runtime_config,
+                logger=logger,
+            )
     except Exception as e:
         logger.error(f"Error running uri_to_ic: {e}")
         logger.error(traceback.format_exc())
@@ -0,0 +1,81 @@
+import os
+import types
+
+import pytest
+
+
+@pytest.fixture
+def parsl_config(tmp_path):
+    """A parsl Config with a single thread pool executor, labelled like the dev
+    resource configuration's, so that every app can run on it."""
+    from parsl import Config
+    from parsl.executors import ThreadPoolExecutor
+
+    return Config(
+        run_dir=str(tmp_path / "runinfo"),
+        executors=[ThreadPoolExecutor(label="local_dev_testing", max_threads=4)],
+    )
+
+
+@pytest.fixture
+def dfk(parsl_config):
+    """A loaded DataFlowKernel, that is cleaned up after the test."""
+    import parsl
+
+    dfk = parsl.load(parsl_config)
+    yield dfk
+    dfk.cleanup()
+    parsl.clear()
+
+
+@pytest.fixture
+def stub_apps(monkeypatch):
+    """python_apps that stand in for the kbmod tasks, added to `kbmod_wf.workflow_tasks`.
+
+    ``copy_stage`` writes each of its outputs, and a shard "0_<output>" next to
+    it, from its upstream input, so it fails if the input was removed. It also
+    fails if ``runtime_config["fail"]`` is part of the input's filepath. The
+    name of every output it wrote is appended to ``calls``.
+    """
+    from parsl import python_app
+
+    from kbmod_wf import workflow_tasks
+
+    calls = []
+
+    @python_app(
+        cache=True, executors=["local_dev_testing"], ignore_for_cache=["logging_file", "logging_config"]
+    )
+    def copy_stage(inputs=(), outputs=(), runtime_config=None, logging_file=None, logging_config=None):
+        runtime_config = runtime_config or {}
+        upstream = inputs[0].filepath
+        if runtime_config.get("fail") and runtime_config["fail"] in upstream:
+            raise RuntimeError(f"Failing on purpose for {upstream}")
+        with open(upstream, "r") as f:
+            content = f.read()
+        for output in outputs:
+            directory, filename = os.path.split(output.filepath)
+            for filepath in (output.filepath, os.path.join(directory, f"0_{filename}")):
+                with open(filepath, "w") as f:
+                    f.write(f"{content}\n{filename}")
+            calls.append(filename)
+        return outputs[0]
+
+    monkeypatch.setattr(workflow_tasks, "copy_stage", copy_stage, raising=False)
+    return types.SimpleNamespace(copy_stage=copy_stage, calls=calls)
+
+
+@pytest.fixture
+def manifest(tmp_path):
+    """A manifest of three staged files in "staging", returning the manifest and the staged files."""
+    staging_directory = tmp_path / "staging"
+    staging_directory.mkdir()
+    entries = []
+    for i in range(3):
+        filepath = staging_directory / f"entry{i}.collection"
+        filepath.write_text(f"entry{i}")
+        entries.append(str(filepath))
+
+    manifest_filepath = tmp_path / "manifest.txt"
+    manifest_filepath.write_text("\n".join(entries) + "\n")
+    return str(manifest_filepath), entries
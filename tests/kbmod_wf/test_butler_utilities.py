@@ -0,0 +1,110 @@
+import threading
+
+import pytest
+
+from kbmod_wf.utilities.butler_utilities import ButlerPool
+
+
+class StubButler:
+    """Stands in for an `lsst.daf.butler.Butler`."""
+
+    def __init__(self, repo, collections):
+        self.repo = repo
+        self.collections = collections
+        self.healthy = True
+
+
+def _check(butler):
+    if not butler.healthy:
+        raise RuntimeError("The registry can't be reached")
+
+
+@pytest.fixture
+def pool():
+    return ButlerPool(factory=StubButler, health_check=_check, health_check_interval=0, max_size=2)
+
+
+def test_butler_is_reused(pool):
+    butler = pool.get("repo")
+
+    assert pool.get("repo") is butler
+    assert pool.get("repo", collections="a") is not butler
+    assert pool.get("repo", collections=["a"]) is pool.get("repo", collections="a")
+    assert (pool.hits, pool.misses) == (3, 2)
+
+
+def test_unhealthy_butler_is_replaced(pool):
+    butler = pool.get("repo")
+    butler.healthy = False
+
+    assert pool.get("repo") is not butler
+    assert len(pool) == 1
+
+
+def test_least_recently_used_butler_is_dropped(pool):
+    a = pool.get("a")
+    b = pool.get("b")
+    assert pool.get("a") is a
+
+    c = pool.get("c")
+
+    assert len(pool) == 2
+    assert pool.get("a") is a and pool.get("c") is c
+    assert pool.get("b") is not b
+
+
+def test_pool_must_hold_a_butler():
+    with pytest.raises(ValueError):
+        ButlerPool(factory=StubButler, max_size=0)
+
+
+def test_borrowed_butler_is_released_on_error(pool):
+    with pool.borrow("repo") as butler:
+        pass
+    assert pool.get("repo") is butler
+
+    with pytest.raises(KeyError), pool.borrow("repo") as butler:
+        raise KeyError("the butler is in a bad state")
+
+    assert len(pool) == 0
+    assert pool.get("repo") is not butler
+
+
+def test_invalidate(pool):
+    a = pool.get("repo", collections="a")
+    pool.get("repo", collections="b")
+
+    pool.invalidate("repo", collections="b")
+    assert len(pool) == 1 and pool.get("repo", collections="a") is a
+
+    pool.invalidate("repo")
+    assert len(pool) == 0
+
+
+def test_butler_is_created_without_holding_up_the_pool():
+    creating = threading.Event()
+    release = threading.Event()
+    created = []
+
+    def factory(repo, collections):
+        created.append(repo)
+        if repo == "slow":
+            creating.set()
+            assert release.wait(timeout=10)
+        return StubButler(repo, collections)
+
+    pool = ButlerPool(factory=factory, health_check=_check)
+    fast = pool.get("fast")
+    getters = [threading.Thread(target=pool.get, args=("slow",)) for _ in range(2)]
+    for getter in getters:
+        getter.start()
+    assert creating.wait(timeout=10)
+
+    # The pooled Butlers of the other repositories are still handed out while one is created.
+    assert pool.get("fast") is fast
+    release.set()
+    for getter in getters:
+        getter.join()
+
+    assert created == ["fast", "slow"]
+    assert (pool.hits, pool.misses) == (2, 2)
@@ -0,0 +1,153 @@
+import sqlite3
+
+import pytest
+
+from kbmod_wf.utilities.checkpoint_utilities import CheckpointStore, SQLiteMemoizer, configure_checkpoints
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints.sqlite"))
+    yield store
+    store.close()
+
+
+def _journal_mode(db_filepath):
+    connection = sqlite3.connect(db_filepath)
+    try:
+        return connection.execute("PRAGMA journal_mode").fetchone()[0]
+    finally:
+        connection.close()
+
+
+def test_store_put_and_get(store):
+    assert store.get("a") is None
+
+    store.put_many([("a", b"result a", ["a.out"]), ("b", b"result b", [])])
+    store.put_many([("a", b"new result a", ["a.out"])])
+
+    assert store.get("a") == b"new result a"
+    assert store.get("b") == b"result b"
+    assert len(store) == 2
+
+
+def test_store_get_with_outputs_and_delete(store):
+    store.put_many([("a", b"result a", ["a.out", "0_a.out"]), ("b", b"result b", [])])
+
+    assert store.get_with_outputs("a") == (b"result a", ["a.out", "0_a.out"])
+    assert store.get_with_outputs("b") == (b"result b", [])
+    assert store.get_with_outputs("c") is None
+
+    store.delete("a")
+    store.delete("c")
+    assert store.get("a") is None and len(store) == 1
+
+
+def test_store_uses_a_rollback_journal_by_default(store, tmp_path):
+    assert _journal_mode(store.db_filepath) == "delete"
+
+
+def test_store_journal_mode(tmp_path):
+    store = CheckpointStore(str(tmp_path / "checkpoints.sqlite"), journal_mode="wal")
+    store.close()
+    assert _journal_mode(store.db_filepath) == "wal"
+
+    with pytest.raises(ValueError, match="journal_mode"):
+        CheckpointStore(str(tmp_path / "other.sqlite"), journal_mode="OFF")
+
+
+def test_store_compact(store, tmp_path):
+    kept = tmp_path / "kept.out"
+    kept.write_text("")
+    store.put_many(
+        [
+            ("kept", b"", [str(kept)]),
+            ("no outputs", b"", []),
+            ("removed", b"", [str(kept), str(tmp_path / "removed.out")]),
+        ]
+    )
+
+    assert store.compact(dry_run=True) == (1, 2)
+    assert len(store) == 3
+    assert store.compact() == (1, 2)
+    assert store.get("removed") is None and len(store) == 2
+
+
+def test_configure_checkpoints(parsl_config):
+    parsl_config.memoizer = SQLiteMemoizer()
+
+    configure_checkpoints(parsl_config, {"flush_interval": 1.0, "journal_mode": "WAL", "other": 1})
+
+    assert parsl_config.memoizer.flush_interval == 1.0
+    assert parsl_config.memoizer.journal_mode == "WAL"
+
+
+def _run(parsl_config, copy_stage, inputs, outputs):
+    import parsl
+    from parsl import File
+
+    dfk = parsl.load(parsl_config)
+    try:
+        return copy_stage(
+            inputs=[File(inputs)], outputs=[File(outputs)], logging_file=None, logging_config=None
+        ).result()
+    finally:
+        dfk.cleanup()
+        parsl.clear()
+
+
+def test_memoizer_checkpoints_between_runs(tmp_path, parsl_config, stub_apps):
+    db_filepath = str(tmp_path / "checkpoints.sqlite")
+    source = tmp_path / "source"
+    source.write_text("source")
+    output = str(tmp_path / "output")
+
+    parsl_config.memoizer = SQLiteMemoizer(db_filepath=db_filepath, flush_interval=60.0)
+    first = _run(parsl_config, stub_apps.copy_stage, str(source), output)
+    # The result was flushed when the DFK was cleaned up.
+    store = CheckpointStore(db_filepath)
+    assert len(store) == 1
+    store.close()
+
+    parsl_config.memoizer = SQLiteMemoizer(db_filepath=db_filepath)
+    second = _run(parsl_config, stub_apps.copy_stage, str(source), output)
+
+    assert stub_apps.calls == ["output"]
+    assert second.filepath == first.filepath == output
+
+
+def test_memoizer_skips_unreadable_checkpoints(tmp_path, parsl_config, stub_apps):
+    db_filepath = str(tmp_path / "checkpoints.sqlite")
+    source = tmp_path / "source"
+    source.write_text("source")
+
+    parsl_config.memoizer = SQLiteMemoizer(db_filepath=db_filepath)
+    _run(parsl_config, stub_apps.copy_stage, str(source), str(tmp_path / "output"))
+
+    connection = sqlite3.connect(db_filepath)
+    with connection:
+        connection.execute("UPDATE checkpoints SET result = ?", (b"not a pickle",))
+    connection.close()
+    parsl_config.memoizer = SQLiteMemoizer(db_filepath=db_filepath)
+    _run(parsl_config, stub_apps.copy_stage, str(source), str(tmp_path / "output"))
+
+    assert stub_apps.calls == ["output", "output"]
+
+
+def test_memoizer_reruns_tasks_whose_outputs_were_removed(tmp_path, parsl_config, stub_apps):
+    db_filepath = str(tmp_path / "checkpoints.sqlite")
+    source = tmp_path / "source"
+    source.write_text("source")
+    output = tmp_path / "output"
+
+    parsl_config.memoizer = SQLiteMemoizer(db_filepath=db_filepath)
+    _run(parsl_config, stub_apps.copy_stage, str(source), str(output))
+    output.unlink()
+    _run(parsl_config, stub_apps.copy_stage, str(source), str(output))
+
+    assert stub_apps.calls == ["output", "output"]
+    assert output.exists()
+    # The stale checkpoint was replaced by the rerun's.
+    store = CheckpointStore(db_filepath)
+    assert len(store) == 1
+    store.close()
@@ -0,0 +1,75 @@
+from concurrent.futures import Future
+
+import pytest
+
+from kbmod_wf.utilities.cleanup_utilities import ArtifactCollector, BackgroundDeleter, list_artifact_files
+
+
+def _touch(directory, *names):
+    for name in names:
+        (directory / name).write_text(name)
+    return [str(directory / name) for name in names]
+
+
+@pytest.fixture
+def deleter():
+    deleter = BackgroundDeleter(n_threads=2, batch_size=2)
+    yield deleter
+    deleter.close()
+
+
+def test_list_artifact_files_finds_shards_in_order(tmp_path):
+    _touch(tmp_path, "a.wu", "10_a.wu", "2_a.wu", "0_a.wu", "x_a.wu", "0_b.wu")
+
+    assert list_artifact_files(str(tmp_path / "a.wu")) == [
+        str(tmp_path / name) for name in ["a.wu", "0_a.wu", "2_a.wu", "10_a.wu"]
+    ]
+    assert list_artifact_files(str(tmp_path / "missing" / "a.wu")) == [str(tmp_path / "missing" / "a.wu")]
+
+
+def test_background_deleter_deletes_files(tmp_path, deleter):
+    filepaths = _touch(tmp_path, "a", "b", "c")
+
+    deleter.delete(filepaths + [str(tmp_path / "already gone")])
+
+    assert deleter.wait()
+    assert list(tmp_path.iterdir()) == []
+    assert (deleter.n_deleted, deleter.n_failed) == (3, 0)
+
+
+def test_background_deleter_deletes_artifacts_with_their_shards(tmp_path, deleter):
+    _touch(tmp_path, "a.wu", "0_a.wu", "1_a.wu", "b.wu")
+
+    deleter.delete_artifact(str(tmp_path / "a.wu"))
+
+    assert deleter.wait()
+    assert [p.name for p in tmp_path.iterdir()] == ["b.wu"]
+
+
+def test_collector_deletes_once_every_reference_is_released(tmp_path, deleter):
+    (artifact,) = _touch(tmp_path, "a.wu")
+    collector = ArtifactCollector(deleter)
+
+    collector.retain(artifact, n=2)
+    assert not collector.release(artifact)
+    assert len(collector) == 1
+    assert collector.release(artifact)
+    collector.wait()
+
+    assert len(collector) == 0 and collector.n_collected == 1
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_collector_keeps_artifacts_whose_consumers_failed(tmp_path, deleter):
+    consumed, failed = _touch(tmp_path, "consumed.wu", "failed.wu")
+    collector = ArtifactCollector(deleter)
+    succeeding, failing = Future(), Future()
+
+    collector.consumed_by(consumed, succeeding)
+    collector.consumed_by(failed, failing)
+    succeeding.set_result(None)
+    failing.set_exception(RuntimeError("the consumer failed"))
+    collector.wait()
+
+    assert [p.name for p in tmp_path.iterdir()] == ["failed.wu"]
+    assert len(collector) == 1
@@ -0,0 +1,95 @@
+import os
+
+import pytest
+
+from kbmod_wf.utilities import concurrency_utilities
+from kbmod_wf.utilities.concurrency_utilities import get_available_memory, get_cpu_limit, resolve_n_workers
+
+GB = 1024**3
+
+
+@pytest.fixture
+def cgroup(tmp_path, monkeypatch):
+    """A fake cgroup tree and /proc files, returning a function that writes a file under the tree."""
+    root = tmp_path / "cgroup"
+    root.mkdir()
+    monkeypatch.setattr(concurrency_utilities, "_CGROUP_ROOT", str(root))
+    monkeypatch.setattr(concurrency_utilities, "_PROC_CGROUP", str(tmp_path / "proc_cgroup"))
+    monkeypatch.setattr(concurrency_utilities, "_PROC_MEMINFO", str(tmp_path / "meminfo"))
+    monkeypatch.setattr(os, "sched_getaffinity", lambda pid: set(range(16)), raising=False)
+    (tmp_path / "meminfo").write_text(f"MemTotal: {64 * GB // 1024} kB\nMemAvailable: {32 * GB // 1024} kB\n")
+
+    def write(relative_path, content):
+        filepath = root / relative_path
+        filepath.parent.mkdir(parents=True, exist_ok=True)
+        filepath.write_text(content)
+
+    def proc(content):
+        (tmp_path / "proc_cgroup").write_text(content)
+
+    write.proc = proc
+    return write
+
+
+def test_without_cgroups(cgroup):
+    assert get_cpu_limit() == 16
+    assert get_available_memory() == 32 * GB
+
+
+def test_cgroup_v2_limits(cgroup):
+    cgroup.proc("0::/slurm/job1/step0\n")
+    cgroup("cgroup.controllers", "cpu memory")
+    # The innermost cgroup without a limit doesn't hide the limit of its parent.
+    cgroup("slurm/job1/cpu.max", "400000 100000")
+    cgroup("slurm/job1/step0/cpu.max", "max 100000")
+    cgroup("slurm/job1/memory.max", str(8 * GB))
+    cgroup("slurm/job1/memory.current", str(2 * GB))
+    cgroup("slurm/job1/step0/memory.max", "max")
+    cgroup("slurm/job1/step0/memory.current", str(GB))
+
+    assert get_cpu_limit() == 4
+    assert get_available_memory() == 6 * GB
+
+
+def test_cgroup_v1_limits(cgroup):
+    cgroup.proc("5:memory:/slurm/job1\n4:cpu,cpuacct:/slurm/job1\n")
+    cgroup("cpu,cpuacct/slurm/job1/cpu.cfs_quota_us", "250000")
+    cgroup("cpu,cpuacct/slurm/job1/cpu.cfs_period_us", "100000")
+    cgroup("cpu,cpuacct/cpu.cfs_quota_us", "-1")
+    cgroup("cpu,cpuacct/cpu.cfs_period_us", "100000")
+    cgroup("memory/slurm/job1/memory.limit_in_bytes", str(4 * GB))
+    cgroup("memory/slurm/job1/memory.usage_in_bytes", str(3 * GB))
+
+    assert get_cpu_limit() == 2
+    assert get_available_memory() == GB
+
+
+def test_hybrid_cgroups_use_the_v1_controllers(cgroup):
+    cgroup.proc("0::/user.slice\n4:cpu,cpuacct:/job\n")
+    cgroup("cpu,cpuacct/job/cpu.cfs_quota_us", "100000")
+    cgroup("cpu,cpuacct/job/cpu.cfs_period_us", "100000")
+
+    assert get_cpu_limit() == 1
+
+
+def test_cgroup_path_of_the_host_is_not_visible(cgroup):
+    # Inside a container only the root of the namespaced hierarchy exists.
+    cgroup.proc("0::/host/slice/job\n")
+    cgroup("cgroup.controllers", "cpu memory")
+    cgroup("cpu.max", "300000 100000")
+
+    assert get_cpu_limit() == 3
+
+
+def test_resolve_n_workers(monkeypatch):
+    monkeypatch.setattr(concurrency_utilities, "get_cpu_limit", lambda: 8)
+    monkeypatch.setattr(concurrency_utilities, "get_available_memory", lambda: 10 * GB)
+
+    assert resolve_n_workers(4) == 4
+    assert resolve_n_workers(0) == 1
+    assert resolve_n_workers(1000) == concurrency_utilities.MAX_N_WORKERS
+    # 8 GB of the available memory fits 4 workers of 2 GB each.
+    assert resolve_n_workers("auto", worker_bytes=2 * GB) == 4
+    assert resolve_n_workers("auto", worker_bytes=GB) == 8
+    assert resolve_n_workers("auto", worker_bytes=GB, n_tasks=3) == 3
+    assert resolve_n_workers("auto", worker_bytes=4 * GB, reserved_bytes=6 * GB) == 1
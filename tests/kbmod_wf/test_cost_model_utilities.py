@@ -0,0 +1,76 @@
+import json
+
+import pytest
+
+from kbmod_wf.utilities import cost_model_utilities
+from kbmod_wf.utilities.cost_model_utilities import CostModel, timed_app_function
+
+
+@pytest.fixture
+def entry(tmp_path):
+    """A URI list with two images."""
+    filepath = tmp_path / "entry.lst"
+    filepath.write_text("#patch_size = [1, 1]\n#pixel_scale = 0.6\nuri0\nuri1\n")
+    return str(filepath)
+
+
+def test_cost_model_is_opt_in():
+    assert CostModel.from_config({}) is None
+    assert isinstance(CostModel.from_config({"enabled": True}), CostModel)
+
+
+def test_record_refits_lazily(entry, monkeypatch):
+    model = CostModel()
+    features = model.features(entry)
+    assert features == {"n_images": 2, "patch_pixels": 100 * 100}
+
+    refits = []
+    refit = model._refit
+    monkeypatch.setattr(model, "_refit", lambda stage: refits.append(stage) or refit(stage))
+    for seconds in (1.0, 3.0, 2.0):
+        model.record("kbmod_search", entry, seconds)
+    assert refits == []
+
+    assert model.predict("kbmod_search", features) == pytest.approx(2.0)
+    assert model.predict("kbmod_search", features) == pytest.approx(2.0)
+    assert refits == ["kbmod_search"]
+
+
+def test_history_is_bounded(tmp_path, entry, monkeypatch):
+    monkeypatch.setattr(cost_model_utilities, "MAX_RECORDS_PER_STAGE", 2)
+    history_filepath = tmp_path / "task_timings.jsonl"
+
+    model = CostModel(history_filepath=str(history_filepath))
+    for seconds in (100.0, 100.0, 1.0, 3.0):
+        model.record("kbmod_search", entry, seconds)
+    assert len(history_filepath.read_text().splitlines()) == 4
+    assert model.predict("kbmod_search", model.features(entry)) == pytest.approx(2.0)
+
+    # The timings that are no longer used are dropped from the history.
+    model = CostModel(history_filepath=str(history_filepath))
+    lines = history_filepath.read_text().splitlines()
+    assert [json.loads(line)["seconds"] for line in lines] == [1.0, 3.0]
+    assert model.predict("kbmod_search", model.features(entry)) == pytest.approx(2.0)
+
+
+def test_order_puts_the_most_expensive_entry_first(tmp_path, entry):
+    small = tmp_path / "small.lst"
+    small.write_text("#patch_size = [1, 1]\n#pixel_scale = 0.6\nuri0\n")
+
+    ordered = CostModel().order([str(small), entry], ["kbmod_search"])
+
+    assert [filepath for filepath, _ in ordered] == [entry, str(small)]
+
+
+def test_timed_app_function_attaches_the_runtime():
+    class Result:
+        pass
+
+    def app(x):
+        return Result() if x else None
+
+    timed = timed_app_function(app)
+
+    assert timed.__name__ == "app" and timed.__module__ == app.__module__
+    assert timed(1).task_seconds >= 0
+    assert timed(0) is None
@@ -0,0 +1,99 @@
+import os
+import pickle
+import types
+
+from kbmod_wf.utilities import ebd_utilities
+from kbmod_wf.utilities.ebd_utilities import EBDCache, get_ebd_cache, transform_wcses_to_ebd_cached
+
+FIT_BYTES = len(pickle.dumps(b"x" * 100))
+
+
+def _age(cache, key, seconds):
+    """Make a cached fit look like it was last used ``seconds`` ago."""
+    path = cache._path(key)
+    mtime = os.stat(path).st_mtime - seconds
+    os.utime(path, (mtime, mtime))
+
+
+def test_put_then_get(tmp_path):
+    cache = EBDCache(str(tmp_path))
+
+    assert cache.get("a") is None
+    cache.put("a", ("wcs", 1.0))
+    assert cache.get("a") == ("wcs", 1.0)
+    assert [f for f in os.listdir(tmp_path)] == ["a.pkl"]
+
+
+def test_put_only_evicts_past_the_budget(tmp_path, monkeypatch):
+    # Evicting down to 90% of the budget leaves room for three fits.
+    cache = EBDCache(str(tmp_path), max_bytes=int(3.5 * FIT_BYTES))
+    scans = []
+    scan = cache._scan
+    monkeypatch.setattr(cache, "_scan", lambda: scans.append(1) or scan())
+
+    for i, key in enumerate("abc"):
+        cache.put(key, b"x" * 100)
+        _age(cache, key, 100 - i)
+    # The size is counted once, and then tracked.
+    assert len(scans) == 1
+
+    # Reading "a" makes "b" the least recently used.
+    assert cache.get("a") is not None
+    cache.put("d", b"x" * 100)
+
+    assert len(scans) == 2
+    assert sorted(os.listdir(tmp_path)) == ["a.pkl", "c.pkl", "d.pkl"]
+
+
+def test_replacing_a_fit_does_not_grow_the_cache(tmp_path):
+    cache = EBDCache(str(tmp_path), max_bytes=2 * FIT_BYTES)
+
+    for _ in range(5):
+        cache.put("a", b"x" * 100)
+    cache.put("b", b"x" * 100)
+
+    assert sorted(os.listdir(tmp_path)) == ["a.pkl", "b.pkl"]
+
+
+def test_evict(tmp_path):
+    cache = EBDCache(str(tmp_path), max_bytes=10 * FIT_BYTES)
+    for i, key in enumerate("abc"):
+        cache.put(key, b"x" * 100)
+        _age(cache, key, 100 - i)
+
+    cache.max_bytes = FIT_BYTES
+    cache.evict()
+
+    assert os.listdir(tmp_path) == ["c.pkl"]
+
+
+def test_get_ebd_cache_is_shared(tmp_path):
+    assert get_ebd_cache(str(tmp_path)) is get_ebd_cache(str(tmp_path))
+    assert get_ebd_cache(str(tmp_path)) is not get_ebd_cache(str(tmp_path), max_bytes=1)
+
+
+def test_fits_are_made_by_spawned_processes(monkeypatch):
+    contexts = []
+
+    class Pool:
+        def __init__(self, max_workers, mp_context=None):
+            contexts.append(mp_context.get_start_method())
+
+        def __enter__(self):
+            return self
+
+        def __exit__(self, *args):
+            return False
+
+        def map(self, func, iterable):
+            return map(func, iterable)
+
+    monkeypatch.setattr(ebd_utilities, "ProcessPoolExecutor", Pool)
+    monkeypatch.setattr(ebd_utilities, "_fit_ebd_wcs_from_args", lambda args: (args[0], args[4]))
+    obstimes = types.SimpleNamespace(mjd=[60000.0, 60001.0])
+
+    wcses, dists = transform_wcses_to_ebd_cached(["a", "b"], 10, 10, 40.0, obstimes, None, n_workers=2)
+
+    assert contexts == ["spawn"]
+    assert wcses == ["a", "b"]
+    assert dists == [60000.0, 60001.0]
@@ -0,0 +1,26 @@
+from concurrent.futures import Future
+
+from kbmod_wf.utilities.future_utilities import wait_for_futures
+
+
+def _resolved(result=None, exception=None):
+    future = Future()
+    if exception is not None:
+        future.set_exception(exception)
+    else:
+        future.set_result(result)
+    return future
+
+
+def test_wait_for_futures_returns_failures():
+    error = ValueError("failed")
+    futures = [_resolved(1), _resolved(exception=error), _resolved(3)]
+
+    results, failures = wait_for_futures(futures)
+
+    assert sorted(results) == [1, 3]
+    assert failures == [(futures[1], error)]
+
+
+def test_wait_for_futures_without_futures():
+    assert wait_for_futures([]) == ([], [])
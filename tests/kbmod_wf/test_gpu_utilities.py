@@ -0,0 +1,113 @@
+import os
+
+import pytest
+
+from kbmod_wf.utilities import gpu_utilities
+from kbmod_wf.utilities.gpu_utilities import GPUAllocator, enumerate_devices, gpu_slot, pin_gpu
+
+GB = 1024**3
+
+
+@pytest.fixture
+def fake_gpus(tmp_path, monkeypatch):
+    """Two fake 16GB GPUs, with the slot locks in a directory of their own, and no device pinned yet."""
+    monkeypatch.setenv(gpu_utilities.FAKE_GPUS_ENV, "2")
+    monkeypatch.delenv("CUDA_VISIBLE_DEVICES", raising=False)
+    monkeypatch.setattr(gpu_utilities, "_pinned_device", None)
+    return {"lock_directory": str(tmp_path / "locks"), "timeout": 0}
+
+
+def test_enumerate_fake_devices(monkeypatch):
+    monkeypatch.setenv(gpu_utilities.FAKE_GPUS_ENV, "2")
+    assert [(d.index, d.memory_bytes) for d in enumerate_devices()] == [(0, 16 * GB), (1, 16 * GB)]
+
+    monkeypatch.setenv(gpu_utilities.FAKE_GPUS_ENV, "1024,2048")
+    assert [d.memory_bytes for d in enumerate_devices()] == [GB, 2 * GB]
+
+
+def test_slots_are_exclusive(fake_gpus):
+    allocator = GPUAllocator(fake_gpus["lock_directory"], slots_per_device=2, memory_fraction=1.0)
+
+    # A search needing more than half of a device takes both of its slots.
+    first, first_held = allocator.acquire(10 * GB, timeout=0)
+    assert len(first_held) == 2
+    second, second_held = allocator.acquire(timeout=0)
+    assert second.index != first.index and len(second_held) == 1
+    third, third_held = allocator.acquire(timeout=0)
+    assert third.index == second.index
+    with pytest.raises(TimeoutError):
+        allocator.acquire(timeout=0)
+
+    allocator.release(first_held)
+    assert allocator.acquire(10 * GB, timeout=0)[0].index == first.index
+
+
+def test_slots_are_exclusive_between_allocators(fake_gpus):
+    # Each worker process has its own allocator, sharing the lock files.
+    a = GPUAllocator(fake_gpus["lock_directory"])
+    b = GPUAllocator(fake_gpus["lock_directory"])
+
+    devices = {a.acquire(timeout=0)[0].index, b.acquire(timeout=0)[0].index}
+
+    assert devices == {0, 1}
+    with pytest.raises(TimeoutError):
+        b.acquire(timeout=0)
+
+
+def test_gpu_slot_sets_and_pins_cuda_visible_devices(fake_gpus):
+    with gpu_slot(gpu_config=fake_gpus) as device:
+        assert os.environ["CUDA_VISIBLE_DEVICES"] == str(device.index)
+        assert gpu_utilities._pinned_device == device.index
+
+    # CUDA can only be pointed at a device once, so later searches stay on it.
+    with gpu_slot(gpu_config=fake_gpus) as again:
+        assert again.index == device.index
+
+
+def test_gpu_slot_keeps_to_the_scheduled_devices(fake_gpus, monkeypatch):
+    monkeypatch.setenv("CUDA_VISIBLE_DEVICES", "1")
+
+    with gpu_slot(gpu_config=fake_gpus) as device:
+        assert device.index == 1
+
+
+def test_gpu_slot_is_released_on_exception(fake_gpus):
+    config = {**fake_gpus, "slots_per_device": 1}
+    with pytest.raises(RuntimeError), gpu_slot(gpu_config=config) as device:
+        raise RuntimeError("the search failed")
+
+    allocator = GPUAllocator(fake_gpus["lock_directory"])
+    assert allocator.acquire(devices=[device], timeout=0)[0] is device
+
+
+def test_gpu_slot_without_gpus(fake_gpus, monkeypatch):
+    monkeypatch.setenv(gpu_utilities.FAKE_GPUS_ENV, "0")
+    monkeypatch.setattr(gpu_utilities.shutil, "which", lambda name: None)
+
+    with gpu_slot(gpu_config=fake_gpus) as device:
+        assert device is None
+    assert "CUDA_VISIBLE_DEVICES" not in os.environ
+
+
+def test_pin_gpu_picks_the_least_loaded_device_before_any_slot(fake_gpus):
+    config = {**fake_gpus, "slots_per_device": 2}
+    allocator = GPUAllocator(fake_gpus["lock_directory"], slots_per_device=2)
+    _, held = allocator.acquire(devices=allocator.devices[:1], timeout=0)
+
+    device = pin_gpu(config)
+
+    assert device.index == 1
+    assert os.environ["CUDA_VISIBLE_DEVICES"] == "1"
+    allocator.release(held)
+    # Searches take their slots on the pinned device, even once the other one is free.
+    assert pin_gpu(config).index == 1
+    with gpu_slot(gpu_config=config) as slot_device:
+        assert slot_device.index == 1
+
+
+def test_pin_gpu_without_gpus(fake_gpus, monkeypatch):
+    monkeypatch.setenv(gpu_utilities.FAKE_GPUS_ENV, "0")
+    monkeypatch.setattr(gpu_utilities.shutil, "which", lambda name: None)
+
+    assert pin_gpu(fake_gpus) is None
+    assert "CUDA_VISIBLE_DEVICES" not in os.environ
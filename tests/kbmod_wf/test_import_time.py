@@ -0,0 +1,8 @@
+from kbmod_wf.utilities.import_utilities import check_import_budgets
+
+
+def test_import_budgets():
+    # Importing the package or a workflow's command line must not import parsl, kbmod and the like.
+    failures = check_import_budgets(verbose=False)
+
+    assert failures == []
@@ -0,0 +1,37 @@
+import logging
+import os
+import socket
+
+from kbmod_wf.utilities.logger_utilities import get_configured_logger, get_worker_log_filepath
+
+
+def test_each_worker_writes_its_own_log_file(tmp_path):
+    file_path = str(tmp_path / "kbmod.log")
+
+    get_configured_logger("task.test_logging", file_path)
+
+    hostname = socket.gethostname().split(".")[0]
+    assert get_worker_log_filepath(file_path) == str(tmp_path / f"kbmod.{hostname}.{os.getpid()}.log")
+    assert os.path.exists(get_worker_log_filepath(file_path))
+    assert not os.path.exists(file_path)
+
+
+def test_a_different_logging_config_is_ignored_with_a_warning(tmp_path):
+    file_path = str(tmp_path / "kbmod.log")
+    records = []
+    handler = logging.Handler()
+    handler.emit = records.append
+
+    logger = get_configured_logger("task.test_logging", file_path, {"level": "INFO"})
+    logger.addHandler(handler)
+    try:
+        # The stages apply to each logger, so they don't count as a different configuration.
+        get_configured_logger("task.test_logging", file_path, {"level": "INFO", "stages": {"other": {}}})
+        get_configured_logger("task.test_logging", file_path, {"level": "DEBUG"})
+        get_configured_logger("task.test_logging", file_path, {"level": "DEBUG"})
+    finally:
+        logger.removeHandler(handler)
+
+    warnings = [record.getMessage() for record in records if record.levelno == logging.WARNING]
+    assert len(warnings) == 1
+    assert "'level': 'DEBUG'" in warnings[0]
@@ -0,0 +1,228 @@
+import errno
+import os
+
+import pytest
+
+from kbmod_wf.utilities.manifest_utilities import (
+    STAGING_INDEX_FILENAME,
+    FileStager,
+    StagingIndex,
+    scan_staging_directory,
+    stream_manifest_entries,
+)
+
+
+def _touch(directory, *names):
+    directory.mkdir(exist_ok=True)
+    for name in names:
+        (directory / name).write_text(name)
+    return [str(directory / name) for name in names]
+
+
+def test_scan_staging_directory_batches_matching_files(tmp_path):
+    expected = _touch(tmp_path, "a.collection", "b.collection", "c.collection")
+    _touch(tmp_path, "d.lst")
+    (tmp_path / "e.collection").mkdir()
+
+    batches = list(scan_staging_directory(str(tmp_path), batch_size=2))
+
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert sorted(sum(batches, [])) == expected
+
+
+def test_scan_staging_directory_skips_seen_files(tmp_path):
+    seen = set(_touch(tmp_path, "a.collection"))
+    expected = _touch(tmp_path, "b.collection")
+
+    assert list(scan_staging_directory(str(tmp_path), seen=seen)) == [expected]
+    assert list(scan_staging_directory(str(tmp_path), seen=seen)) == []
+    assert len(seen) == 2
+
+
+def test_scan_staging_directory_waits_for_files_being_written(tmp_path):
+    seen = set()
+    pending = {}
+    (path,) = _touch(tmp_path, "a.collection")
+
+    # A file is only yielded once it is unchanged since the previous scan.
+    assert list(scan_staging_directory(str(tmp_path), seen=seen, pending=pending)) == []
+    with open(path, "a") as f:
+        f.write("more")
+    assert list(scan_staging_directory(str(tmp_path), seen=seen, pending=pending)) == []
+    assert list(scan_staging_directory(str(tmp_path), seen=seen, pending=pending)) == [[path]]
+    assert list(scan_staging_directory(str(tmp_path), seen=seen, pending=pending)) == []
+    assert pending == {}
+
+
+def test_stream_manifest_entries_writes_each_batch(tmp_path):
+    staging_directory = tmp_path / "staging"
+    _touch(staging_directory, "a.collection", "b.collection", "c.collection")
+    manifest_filepath = tmp_path / "manifest.txt"
+
+    batches = []
+    for batch in stream_manifest_entries(
+        str(staging_directory), str(tmp_path / "staged"), str(manifest_filepath), batch_size=2
+    ):
+        # Each batch is in the manifest by the time it is yielded.
+        assert manifest_filepath.read_text().splitlines()[-len(batch) :] == batch
+        batches.append(batch)
+
+    assert [len(batch) for batch in batches] == [2, 1]
+    assert sorted(os.path.basename(f) for f in sum(batches, [])) == [
+        "a.collection",
+        "b.collection",
+        "c.collection",
+    ]
+    assert all(os.path.dirname(f) == str(tmp_path / "staged") for f in sum(batches, []))
+
+
+def test_stream_manifest_entries_watches_for_new_files(tmp_path):
+    staging_directory = tmp_path / "staging"
+    _touch(staging_directory, "a.collection")
+
+    stream = stream_manifest_entries(
+        str(staging_directory),
+        str(tmp_path / "staged"),
+        str(tmp_path / "manifest.txt"),
+        watch=True,
+        poll_interval=0.01,
+        idle_timeout=0.2,
+    )
+
+    assert [os.path.basename(f) for f in next(stream)] == ["a.collection"]
+    _touch(staging_directory, "b.collection")
+    assert [os.path.basename(f) for f in next(stream)] == ["b.collection"]
+    # The stream ends once nothing new has been found for idle_timeout.
+    assert list(stream) == []
+    assert len((tmp_path / "manifest.txt").read_text().splitlines()) == 2
+
+
+def test_stream_manifest_entries_stages_complete_files(tmp_path, monkeypatch):
+    from kbmod_wf.utilities import manifest_utilities
+
+    staging_directory = tmp_path / "staging"
+    (path,) = _touch(staging_directory, "a.collection")
+    polls = []
+
+    def sleep(seconds):
+        # The file is still being written when the first two polls find it.
+        if len(polls) < 2:
+            with open(path, "a") as f:
+                f.write("more")
+        polls.append(seconds)
+
+    monkeypatch.setattr(manifest_utilities.time, "sleep", sleep)
+    stream = stream_manifest_entries(
+        str(staging_directory),
+        str(tmp_path / "staged"),
+        str(tmp_path / "manifest.txt"),
+        watch=True,
+        poll_interval=0.01,
+        idle_timeout=0.2,
+    )
+
+    assert [os.path.basename(f) for f in next(stream)] == ["a.collection"]
+    assert len(polls) == 3
+    with open(tmp_path / "staged" / "a.collection", "r") as f:
+        assert f.read() == "a.collectionmoremore"
+
+
+@pytest.mark.parametrize("staging", ["auto", "reflink", "hardlink", "symlink", "copy"])
+def test_file_stager_places_files(tmp_path, staging):
+    (source,) = _touch(tmp_path / "staging", "a.collection")
+    (tmp_path / "staged").mkdir()
+
+    staged = FileStager(str(tmp_path / "staged"), staging).stage(source)
+
+    assert staged == str(tmp_path / "staged" / "a.collection")
+    with open(staged, "r") as f:
+        assert f.read() == "a.collection"
+    assert os.path.islink(staged) == (staging == "symlink")
+    if staging == "hardlink":
+        assert os.path.samefile(staged, source)
+    # Nothing is left behind under a temporary name.
+    assert os.listdir(tmp_path / "staged") == ["a.collection"]
+
+
+def test_file_stager_falls_back_to_a_copy(tmp_path, monkeypatch):
+    sources = _touch(tmp_path / "staging", "a.collection", "b.collection")
+    (tmp_path / "staged").mkdir()
+    links = []
+
+    def link(source, destination):
+        links.append(source)
+        raise OSError(errno.EXDEV, "Invalid cross-device link")
+
+    monkeypatch.setattr(os, "link", link)
+    stager = FileStager(str(tmp_path / "staged"), "hardlink")
+
+    staged = stager.stage_batch(sources)
+
+    assert [os.path.basename(f) for f in staged] == ["a.collection", "b.collection"]
+    assert not os.path.samefile(staged[0], sources[0])
+    # A hard link across filesystems can't work for any file, so it is only tried once.
+    assert len(links) == 1 and stager.strategies == ["copy"]
+
+
+def test_file_stager_raises_other_errors(tmp_path):
+    (tmp_path / "staged").mkdir()
+
+    with pytest.raises(FileNotFoundError):
+        FileStager(str(tmp_path / "staged"), "hardlink").stage(str(tmp_path / "missing.collection"))
+    with pytest.raises(ValueError, match="Invalid staging strategy"):
+        FileStager(str(tmp_path / "staged"), "move")
+
+
+def test_staging_index_tracks_staged_files(tmp_path):
+    (source,) = _touch(tmp_path / "staging", "a.collection")
+    output_directory = tmp_path / "staged"
+    output_directory.mkdir()
+
+    index = StagingIndex(str(output_directory))
+    FileStager(str(output_directory), index=index).stage(source)
+    index.save()
+    assert (output_directory / STAGING_INDEX_FILENAME).exists()
+
+    stat = os.stat(source)
+    index = StagingIndex(str(output_directory))
+    assert len(index) == 1
+    assert index.is_current(source, stat, "copy")
+    assert not index.is_current(source, stat, "hardlink")
+
+    # The staged copy was removed since.
+    (output_directory / "a.collection").unlink()
+    assert not StagingIndex(str(output_directory)).is_current(source, stat, "copy")
+
+
+def test_file_stager_only_restages_changed_files(tmp_path):
+    sources = _touch(tmp_path / "staging", "a.collection", "b.collection")
+    output_directory = tmp_path / "staged"
+    output_directory.mkdir()
+    index = StagingIndex(str(output_directory))
+    FileStager(str(output_directory), index=index).stage_batch(sources)
+    index.save()
+
+    with open(sources[1], "w") as f:
+        f.write("changed")
+    stager = FileStager(str(output_directory), index=StagingIndex(str(output_directory)))
+    stager.stage_batch(sources)
+
+    assert (stager.n_unchanged, stager.n_staged) == (1, 1)
+    assert (output_directory / "b.collection").read_text() == "changed"
+
+
+def test_stream_manifest_entries_keeps_unchanged_files(tmp_path):
+    staging_directory = tmp_path / "staging"
+    _touch(staging_directory, "a.collection")
+    args = (str(staging_directory), str(tmp_path / "staged"), str(tmp_path / "manifest.txt"))
+    list(stream_manifest_entries(*args))
+    staged = tmp_path / "staged" / "a.collection"
+    inode = staged.stat().st_ino
+
+    # Every file is still in the manifest, but the unchanged ones aren't staged again.
+    _touch(staging_directory, "b.collection")
+    batches = list(stream_manifest_entries(*args))
+
+    assert sorted(os.path.basename(f) for f in batches[0]) == ["a.collection", "b.collection"]
+    assert len((tmp_path / "manifest.txt").read_text().splitlines()) == 2
+    assert staged.stat().st_ino == inode
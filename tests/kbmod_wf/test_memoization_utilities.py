@@ -0,0 +1,99 @@
+import os
+import pickle
+import subprocess
+import sys
+
+from parsl import File
+
+from kbmod_wf.utilities import memoization_utilities
+from kbmod_wf.utilities.cleanup_utilities import BackgroundDeleter
+from kbmod_wf.utilities.memoization_utilities import (
+    DIGEST_SIDECAR_SUFFIX,
+    get_file_identity,
+    id_for_memo_file,
+)
+
+
+def test_importing_the_workflow_tasks_registers_file_memoization():
+    # In a fresh interpreter, as this one may already have imported memoization_utilities.
+    code = (
+        "import kbmod_wf.workflow_tasks\n"
+        "from parsl import File\n"
+        "from parsl.dataflow.memoization import id_for_memo\n"
+        "assert id_for_memo.dispatch(File).__module__ == 'kbmod_wf.utilities.memoization_utilities'\n"
+    )
+
+    completed = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True)
+
+    assert completed.returncode == 0, completed.stderr
+
+
+def _restage(path, content, mtime_ns):
+    path.write_text(content)
+    os.utime(path, ns=(mtime_ns, mtime_ns))
+
+
+def test_stat_identity_changes_when_a_file_is_restaged(tmp_path):
+    path = tmp_path / "a.wu"
+    _restage(path, "abc", 10**18)
+    identity = get_file_identity(str(path), mode="stat")
+
+    assert get_file_identity(str(path), mode="stat") == identity
+    assert id_for_memo_file(File(str(path))) == id_for_memo_file(File(str(path)))
+
+    # A new modification time, or a new size, is a new key.
+    _restage(path, "abc", 2 * 10**18)
+    assert get_file_identity(str(path), mode="stat") != identity
+    key = id_for_memo_file(File(str(path)))
+    _restage(path, "abcd", 2 * 10**18)
+    assert id_for_memo_file(File(str(path))) != key
+
+    # As is a rewritten shard of a WorkUnit.
+    identity = get_file_identity(str(path), mode="stat")
+    (tmp_path / "0_a.wu").write_text("shard")
+    assert get_file_identity(str(path), mode="stat") != identity
+
+
+def test_outputs_and_missing_files_are_identified_by_path(tmp_path):
+    path = tmp_path / "a.wu"
+    assert get_file_identity(str(path), mode="stat") is None
+    path.write_text("abc")
+
+    assert get_file_identity(str(path), mode="path") is None
+    assert pickle.loads(id_for_memo_file(File(str(path)), output_ref=True)) == str(path)
+
+
+def test_digest_sidecar_is_reused_until_the_file_changes(tmp_path, monkeypatch):
+    path = tmp_path / "a.wu"
+    _restage(path, "abc", 10**18)
+    digest = get_file_identity(str(path), mode="digest")
+    assert (tmp_path / f"a.wu{DIGEST_SIDECAR_SUFFIX}").exists()
+
+    def blake2b(*args, **kwargs):
+        raise AssertionError("The file was hashed again")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(memoization_utilities.hashlib, "blake2b", blake2b)
+        assert get_file_identity(str(path), mode="digest") == digest
+
+    # The same content restaged with a new modification time has the same digest.
+    _restage(path, "abc", 2 * 10**18)
+    assert get_file_identity(str(path), mode="digest") == digest
+    _restage(path, "abd", 3 * 10**18)
+    assert get_file_identity(str(path), mode="digest") != digest
+
+
+def test_digest_sidecar_is_cleaned_up_with_its_file(tmp_path):
+    path = tmp_path / "a.wu"
+    path.write_text("abc")
+    (tmp_path / "0_a.wu").write_text("shard")
+    get_file_identity(str(path), mode="digest")
+
+    deleter = BackgroundDeleter()
+    try:
+        deleter.delete_artifact(str(path))
+        assert deleter.wait()
+    finally:
+        deleter.close()
+
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,34 @@
+import json
+
+from kbmod_wf.utilities.memory_utilities import MEMORY_DIRECTORY_NAME, record_input_size, task_memory
+
+
+def test_task_memory_is_disabled_by_default(tmp_path):
+    logging_file = str(tmp_path / "kbmod.log")
+
+    with task_memory("kbmod_search", logging_file) as record:
+        assert record is None
+        record_input_size(n_images=3)
+
+    with task_memory("kbmod_search", logging_file, memory_config={"enabled": False}) as record:
+        assert record is None
+
+    assert not (tmp_path / MEMORY_DIRECTORY_NAME).exists()
+
+
+def test_task_memory_writes_a_record_when_enabled(tmp_path):
+    logging_file = str(tmp_path / "kbmod.log")
+
+    with task_memory(
+        "kbmod_search", logging_file, {"enabled": True}, output_filepath="out.parquet"
+    ) as record:
+        record_input_size(n_images=3, image_height=4, image_width=5)
+
+    (filepath,) = (tmp_path / MEMORY_DIRECTORY_NAME).iterdir()
+    with open(filepath, "r") as f:
+        (row,) = [json.loads(line) for line in f]
+    assert row["task"] == "kbmod_search"
+    assert row["output"] == "out.parquet"
+    assert row["n_pixels"] == 60
+    assert row["peak_rss_bytes"] == record.peak_rss_bytes
+    assert "top_allocators" not in row
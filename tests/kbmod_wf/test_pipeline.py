@@ -0,0 +1,446 @@
+import pytest
+
+from kbmod_wf.pipeline import run_workflow
+from kbmod_wf.utilities.future_utilities import wait_for_futures
+
+
+def _runtime_config(tmp_path, **copy_config):
+    return {
+        "apps": {
+            "create_manifest": {
+                "staging_directory": str(tmp_path / "staging"),
+                "output_directory": str(tmp_path / "staged"),
+            },
+            "copy": copy_config,
+        },
+        "cost_model": {"enabled": False},
+    }
+
+
+@pytest.fixture
+def resource_config(parsl_config, monkeypatch):
+    """Make run_workflow load the test's parsl Config."""
+    from kbmod_wf.utilities import configuration_utilities
+
+    monkeypatch.setattr(configuration_utilities, "get_resource_config", lambda env=None: parsl_config)
+    return parsl_config
+
+
+def test_run_workflow_returns_results(tmp_path, manifest, resource_config, stub_apps):
+    results = run_workflow(
+        runtime_config=_runtime_config(tmp_path),
+        default_stages=[{"name": "copy", "app": "copy_stage", "output": "{upstream}.out"}],
+    )
+
+    assert sorted(r.filepath for r in results) == [
+        str(tmp_path / "staged" / f"entry{i}.collection.out") for i in range(3)
+    ]
+
+
+def test_run_workflow_raises_on_failed_tasks(tmp_path, manifest, resource_config, stub_apps):
+    with pytest.raises(RuntimeError, match="1 of 3 workflow tasks failed"):
+        run_workflow(
+            runtime_config=_runtime_config(tmp_path, fail="entry1"),
+            default_stages=[{"name": "copy", "app": "copy_stage", "output": "{upstream}.out"}],
+        )
+
+    # The other entries were still processed.
+    assert (tmp_path / "staged" / "entry0.collection.out").exists()
+    assert (tmp_path / "staged" / "entry2.collection.out").exists()
+
+
+def _graph(stages, app_configs=None):
+    from kbmod_wf.pipeline import Stage, StageGraph
+
+    return StageGraph([Stage.from_dict(s) for s in stages], app_configs=app_configs)
+
+
+def test_stage_graph_defaults_upstream_to_previous_stage():
+    from kbmod_wf.pipeline import MANIFEST
+
+    graph = _graph([{"name": "a"}, {"name": "b"}, {"name": "c", "upstream": "a"}])
+
+    assert [stage.upstream for stage in graph.stages] == [MANIFEST, "a", "a"]
+    assert graph.downstream == {"a": ["b", "c"], "b": [], "c": []}
+    assert graph.is_leaf(graph.stage("b")) and not graph.is_leaf(graph.stage("a"))
+
+
+@pytest.mark.parametrize(
+    "stages, match",
+    [
+        ([], "at least one stage"),
+        ([{"name": "a"}, {"name": "a"}], "declared more than once"),
+        ([{"name": "a", "upstream": "b"}, {"name": "b"}], "after its upstream"),
+        ([{"name": "a", "inputs": ["nope"]}], "unknown input"),
+        ([{"name": "a", "max_in_flight": 0}], "max_in_flight"),
+        ([{"name": "a", "fuse": True}], "no upstream stage"),
+        ([{"name": "a"}, {"name": "b", "fuse": True}, {"name": "c", "upstream": "a"}], "also used by"),
+    ],
+)
+def test_stage_graph_rejects_invalid_graphs(stages, match):
+    with pytest.raises(ValueError, match=match):
+        _graph(stages)
+
+
+def test_stage_graph_expands_fan_out():
+    graph = _graph(
+        [
+            {"name": "a", "output": "{upstream}.a"},
+            {"name": "b", "fan_out": "d", "output": "{upstream}.{fan_out}.b"},
+            {"name": "c", "output": "{upstream}.c"},
+        ],
+        app_configs={"b": {"d": [1, 2]}},
+    )
+
+    tasks = list(graph.expand("x"))
+
+    assert [(task.stage.name, task.output_filepath) for task in tasks] == [
+        ("a", "x.a"),
+        ("b", "x.a.1.b"),
+        ("b", "x.a.2.b"),
+        ("c", "x.a.1.b.c"),
+        ("c", "x.a.2.b.c"),
+    ]
+    # Each task consumes the output of the task before it in its chain.
+    assert tasks[3].upstream is tasks[1] and tasks[4].upstream is tasks[2]
+    assert tasks[1].upstream is tasks[0] and tasks[0].upstream is None
+    assert all(task.source_filepath == "x" for task in tasks)
+
+
+def test_stage_graph_groups_fan_out():
+    graph = _graph(
+        [{"name": "a", "fan_out": [1, 2], "group_fan_out": True, "output": "{upstream}.{fan_out}"}]
+    )
+
+    tasks = list(graph.expand("x"))
+
+    assert len(tasks) == 2
+    assert tasks[0].group is tasks[1].group
+    assert [t.fan_out for t in tasks[0].group] == [1, 2]
+
+
+def test_stage_graph_validate_requires_fan_out_values():
+    graph = _graph([{"name": "a", "fan_out": "d"}])
+
+    with pytest.raises(ValueError, match="No 'd' were provided"):
+        graph.validate()
+
+
+def test_stage_graph_validate_rejects_fusing_a_fan_out():
+    graph = _graph([{"name": "a"}, {"name": "b", "fuse": True, "fan_out": [1, 2]}])
+
+    with pytest.raises(ValueError, match="fans out over 2 values"):
+        graph.validate()
+
+
+def _pipeline(stages, app_configs=None):
+    from kbmod_wf.pipeline import Pipeline
+
+    return Pipeline(_graph(stages, app_configs))
+
+
+def test_pipeline_chains_stages(dfk, stub_apps, manifest):
+    manifest_filepath, entries = manifest
+    pipeline = _pipeline(
+        [
+            {"name": "a", "app": "copy_stage", "output": "{upstream}.a"},
+            {
+                "name": "b",
+                "app": "copy_stage",
+                "fan_out": [1, 2],
+                "inputs": ["upstream", "fan_out"],
+                "output": "{upstream}.{fan_out}.b",
+            },
+        ]
+    )
+
+    results, failures = pipeline.run(manifest_filepath)
+
+    assert failures == []
+    assert sorted(r.filepath for r in results) == sorted(
+        f"{entry}.a.{value}.b" for entry in entries for value in (1, 2)
+    )
+    with open(f"{entries[0]}.a.2.b", "r") as f:
+        assert f.read().split("\n") == ["entry0", "entry0.collection.a", "entry0.collection.a.2.b"]
+
+
+def test_pipeline_grouped_fan_out_runs_one_task(dfk, stub_apps, manifest):
+    manifest_filepath, entries = manifest
+    pipeline = _pipeline(
+        [
+            {
+                "name": "a",
+                "app": "copy_stage",
+                "fan_out": [1, 2],
+                "group_fan_out": True,
+                "output": "{upstream}.{fan_out}",
+            },
+            {"name": "b", "app": "copy_stage", "output": "{upstream}.b"},
+        ]
+    )
+
+    results, failures = pipeline.run(manifest_filepath)
+
+    assert failures == [] and len(results) == 6
+    # Every output of the grouped task is written by the same call.
+    assert len(stub_apps.calls) == 3 * 2 + 6
+    for entry in entries:
+        assert (
+            stub_apps.calls.index(f"{entry.split('/')[-1]}.2")
+            == stub_apps.calls.index(f"{entry.split('/')[-1]}.1") + 1
+        )
+
+
+def test_pipeline_failure_only_fails_its_own_chain(dfk, stub_apps, manifest):
+    manifest_filepath, _ = manifest
+    pipeline = _pipeline(
+        [
+            {"name": "a", "app": "copy_stage", "output": "{upstream}.a"},
+            {"name": "b", "app": "copy_stage", "output": "{upstream}.b"},
+        ],
+        app_configs={"a": {"fail": "entry1"}},
+    )
+
+    results, failures = pipeline.run(manifest_filepath)
+
+    assert len(results) == 2 and len(failures) == 1
+
+
+def test_pipeline_limits_tasks_in_flight(dfk, stub_apps, manifest, monkeypatch):
+    import threading
+    import time
+
+    from parsl import python_app
+
+    from kbmod_wf import workflow_tasks
+
+    lock = threading.Lock()
+    running = [0, 0]  # current, most
+
+    @python_app(executors=["local_dev_testing"])
+    def slow_stage(inputs=(), outputs=(), runtime_config=None, logging_file=None, logging_config=None):
+        with lock:
+            running[0] += 1
+            running[1] = max(running)
+        time.sleep(0.1)
+        with lock:
+            running[0] -= 1
+        return outputs[0]
+
+    monkeypatch.setattr(workflow_tasks, "slow_stage", slow_stage, raising=False)
+    manifest_filepath, _ = manifest
+    pipeline = _pipeline([{"name": "a", "app": "slow_stage", "max_in_flight": 1, "output": "{upstream}.a"}])
+
+    results, failures = pipeline.run(manifest_filepath)
+
+    assert len(results) == 3 and failures == []
+    assert running[1] == 1
+
+
+def test_pipeline_limit_only_holds_back_its_own_stage(dfk, stub_apps, manifest, monkeypatch):
+    import threading
+    import time
+
+    from parsl import python_app
+
+    from kbmod_wf import workflow_tasks
+
+    release = threading.Event()
+
+    @python_app(executors=["local_dev_testing"])
+    def blocked_stage(inputs=(), outputs=(), runtime_config=None, logging_file=None, logging_config=None):
+        release.wait(timeout=10)
+        return outputs[0]
+
+    monkeypatch.setattr(workflow_tasks, "blocked_stage", blocked_stage, raising=False)
+    _, entries = manifest
+    pipeline = _pipeline(
+        [
+            {"name": "a", "app": "copy_stage", "output": "{upstream}.a"},
+            {"name": "b", "app": "blocked_stage", "max_in_flight": 1, "output": "{upstream}.b"},
+        ]
+    )
+
+    submitter = threading.Thread(target=lambda: [pipeline.submit(entry) for entry in entries])
+    submitter.start()
+    deadline = time.monotonic() + 5
+    while len(stub_apps.calls) < len(entries) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # The upstream task of every entry ran while the first "b" held the stage's only slot.
+    n_upstream = len(stub_apps.calls)
+    release.set()
+    submitter.join()
+    results, failures = wait_for_futures(pipeline.leaf_futures)
+
+    assert n_upstream == len(entries)
+    assert failures == [] and sorted(r.filepath for r in results) == sorted(f"{e}.a.b" for e in entries)
+
+
+def test_pipeline_limit_passes_on_failures(dfk, stub_apps, manifest):
+    manifest_filepath, _ = manifest
+    pipeline = _pipeline(
+        [
+            {"name": "a", "app": "copy_stage", "max_in_flight": 1, "output": "{upstream}.a"},
+            {"name": "b", "app": "copy_stage", "max_in_flight": 1, "output": "{upstream}.b"},
+        ],
+        app_configs={"a": {"fail": "entry1"}},
+    )
+
+    results, failures = pipeline.run(manifest_filepath)
+
+    assert len(results) == 2 and len(failures) == 1
+
+
+def test_pipeline_run_batches_skips_repeated_entries(dfk, stub_apps, manifest):
+    _, entries = manifest
+    pipeline = _pipeline([{"name": "a", "app": "copy_stage", "output": "{upstream}.a"}])
+
+    results, failures = pipeline.run_batches([entries[:2], entries[1:]])
+
+    assert failures == [] and len(results) == 3
+    assert sorted(stub_apps.calls) == sorted(f"entry{i}.collection.a" for i in range(3))
+
+
+def test_pipeline_rejects_unknown_app(dfk):
+    with pytest.raises(ValueError, match="Unknown app"):
+        _pipeline([{"name": "a", "app": "no_such_app"}])
+
+
+def test_pipeline_records_the_time_spent_running_each_task(dfk, stub_apps, manifest, monkeypatch):
+    import time
+
+    from parsl import python_app
+
+    from kbmod_wf import workflow_tasks
+    from kbmod_wf.pipeline import Pipeline
+    from kbmod_wf.utilities.cost_model_utilities import CostModel
+
+    @python_app(executors=["local_dev_testing"])
+    def slow_stage(inputs=(), outputs=(), runtime_config=None, logging_file=None, logging_config=None):
+        time.sleep(0.05)
+        return outputs[0]
+
+    monkeypatch.setattr(workflow_tasks, "slow_stage", slow_stage, raising=False)
+    cost_model = CostModel()
+    recorded = []
+    monkeypatch.setattr(cost_model, "record", lambda stage, entry, seconds: recorded.append(seconds))
+    manifest_filepath, _ = manifest
+    graph = _graph(
+        [{"name": "a", "app": "slow_stage", "fan_out": list(range(8)), "output": "{upstream}.{fan_out}"}]
+    )
+
+    results, failures = Pipeline(graph, cost_model=cost_model).run(manifest_filepath)
+
+    assert len(results) == 24 and failures == []
+    # 24 tasks ran on 4 threads, the time the later ones waited for a thread isn't included.
+    assert len(recorded) == 24
+    assert all(0.05 <= seconds < 0.15 for seconds in recorded)
+
+
+def test_plan_workflow_reads_the_timings_recorded_by_run_workflow(
+    tmp_path, manifest, resource_config, stub_apps
+):
+    from kbmod_wf.planner import plan_workflow
+
+    runtime_config = _runtime_config(tmp_path)
+    runtime_config["cost_model"] = {"enabled": True}
+    default_stages = [{"name": "copy", "app": "copy_stage", "output": "{upstream}.out"}]
+
+    # Without any timings, each entry's single image is predicted from the default estimates.
+    plan = plan_workflow(runtime_config=runtime_config, default_stages=default_stages)
+    assert all(task["seconds"] > 1 for task in plan.tasks)
+
+    run_workflow(runtime_config=runtime_config, default_stages=default_stages)
+    assert (tmp_path / "runinfo" / "task_timings.jsonl").exists()
+
+    plan = plan_workflow(runtime_config=runtime_config, default_stages=default_stages)
+    assert len(plan.tasks) == 3
+    assert all(task["seconds"] < 1 for task in plan.tasks)
+
+
+def test_pipeline_only_fuses_fusable_apps(dfk, stub_apps):
+    with pytest.raises(ValueError, match="can not be fused"):
+        _pipeline([{"name": "a", "app": "copy_stage"}, {"name": "b", "app": "copy_stage", "fuse": True}])
+
+
+@pytest.mark.parametrize("file_identity", ["path", "stat"])
+def test_run_workflow_reruns_after_cleanup(tmp_path, manifest, resource_config, stub_apps, file_identity):
+    from kbmod_wf.utilities.checkpoint_utilities import SQLiteMemoizer
+
+    resource_config.memoizer = SQLiteMemoizer(db_filepath=str(tmp_path / "checkpoints.sqlite"))
+    runtime_config = _runtime_config(tmp_path)
+    runtime_config["memoization"] = {"file_identity": file_identity}
+    default_stages = [
+        {"name": "a", "app": "copy_stage", "output": "{upstream}.a", "cleanup": True},
+        {"name": "b", "app": "copy_stage", "output": "{upstream}.b"},
+    ]
+    expected = [str(tmp_path / "staged" / f"entry{i}.collection.a.b") for i in range(3)]
+
+    results = run_workflow(runtime_config=runtime_config, default_stages=default_stages)
+    assert sorted(r.filepath for r in results) == expected
+    assert not (tmp_path / "staged" / "entry0.collection.a").exists()
+
+    assert len(stub_apps.calls) == 6
+
+    # The finished entries are not resubmitted, so the cleaned up outputs of "a" are not remade.
+    results = run_workflow(runtime_config=runtime_config, default_stages=default_stages)
+    assert sorted(r.filepath for r in results) == expected
+    assert len(stub_apps.calls) == 6
+
+    # The checkpointed outputs of "a" were cleaned up, so it is rerun for any "b" that must run again.
+    (tmp_path / "staged" / "entry0.collection.a.b").unlink()
+    results = run_workflow(runtime_config=runtime_config, default_stages=default_stages)
+    assert sorted(r.filepath for r in results) == expected
+    assert sorted(stub_apps.calls[6:]) == ["entry0.collection.a", "entry0.collection.a.b"]
+    assert (tmp_path / "staged" / "entry0.collection.a.b").exists()
+    assert not (tmp_path / "staged" / "entry0.collection.a").exists()
+
+
+def test_pipeline_skips_completed_entries_only_with_cleanup(dfk, stub_apps, manifest):
+    manifest_filepath, entries = manifest
+    stages = [
+        {"name": "a", "app": "copy_stage", "output": "{upstream}.a"},
+        {"name": "b", "app": "copy_stage", "output": "{upstream}.b"},
+    ]
+    pipeline = _pipeline(stages)
+    pipeline.submit(entries[0])
+    wait_for_futures(pipeline.leaf_futures)
+
+    # Without cleanup the checkpoints decide what runs again.
+    assert not _pipeline(stages).skip_completed
+
+    stages[0]["cleanup"] = True
+    pipeline = _pipeline(stages)
+    assert pipeline.skip_completed
+    pipeline.submit(entries[0])
+    pipeline.submit(entries[1])
+    results, failures = wait_for_futures(pipeline.leaf_futures)
+
+    assert sorted(r.filepath for r in results) == [f"{entry}.a.b" for entry in entries[:2]]
+    assert pipeline.n_completed == 1
+    assert stub_apps.calls == [
+        "entry0.collection.a",
+        "entry0.collection.a.b",
+        "entry1.collection.a",
+        "entry1.collection.a.b",
+    ]
+
+
+def test_run_workflow_cleans_up_when_it_fails_to_start(tmp_path, manifest, resource_config, stub_apps):
+    import parsl
+    from parsl.errors import NoDataFlowKernelError
+
+    runtime_config = _runtime_config(tmp_path)
+    runtime_config["apps"]["create_manifest"] = {"streaming": True}
+    cleanups = []
+    resource_config.executors[0].shutdown = lambda *args, **kwargs: cleanups.append(True)
+
+    with pytest.raises(ValueError, match="No staging_directory"):
+        run_workflow(
+            runtime_config=runtime_config,
+            default_stages=[{"name": "copy", "app": "copy_stage", "output": "{upstream}.out"}],
+        )
+
+    assert cleanups == [True]
+    with pytest.raises(NoDataFlowKernelError):
+        parsl.dfk()
@@ -0,0 +1,52 @@
+import threading
+import types
+
+from kbmod_wf.utilities import profiling_utilities
+from kbmod_wf.utilities.profiling_utilities import StackSampler, task_profile
+
+
+def _profiled_task(output_filepath, started, errors):
+    try:
+        with task_profile("task", output_filepath, profile_config={"interval": 0.001}):
+            started.wait(timeout=5)
+            sum(i * i for i in range(100000))
+    except Exception as e:
+        errors.append(e)
+
+
+def test_profiled_tasks_can_run_at_the_same_time(tmp_path):
+    started = threading.Barrier(2)
+    errors = []
+    outputs = [tmp_path / "a.out", tmp_path / "b.out"]
+    threads = [threading.Thread(target=_profiled_task, args=(str(o), started, errors)) for o in outputs]
+
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert errors == []
+    assert all((tmp_path / f"{o.name}.collapsed").exists() for o in outputs)
+
+
+def test_task_profile_falls_back_to_sampling(tmp_path, monkeypatch):
+    class Profile:
+        def enable(self):
+            raise ValueError("Another profiling tool is already active")
+
+    monkeypatch.setattr(profiling_utilities, "cProfile", types.SimpleNamespace(Profile=Profile))
+
+    with task_profile("task", str(tmp_path / "a.out"), profile_config=True) as profiler:
+        assert isinstance(profiler, StackSampler)
+
+    assert (tmp_path / "a.out.collapsed").exists()
+    assert not (tmp_path / "a.out.pstats").exists()
+
+
+def test_task_profile_only_profiles_one_in_every(tmp_path):
+    with task_profile("task", str(tmp_path / "a.out"), profile_config=None) as profiler:
+        assert profiler is None
+
+    profiled = [profiling_utilities.is_profiled(f"{i}.out", 4) for i in range(400)]
+    assert 50 < sum(profiled) < 150
+    assert profiled == [profiling_utilities.is_profiled(f"{i}.out", 4) for i in range(400)]